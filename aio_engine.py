@@ -0,0 +1,369 @@
+import asyncio
+import logging
+import ssl
+import threading
+import time
+import urllib.request
+import zlib
+from concurrent.futures import Future
+from concurrent.futures.thread import ThreadPoolExecutor
+from datetime import timedelta
+from typing import Optional, Callable, Dict, Tuple, List, Awaitable, Set
+from urllib.parse import urlsplit, urljoin
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from config import USE_ASYNCIO_ENGINE
+from http_engine import HttpEngine
+
+log = logging.getLogger(__name__)
+
+MAX_REDIRECTS = 10
+# Requests which may be sent again if a kept-alive connection turns out to have been closed.
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE', 'TRACE'}
+READ_SIZE = 64 * 1024
+DEFAULT_HEADERS = {
+    'User-Agent': requests.utils.default_user_agent(),
+    'Accept-Encoding': 'gzip, deflate',
+    'Accept': '*/*',
+    'Connection': 'keep-alive',
+}
+
+
+class EngineResponse:
+    """The parts of a response the request engines hand back, elapsed covers the whole exchange including the body."""
+
+    def __init__(self,
+                 url: str,
+                 status_code: int,
+                 reason: str,
+                 headers: CaseInsensitiveDict,
+                 content: bytes,
+                 elapsed: timedelta):
+        self.url = url
+        self.status_code = status_code
+        self.reason = reason
+        self.headers = headers
+        self.content = content
+        self.elapsed = elapsed
+
+    @property
+    def ok(self) -> bool:
+        return self.status_code < 400
+
+
+class ThreadedHttpEngine:
+    """Sends requests from a thread pool, one thread per request in flight."""
+
+    def __init__(self, concurrency: int):
+        self.http_engine = HttpEngine(max_connections_per_host=concurrency, idle_timeout=0)
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='request-engine')
+
+    def submit(self, method: str, url: str, callback: Callable[[Future], None] = None, **kwargs) -> Future:
+        """Sends a request, callback is called from the engine's thread once it's done, never from the caller's."""
+        future = Future()
+        if callback:
+            future.add_done_callback(callback)
+        self._executor.submit(self._send, future, method, url, kwargs)
+        return future
+
+    def _send(self, future: Future, method: str, url: str, kwargs: Dict):
+        if not future.set_running_or_notify_cancel():
+            return
+        start = time.perf_counter()
+        try:
+            res = self.http_engine.request(method, url, **kwargs)
+            content = res.content
+            future.set_result(EngineResponse(res.url, res.status_code, res.reason, res.headers, content,
+                                             timedelta(seconds=time.perf_counter() - start)))
+        except Exception as e:
+            future.set_exception(e)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        self.http_engine.close()
+
+
+class _Connection:
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+
+    def is_usable(self) -> bool:
+        return not (self.writer.is_closing() or self.reader.at_eof())
+
+    def close(self):
+        self.writer.close()
+
+
+class _HostPool:
+    def __init__(self, max_connections: int):
+        self.semaphore = asyncio.Semaphore(max_connections)
+        self.idle: List[_Connection] = []
+
+
+class AsyncHttpEngine:
+    """
+    Sends requests from an asyncio event loop running in its own thread, next to the gtk main loop.
+
+    Each request in flight is a coroutine instead of a thread, so thousands can be
+    in flight at once. Connections are kept alive and pooled per host. This is a
+    minimal http/1.1 client: it supports redirects, chunked and compressed
+    bodies, but not proxies, see create_request_engine.
+    """
+
+    def __init__(self, max_connections_per_host: int = 256, max_in_flight: int = 10000):
+        self.max_connections_per_host = max_connections_per_host
+        self.max_in_flight = max_in_flight
+        self._ssl_context = ssl.create_default_context(cafile=requests.certs.where())
+        self._pools: Dict[Tuple[str, str, int], _HostPool] = {}
+        self._in_flight: Optional[asyncio.Semaphore] = None
+        # The loop only keeps weak references to tasks, one nothing else refers to can be collected mid request.
+        self._tasks: Set[asyncio.Task] = set()
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run_loop, name='async-http-engine', daemon=True)
+        self._thread.start()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._loop.run_forever()
+        finally:
+            self._loop.close()
+
+    def submit(self, method: str, url: str, callback: Callable[[Future], None] = None, **kwargs) -> Future:
+        """Sends a request, callback is called from the engine's thread once it's done, never from the caller's."""
+        future = Future()
+        if callback:
+            future.add_done_callback(callback)
+        self._loop.call_soon_threadsafe(self._start, future, method, url, kwargs)
+        return future
+
+    def _start(self, future: Future, method: str, url: str, kwargs: Dict):
+        if not future.set_running_or_notify_cancel():
+            return
+
+        def transfer(task: asyncio.Task):
+            if task.cancelled():
+                future.cancel()
+            elif task.exception():
+                future.set_exception(task.exception())
+            else:
+                future.set_result(task.result())
+
+        task = self._loop.create_task(self.request(method, url, **kwargs))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        task.add_done_callback(transfer)
+
+    async def request(self,
+                      method: str,
+                      url: str,
+                      params=None,
+                      headers: Dict[str, str] = None,
+                      data=None,
+                      timeout: Tuple[float, float] = None) -> EngineResponse:
+        if self._in_flight is None:
+            self._in_flight = asyncio.Semaphore(self.max_in_flight)
+
+        connect_timeout, read_timeout = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+        prepared = requests.Request(method, url, params=params, headers=headers, data=data).prepare()
+
+        async with self._in_flight:
+            start = time.perf_counter()
+            for _ in range(MAX_REDIRECTS + 1):
+                status, reason, res_headers, content = await self._send(prepared, connect_timeout, read_timeout)
+                location = res_headers.get('location')
+                if status not in {301, 302, 303, 307, 308} or not location:
+                    return EngineResponse(prepared.url, status, reason, res_headers, content,
+                                          timedelta(seconds=time.perf_counter() - start))
+
+                prepared = _rebuild_redirect(prepared, status, location)
+
+        raise requests.TooManyRedirects(f'Exceeded {MAX_REDIRECTS} redirects.')
+
+    async def _send(self, prepared: requests.PreparedRequest, connect_timeout: float, read_timeout: float):
+        parts = urlsplit(prepared.url)
+        https = parts.scheme == 'https'
+        host, port = parts.hostname, parts.port or (443 if https else 80)
+        pool = self._pools.get((parts.scheme, host, port))
+        if not pool:
+            pool = self._pools[(parts.scheme, host, port)] = _HostPool(self.max_connections_per_host)
+
+        async with pool.semaphore:
+            while pool.idle:
+                conn = pool.idle.pop()
+                if conn.is_usable():
+                    try:
+                        return await self._exchange(pool, conn, prepared, parts, read_timeout)
+                    except (ConnectionError, asyncio.IncompleteReadError):
+                        # The server closed the kept-alive connection, retry on a new one, unless
+                        # the server may have acted on the request already and it's unsafe to repeat.
+                        conn.close()
+                        if prepared.method not in IDEMPOTENT_METHODS:
+                            raise
+
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(host, port, ssl=self._ssl_context if https else None,
+                                        server_hostname=host if https else None),
+                connect_timeout)
+            return await self._exchange(pool, _Connection(reader, writer), prepared, parts, read_timeout)
+
+    async def _exchange(self, pool: _HostPool, conn: _Connection, prepared: requests.PreparedRequest, parts,
+                        read_timeout: float):
+        body = prepared.body or b''
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+
+        headers = CaseInsensitiveDict(DEFAULT_HEADERS)
+        headers['Host'] = parts.netloc
+        headers.update(prepared.headers)
+        if body or prepared.method in {'POST', 'PUT', 'PATCH'}:
+            headers['Content-Length'] = str(len(body))
+
+        target = (parts.path or '/') + (f'?{parts.query}' if parts.query else '')
+        head = f'{prepared.method} {target} HTTP/1.1\r\n' + ''.join(f'{k}: {v}\r\n' for k, v in headers.items())
+        try:
+            conn.writer.write(head.encode('latin-1') + b'\r\n' + body)
+            await conn.writer.drain()
+            status, reason, res_headers, content, keep_alive = await self._read_response(
+                conn.reader, prepared.method, read_timeout)
+        except BaseException:
+            conn.close()
+            raise
+
+        if keep_alive and conn.is_usable():
+            pool.idle.append(conn)
+        else:
+            conn.close()
+
+        return status, reason, res_headers, content
+
+    async def _read_response(self, reader: asyncio.StreamReader, method: str, read_timeout: Optional[float]):
+        """Reads a response, read_timeout bounds each read, like requests' read timeout, not the whole body."""
+
+        def timed(read: Awaitable):
+            return asyncio.wait_for(read, read_timeout)
+
+        status_line = await timed(reader.readline())
+        if not status_line:
+            raise ConnectionResetError('Connection closed before a response was received')
+
+        version, status, reason = (status_line.decode('latin-1').rstrip('\r\n').split(' ', 2) + [''])[:3]
+        status = int(status)
+        headers = CaseInsensitiveDict()
+        while True:
+            line = (await timed(reader.readline())).decode('latin-1').rstrip('\r\n')
+            if not line:
+                break
+            key, _, val = line.partition(':')
+            val = val.strip()
+            headers[key] = f'{headers[key]}, {val}' if key in headers else val
+
+        connection = headers.get('connection', '').lower()
+        keep_alive = connection == 'keep-alive' if version == 'HTTP/1.0' else connection != 'close'
+
+        if method == 'HEAD' or status in {204, 304} or 100 <= status < 200:
+            content = b''
+        elif 'chunked' in headers.get('transfer-encoding', '').lower():
+            chunks = []
+            while True:
+                size = int((await timed(reader.readline())).split(b';')[0].strip(), 16)
+                if not size:
+                    break
+                chunks.append(await self._read_exactly(reader, size, read_timeout))
+                await timed(reader.readexactly(2))
+            while (await timed(reader.readline())).strip():  # Trailers
+                pass
+            content = b''.join(chunks)
+        elif 'content-length' in headers:
+            content = await self._read_exactly(reader, int(headers['content-length']), read_timeout)
+        else:
+            chunks = []
+            while True:
+                chunk = await timed(reader.read(READ_SIZE))
+                if not chunk:
+                    break
+                chunks.append(chunk)
+            content = b''.join(chunks)
+            keep_alive = False
+
+        encoding = headers.get('content-encoding', '').lower()
+        if encoding in {'gzip', 'deflate'} and content:
+            content = _decompress(content, encoding)
+
+        return status, reason, headers, content, keep_alive
+
+    @staticmethod
+    async def _read_exactly(reader: asyncio.StreamReader, size: int, read_timeout: Optional[float]) -> bytes:
+        chunks, remaining = [], size
+        while remaining:
+            chunk = await asyncio.wait_for(reader.read(min(remaining, READ_SIZE)), read_timeout)
+            if not chunk:
+                raise asyncio.IncompleteReadError(b''.join(chunks), size)
+            chunks.append(chunk)
+            remaining -= len(chunk)
+        return b''.join(chunks)
+
+    def close(self):
+        if not self._loop.is_running():
+            return
+        self._loop.call_soon_threadsafe(self._close)
+        # The engine may be closed from one of its own callbacks, which run on the loop thread.
+        if threading.current_thread() is not self._thread:
+            self._thread.join(5)
+
+    def _close(self):
+        for pool in self._pools.values():
+            for conn in pool.idle:
+                conn.close()
+            pool.idle.clear()
+        self._loop.stop()
+
+
+def _rebuild_redirect(prepared: requests.PreparedRequest, status: int, location: str) -> requests.PreparedRequest:
+    """The request to send on to location, rebuilt the way requests' Session.resolve_redirects does."""
+    redirect = prepared.copy()
+    redirect.url = urljoin(prepared.url, location)
+    if status == 303 or (status in {301, 302} and prepared.method == 'POST'):
+        redirect.method = 'GET'
+        for header in ('Content-Length', 'Transfer-Encoding', 'Content-Type'):
+            redirect.headers.pop(header, None)
+        redirect.prepare_body(None, None)
+    if urlsplit(redirect.url).hostname != urlsplit(prepared.url).hostname:
+        # Credentials aren't sent on to another host.
+        for header in ('Authorization', 'Cookie'):
+            redirect.headers.pop(header, None)
+    return redirect
+
+
+def _decompress(content: bytes, encoding: str) -> bytes:
+    if encoding == 'gzip':
+        return zlib.decompress(content, 16 + zlib.MAX_WBITS)
+    try:
+        return zlib.decompress(content)
+    except zlib.error:
+        return zlib.decompress(content, -zlib.MAX_WBITS)  # Raw deflate, without the zlib header
+
+
+def create_request_engine(concurrency: int):
+    """
+    Creates the engine for sending many requests at once.
+
+    Prefers the asyncio engine, which doesn't need a thread per request in flight.
+    Falls back to a thread pool of concurrency threads when it's disabled or
+    can't be used, e.g. when a proxy is configured, which it doesn't support.
+    """
+    if not USE_ASYNCIO_ENGINE:
+        return ThreadedHttpEngine(concurrency)
+    if urllib.request.getproxies():
+        log.info('Proxies are configured, using the threaded request engine.')
+        return ThreadedHttpEngine(concurrency)
+
+    try:
+        return AsyncHttpEngine(max_connections_per_host=concurrency)
+    except Exception as e:
+        log.warning('asyncio request engine unavailable, falling back to threads: %s', e)
+        return ThreadedHttpEngine(concurrency)
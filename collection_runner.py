@@ -0,0 +1,182 @@
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from typing import List, Callable, Optional, Dict, Any
+
+from aio_engine import create_request_engine
+from models import RequestTreeNode, RequestModel
+from pool import CompletionBatcher
+from utils import format_request_url
+
+log = logging.getLogger(__name__)
+
+DEFAULT_CONCURRENCY = 16
+
+
+class RunResult:
+    def __init__(self,
+                 node_pk: str,
+                 status_code: Optional[int] = None,
+                 reason: str = '',
+                 elapsed: float = 0.0,
+                 size: int = 0,
+                 error: Optional[str] = None):
+        self.node_pk = node_pk
+        self.status_code = status_code
+        self.reason = reason
+        self.elapsed = elapsed
+        self.size = size
+        self.error = error
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and self.status_code < 400
+
+
+def request_kwargs(req: RequestModel) -> Dict[str, Any]:
+    """Arguments for HttpEngine.request to send a saved request."""
+    return {
+        'params': [(k, v) for k, v, _ in req.params if k],
+        'headers': {k: v for k, v, _ in req.request_headers if k},
+        'data': req.request_body.encode('utf-8') if req.request_body else None,
+        'timeout': (req.connect_timeout, req.read_timeout),
+    }
+
+
+class CollectionRun:
+    """
+    Runs every request in a set of request trees.
+
+    Children of a folder run in parallel, unless the folder is ordered, in which
+    case each child (and the whole subtree under it) finishes before the next starts.
+    Scheduling is driven by completions, so workers never block waiting on each
+    other and the run takes as long as its critical path, not the sum of its latencies.
+
+    Results are handed to on_results in batches as they arrive, on_finished is
+    called with all of them once the run is over. Requests of nodes which weren't
+    loaded are taken from requests, see RequestLoader.
+    """
+
+    def __init__(self,
+                 nodes: List[RequestTreeNode],
+                 on_results: Callable[[List[RunResult]], None] = None,
+                 on_finished: Callable[[List[RunResult]], None] = None,
+                 ordered: bool = False,
+                 concurrency: int = DEFAULT_CONCURRENCY,
+                 report_interval: float = 0.1,
+                 requests: Dict[str, RequestModel] = None):
+        self.nodes = nodes
+        self.requests = requests or {}
+        self.ordered = ordered
+        self.on_finished = on_finished
+        self.results: List[RunResult] = []
+        self.elapsed = 0.0
+
+        self.engine = create_request_engine(concurrency)
+        self._batcher = CompletionBatcher(on_results or (lambda results: None), report_interval)
+        self._lock = threading.Lock()
+        self._cancelled = threading.Event()
+        self._finished = threading.Event()
+        self._start_time = 0.0
+
+    def start(self):
+        log.info('Running %d requests', sum(1 for _ in iter_requests(self.nodes)))
+        self._start_time = time.monotonic()
+        self._run_nodes(self.nodes, self.ordered, self._finish)
+
+    def run(self) -> List[RunResult]:
+        self.start()
+        return self.wait()
+
+    def wait(self, timeout: float = None) -> List[RunResult]:
+        self._finished.wait(timeout)
+        return self.results
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def _run_nodes(self, nodes: List[RequestTreeNode], ordered: bool, done: Callable[[], None]):
+        if not nodes:
+            done()
+            return
+
+        if ordered:
+            def run_from(idx: int):
+                if idx < len(nodes) and self._cancelled.is_set():
+                    # Skip the rest without recursing through each of them.
+                    for node in iter_requests(nodes[idx:]):
+                        self._record(RunResult(node.pk, error='Cancelled'))
+                    idx = len(nodes)
+
+                if idx == len(nodes):
+                    done()
+                else:
+                    self._run_node(nodes[idx], lambda: run_from(idx + 1))
+
+            run_from(0)
+            return
+
+        remaining = [len(nodes)]
+
+        def child_done():
+            with self._lock:
+                remaining[0] -= 1
+                finished = not remaining[0]
+            if finished:
+                done()
+
+        for node in nodes:
+            self._run_node(node, child_done)
+
+    def _run_node(self, node: RequestTreeNode, done: Callable[[], None]):
+        if node.is_folder():
+            self._run_nodes(node.children, node.folder.ordered, done)
+        elif self._cancelled.is_set():
+            self._record(RunResult(node.pk, error='Cancelled'))
+            done()
+        elif not node.request and node.pk not in self.requests:
+            self._record(RunResult(node.pk, error='Request not found'))
+            done()
+        else:
+            # The engine calls back from its own thread, so long ordered chains don't recurse on one stack.
+            req = node.request or self.requests[node.pk]
+            start = time.perf_counter()
+            self.engine.submit(req.method, format_request_url(req.url),
+                               lambda future: self._handle_response(node, future, start, done),
+                               **request_kwargs(req))
+
+    def _handle_response(self, node: RequestTreeNode, future: Future, start: float, done: Callable[[], None]):
+        try:
+            res = future.result()
+            result = RunResult(node.pk, res.status_code, res.reason, res.elapsed.total_seconds(), len(res.content))
+        except Exception as e:
+            log.debug('Request %s failed during run: %s', node.name, e)
+            result = RunResult(node.pk, elapsed=time.perf_counter() - start, error=str(e) or type(e).__name__)
+
+        try:
+            self._record(result)
+        finally:
+            done()
+
+    def _record(self, result: RunResult):
+        with self._lock:
+            self.results.append(result)
+        self._batcher.add(result)
+
+    def _finish(self):
+        self.elapsed = time.monotonic() - self._start_time
+        self._batcher.flush()
+        self.engine.close()
+        log.info('Finished running %d requests in %.2fs', len(self.results), self.elapsed)
+        self._finished.set()
+        if self.on_finished:
+            self.on_finished(self.results)
+
+
+def iter_requests(nodes: List[RequestTreeNode]):
+    for node in nodes:
+        if node.is_folder():
+            yield from iter_requests(node.children)
+        else:
+            yield node
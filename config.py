@@ -4,3 +4,41 @@ APP_NAME = 'repose'
 APP_AUTHOR = 'Benjamin Quinn'
 
 DATA_DIR = appdirs.user_data_dir(APP_NAME, APP_AUTHOR)
+
+# Response bodies larger than this are spilled from memory to a temporary file.
+RESPONSE_SPILL_THRESHOLD = 16 * 1024 * 1024
+RESPONSE_CHUNK_SIZE = 64 * 1024
+
+# Responses larger than this are pretty printed in a separate process, so they don't stall the ui.
+FORMAT_IN_PROCESS_THRESHOLD = 4 * 1024 * 1024
+# Responses larger than this aren't formatted, they're shown a window at a time by the large body viewer.
+LARGE_BODY_VIEWER_THRESHOLD = 8 * 1024 * 1024
+
+# Default per request timeouts in seconds, the deadline bounds the whole request including the body.
+DEFAULT_CONNECT_TIMEOUT = 10.0
+DEFAULT_READ_TIMEOUT = 60.0
+DEFAULT_REQUEST_DEADLINE = None
+
+# Send load tests and collection runs from an asyncio event loop instead of a thread per request.
+USE_ASYNCIO_ENGINE = True
+
+# Client side http cache, used by requests which opt in to it.
+HTTP_CACHE_DIR = f'{DATA_DIR}/http-cache'
+HTTP_CACHE_MAX_BYTES = 512 * 1024 * 1024
+HTTP_CACHE_MAX_ENTRIES = 10000
+
+# Request history, the oldest entries are dropped past either limit. Bodies larger than
+# HISTORY_MAX_BODY_SIZE are not kept, sizes are of the compressed bodies.
+HISTORY_MAX_ENTRIES = 5000
+HISTORY_MAX_BYTES = 256 * 1024 * 1024
+HISTORY_MAX_BODY_SIZE = 32 * 1024 * 1024
+HISTORY_FLUSH_INTERVAL = 0.5
+
+# Saves of collections and requests are written behind, merged into one transaction at most once per interval.
+SAVE_FLUSH_INTERVAL = 0.2
+# Requests in collections are loaded when they're opened or run, this many of the latest are kept loaded.
+LOADED_REQUESTS_MAX = 64
+# Request bodies at least this long are stored compressed, once per content, apart from the rest of the request.
+REQUEST_BODY_BLOB_SIZE = 64 * 1024
+# Reads of the store run concurrently on this many connections, writes run one at a time on another.
+DB_READ_CONNECTIONS = 3
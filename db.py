@@ -1,14 +1,20 @@
+import hashlib
+import itertools
 import json
 import logging
+import zlib
+from concurrent.futures import Executor, Future
 from concurrent.futures.thread import ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
-from typing import List, Iterable
-from collections import namedtuple
+from typing import List, Iterable, Optional, Tuple, Iterator, Dict, Callable, TextIO
+from collections import namedtuple, OrderedDict
 import sqlite3
 import threading
+import time
 
-from config import DATA_DIR
-from models import RequestModel, CollectionModel, RequestTreeNode, FolderModel
+from config import DATA_DIR, SAVE_FLUSH_INTERVAL, LOADED_REQUESTS_MAX, REQUEST_BODY_BLOB_SIZE, DB_READ_CONNECTIONS
+from models import RequestModel, CollectionModel, RequestTreeNode, FolderModel, HistoryEntry, RequestSummary
 
 
 db_local = threading.local()
@@ -16,45 +22,421 @@ db_local = threading.local()
 log = logging.getLogger(__name__)
 
 
-def initialize_db_thread(*args, **kwargs):
+def initialize_db_thread(path: str = None, read_only: bool = False):
     """Initialize each thread pool worker with its own db connection"""
     Path(DATA_DIR).mkdir(parents=True, exist_ok=True)
-    db_local.db = get_connection()
-    log.info('Initialized db in thread %s', threading.get_ident())
+    db_local.db = get_connection(path, read_only)
+    log.info('Initialized %s db in thread %s', 'read only' if read_only else 'writable', threading.get_ident())
 
 
-# Serialize all access to sqlite connection via this single threaded executor.
-# All access to sqlite should happen through the executor.
-DB_EXECUTOR = ThreadPoolExecutor(max_workers=1, initializer=initialize_db_thread)
+def reads(fn: Callable) -> Callable:
+    """Marks a function which only reads from the store, the DB_EXECUTOR runs it on a read connection."""
+    fn.reads = True
+    return fn
 
 
-def get_connection(path: str = None) -> sqlite3.Connection:
-    path = path or f'{DATA_DIR}/storage.db'
-    db = sqlite3.connect(path, 30.0)
-    try:
-        db.execute("""
-        create table collections (
+class StoreStats:
+    """Queue depth and wait times of one side of the store, a call waits from when it's submitted until it starts."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.max_queued = 0
+        self.running = 0
+        self.completed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record_submitted(self):
+        with self._lock:
+            self.queued += 1
+            self.max_queued = max(self.max_queued, self.queued)
+
+    def record_started(self, wait: float):
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+
+    def record_finished(self):
+        with self._lock:
+            self.running -= 1
+            self.completed += 1
+
+    @property
+    def mean_wait(self) -> float:
+        started = self.completed + self.running
+        return self.total_wait / started if started else 0.0
+
+    def format(self) -> str:
+        return f'{self.queued} queued (at most {self.max_queued}), {self.running} running, {self.completed} done, ' \
+               f'waited {self.mean_wait * 1000:.1f}ms on average, {self.max_wait * 1000:.1f}ms at most'
+
+
+class StoreExecutor(Executor):
+    """
+    Runs calls to the store, writes one at a time on the writable connection, reads concurrently on a pool
+    of read only connections, each thread has its connection in db_local.
+
+    Calls marked with @reads go to the readers, everything else to the writer, so a slow write doesn't hold
+    up loading the tree, searching or browsing history. In WAL mode readers aren't blocked by the writer,
+    they see what was committed when they started, so a read which must see a write that's in flight should
+    be submitted once it's done, see submit_after.
+    """
+
+    def __init__(self, readers: int = DB_READ_CONNECTIONS, path: str = None):
+        self.write_stats = StoreStats()
+        self.read_stats = StoreStats()
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-write',
+                                          initializer=initialize_db_thread, initargs=(path, False))
+        self._readers = ThreadPoolExecutor(max_workers=readers, thread_name_prefix='db-read',
+                                           initializer=initialize_db_thread, initargs=(path, True))
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        if getattr(fn, 'reads', False):
+            return self._submit(self._readers, self.read_stats, fn, *args, **kwargs)
+        return self._submit(self._writer, self.write_stats, fn, *args, **kwargs)
+
+    @staticmethod
+    def _submit(executor: ThreadPoolExecutor, stats: StoreStats, fn: Callable, *args, **kwargs) -> Future:
+        submitted = time.monotonic()
+
+        def run():
+            stats.record_started(time.monotonic() - submitted)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                stats.record_finished()
+
+        stats.record_submitted()
+        try:
+            return executor.submit(run)
+        except RuntimeError:
+            stats.record_started(0.0)
+            stats.record_finished()
+            raise
+
+    def shutdown(self, wait: bool = True, **kwargs):
+        self._readers.shutdown(wait, **kwargs)
+        self._writer.shutdown(wait, **kwargs)
+        log.info('Store writes: %s', self.write_stats.format())
+        log.info('Store reads: %s', self.read_stats.format())
+
+
+def submit_after(executor: Executor, future: Future, fn: Callable, *args, **kwargs) -> Future:
+    """Submits fn once future is done, e.g. a read which has to see a write. Future of what fn returns."""
+    result = Future()
+
+    def copy_result(done: Future):
+        if done.exception() is not None:
+            result.set_exception(done.exception())
+        else:
+            result.set_result(done.result())
+
+    def submit(_):
+        try:
+            executor.submit(fn, *args, **kwargs).add_done_callback(copy_result)
+        except Exception as e:
+            result.set_exception(e)
+
+    future.add_done_callback(submit)
+    return result
+
+
+# All access to sqlite happens through this executor, a thread's connection mustn't be used by another thread.
+DB_EXECUTOR = StoreExecutor()
+
+
+def _fts_values(row: str) -> str:
+    """What's indexed for a requests row, the same expressions must be used to remove it from the index."""
+    return f"""
+        {row}.name,
+        json_extract({row}.request_json, '$.url'),
+        (select group_concat(json_extract(value, '$[0]') || ' ' || json_extract(value, '$[1]'), ' ')
+         from json_each({row}.request_json, '$.request_headers')),
+        json_extract({row}.request_json, '$.request_body')
+    """
+
+
+# Each migration moves the schema up one version, the version is kept in PRAGMA user_version.
+# Append new migrations, never edit applied ones. The first one uses "if not exists", since
+# it's applied to stores created before versioning, which already have its tables.
+MIGRATIONS: List[Tuple[str, ...]] = [
+    (
+        """
+        create table if not exists collections (
             id text primary key,
             name text unique not null
-        );
-        """)
-
-        db.execute("""
-        create table requests (
+        )
+        """,
+        """
+        create table if not exists requests (
             id text primary key,
             collection_id text references collections,
             parent_id text references requests,
-            folder_json text, 
-            request_json text 
-        );
-        """)
-    except sqlite3.OperationalError:
-        pass
+            folder_json text,
+            request_json text
+        )
+        """,
+        """
+        create table if not exists history_bodies (
+            hash text primary key,
+            size integer not null,
+            data blob not null
+        )
+        """,
+        """
+        create table if not exists history (
+            id integer primary key autoincrement,
+            sent_at real not null,
+            method text not null,
+            url text not null,
+            host text not null,
+            status_code integer,
+            reason text,
+            error text,
+            request_json text not null,
+            response_headers_json text,
+            timings_json text,
+            body_size integer not null default 0,
+            body_hash text references history_bodies
+        )
+        """,
+        'create index if not exists history_sent_at_idx on history (sent_at)',
+        'create index if not exists history_host_idx on history (host, sent_at)',
+        'create index if not exists history_status_idx on history (status_code, sent_at)',
+        'create index if not exists history_body_hash_idx on history (body_hash)',
+    ),
+    (
+        # Loading a collection's tree, and finding a node's children.
+        'create index requests_collection_idx on requests (collection_id)',
+        'create index requests_parent_idx on requests (parent_id)',
+    ),
+    (
+        # The tree is loaded from a covering index, without reading request_json, see RequestDAO.get_skeleton.
+        'alter table requests add column name text',
+        'alter table requests add column method text',
+        """
+        update requests set name = json_extract(coalesce(folder_json, request_json), '$.name'),
+                            method = json_extract(request_json, '$.method')
+        """,
+        'drop index requests_collection_idx',
+        'create index requests_tree_idx on requests (collection_id, parent_id, id, name, method, folder_json)',
+    ),
+    (
+        # Full text search over requests, see RequestDAO.search. Contentless, the text is only kept in
+        # requests, so entries are removed by repeating the values they were indexed with.
+        """
+        create virtual table requests_fts using fts5(
+            name, url, headers, body, content='', prefix='2 3', tokenize='unicode61 remove_diacritics 2'
+        )
+        """,
+        f"""
+        insert into requests_fts (rowid, name, url, headers, body)
+        select rowid, {_fts_values('requests')} from requests where request_json is not null
+        """,
+        f"""
+        create trigger requests_fts_insert after insert on requests when new.request_json is not null begin
+            insert into requests_fts (rowid, name, url, headers, body) values (new.rowid, {_fts_values('new')});
+        end
+        """,
+        f"""
+        create trigger requests_fts_delete after delete on requests when old.request_json is not null begin
+            insert into requests_fts (requests_fts, rowid, name, url, headers, body)
+            values ('delete', old.rowid, {_fts_values('old')});
+        end
+        """,
+        f"""
+        create trigger requests_fts_update after update of name, request_json on requests begin
+            insert into requests_fts (requests_fts, rowid, name, url, headers, body)
+            select 'delete', old.rowid, {_fts_values('old')} where old.request_json is not null;
+            insert into requests_fts (rowid, name, url, headers, body)
+            select new.rowid, {_fts_values('new')} where new.request_json is not null;
+        end
+        """,
+    ),
+    (
+        # Large request bodies are kept apart from request_json, see dump_request. History's response bodies
+        # were already stored compressed, once per hash, so their table becomes the one for every body.
+        'alter table history_bodies rename to blobs',
+        'alter table requests add column body_hash text references blobs',
+        'alter table history add column request_body_hash text references blobs',
+        'create index requests_body_hash_idx on requests (body_hash) where body_hash is not null',
+        'create index history_request_body_hash_idx on history (request_body_hash) where request_body_hash is not null',
+    ),
+]
+
+# Tuned for a single writer. In WAL mode synchronous=normal only syncs on checkpoints, committed
+# transactions survive the app crashing, the last few may be rolled back if the os crashes.
+CONNECTION_PRAGMAS = (
+    'pragma journal_mode = wal',
+    'pragma synchronous = normal',
+    'pragma cache_size = -16000',  # KiB
+    'pragma temp_store = memory',
+)
+
+_savepoint_ids = itertools.count()
+
 
+def get_connection(path: str = None, read_only: bool = False) -> sqlite3.Connection:
+    """
+    Opens the store, migrating it to the latest schema if it's behind.
+    Connections are in autocommit mode, statements which should be atomic go in a transaction().
+    A read only connection raises sqlite3.OperationalError on any write.
+    """
+    path = path or f'{DATA_DIR}/storage.db'
+    db = sqlite3.connect(path, 30.0, isolation_level=None)
+    for pragma in CONNECTION_PRAGMAS:
+        db.execute(pragma)
+    migrate(db)
+    if read_only:
+        db.execute('pragma query_only = 1')
     return db
 
 
-NodeRecord = namedtuple('NodeRecord', ['pk', 'collection_pk', 'parent_pk', 'folder_json', 'request_json'])
+def get_schema_version(db: sqlite3.Connection) -> int:
+    return db.execute('pragma user_version').fetchone()[0]
+
+
+def migrate(db: sqlite3.Connection, migrations: List[Tuple[str, ...]] = MIGRATIONS):
+    """Applies the migrations the store hasn't had yet, each one in its own transaction along with its version."""
+    version = get_schema_version(db)
+    if version > len(migrations):
+        raise RuntimeError(f'The store is at schema version {version}, newer than this version of repose supports')
+
+    for target, statements in enumerate(migrations[version:], start=version + 1):
+        with transaction(db):
+            # Checked again once the write lock is held, another connection may have got there first.
+            if get_schema_version(db) >= target:
+                continue
+            for statement in statements:
+                db.execute(statement)
+            db.execute(f'pragma user_version = {target}')
+        log.info('Migrated store to schema version %d', target)
+
+
+@contextmanager
+def transaction(db: sqlite3.Connection) -> Iterator[sqlite3.Connection]:
+    """
+    Commits the statements run in it, or rolls them back if it raises.
+    Transactions nest, an inner one is a savepoint which only rolls back its own statements.
+    The write lock is taken up front, so a transaction can't fail to upgrade a read to a write.
+    """
+    if db.in_transaction:
+        name = f'sp_{next(_savepoint_ids)}'
+        db.execute(f'savepoint {name}')
+        try:
+            yield db
+        except BaseException:
+            db.execute(f'rollback to {name}')
+            db.execute(f'release {name}')
+            raise
+        db.execute(f'release {name}')
+        return
+
+    db.execute('begin immediate')
+    try:
+        yield db
+    except BaseException:
+        db.execute('rollback')
+        raise
+    db.execute('commit')
+
+
+# body is the compressed body of a request whose body is kept in a blob, see dump_request.
+NodeRecord = namedtuple('NodeRecord', ['pk', 'collection_pk', 'parent_pk', 'folder_json', 'request_json', 'body'],
+                        defaults=(None,))
+SkeletonRecord = namedtuple('SkeletonRecord', ['pk', 'collection_pk', 'parent_pk', 'folder_json', 'name', 'method'])
+
+
+def blob_hash(data: bytes) -> str:
+    """The key data is stored under, the same data is stored once whatever it's the body of."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def compress_blob(data: bytes) -> bytes:
+    return zlib.compress(data, 1)
+
+
+def decompress_blob(data: bytes) -> bytes:
+    return zlib.decompress(data)
+
+
+class DAO:
+    """
+    Runs its statements on db, or if it isn't given one, on the connection of the thread it's called on.
+    So a DAO can be made anywhere, and its methods submitted to the DB_EXECUTOR, which routes them by @reads.
+    """
+
+    def __init__(self, db: sqlite3.Connection = None):
+        self._db = db
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        return self._db or db_local.db
+
+
+class BlobDAO(DAO):
+    """Compressed bodies, of requests and history's responses, stored once per hash of their content."""
+
+    # Blobs which no request, or history entry, refers to.
+    ORPHANED = '''
+    not exists (select 1 from requests r where r.body_hash = blobs.hash)
+    and not exists (select 1 from history h where h.body_hash = blobs.hash)
+    and not exists (select 1 from history h where h.request_body_hash = blobs.hash)
+    '''
+
+    def put(self, data: bytes) -> str:
+        """Stores data, returns its hash. Data that's already stored isn't compressed or written again."""
+        key = blob_hash(data)
+        if not self.db.execute('select 1 from blobs where hash = ?', (key,)).fetchone():
+            self.put_compressed(key, compress_blob(data))
+        return key
+
+    def put_compressed(self, key: str, compressed: bytes):
+        self.db.execute('insert or ignore into blobs (hash, size, data) values (?, ?, ?)',
+                        (key, len(compressed), compressed))
+
+    @reads
+    def get(self, key: str) -> Optional[bytes]:
+        """The compressed blob stored under key."""
+        row = self.db.execute('select data from blobs where hash = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def delete_orphans(self, keys: Optional[Iterable[str]] = None, batch_size: int = 500) -> int:
+        """Deletes the blobs nothing refers to any more, only those with keys if they're given."""
+        if keys is None:
+            return self.db.execute(f'delete from blobs where {self.ORPHANED}').rowcount
+
+        keys, deleted = list(set(keys)), 0
+        for i in range(0, len(keys), batch_size):
+            batch = keys[i:i + batch_size]
+            deleted += self.db.execute(f'''
+            delete from blobs where hash in ({', '.join('?' * len(batch))}) and {self.ORPHANED}
+            ''', batch).rowcount
+        return deleted
+
+
+def dump_request(req: RequestModel, blobs: BlobDAO,
+                 blob_size: int = REQUEST_BODY_BLOB_SIZE) -> Tuple[str, Optional[str]]:
+    """
+    The request's json, and the hash of its body if it's large enough to be kept in a blob instead.
+    The json is then small whatever the body, and saving the request again only writes the body if it's changed.
+    Bodies kept in blobs aren't in the full text index.
+    """
+    if len(req.request_body) < blob_size:
+        return json.dumps(vars(req)), None
+    body_hash = blobs.put(req.request_body.encode('utf-8'))
+    return json.dumps({**vars(req), 'request_body': ''}), body_hash
+
+
+def load_request(request_json: str, body: Optional[bytes] = None) -> RequestModel:
+    """A request from its json, with its compressed body if it's kept in a blob."""
+    req = RequestModel(**json.loads(request_json))
+    if body is not None:
+        req.request_body = decompress_blob(body).decode('utf-8')
+    return req
 
 
 def map_record_to_node(rec: NodeRecord) -> RequestTreeNode:
@@ -62,12 +444,34 @@ def map_record_to_node(rec: NodeRecord) -> RequestTreeNode:
         folder = FolderModel(**json.loads(rec.folder_json))
         return RequestTreeNode(pk=rec.pk, parent_pk=rec.parent_pk, folder=folder, collection_pk=rec.collection_pk)
 
-    req = RequestModel(**json.loads(rec.request_json))
+    req = load_request(rec.request_json, rec.body)
     return RequestTreeNode(pk=rec.pk, parent_pk=rec.parent_pk, request=req, collection_pk=rec.collection_pk)
 
 
-def map_records(recs: Iterable[NodeRecord]) -> List[RequestTreeNode]:
-    nodes = (map_record_to_node(rec) for rec in recs)
+def map_skeleton_record_to_node(rec: SkeletonRecord) -> RequestTreeNode:
+    if rec.folder_json:
+        folder = FolderModel(**json.loads(rec.folder_json))
+        return RequestTreeNode(pk=rec.pk, parent_pk=rec.parent_pk, folder=folder, collection_pk=rec.collection_pk)
+
+    summary = RequestSummary(rec.name, rec.method)
+    return RequestTreeNode(pk=rec.pk, parent_pk=rec.parent_pk, summary=summary, collection_pk=rec.collection_pk)
+
+
+def map_node_to_record(node: RequestTreeNode, blobs: BlobDAO) -> Tuple[NodeRecord, Optional[str]]:
+    """
+    The node's row, and the hash of its request's body if it's kept in a blob.
+    A request which hasn't been loaded has no request_json, see RequestDAO.save_many.
+    """
+    if node.is_folder():
+        return NodeRecord(node.pk, node.collection_pk, node.parent_pk, json.dumps(vars(node.folder)), None), None
+    if not node.request:
+        return NodeRecord(node.pk, node.collection_pk, node.parent_pk, None, None), None
+    request_json, body_hash = dump_request(node.request, blobs)
+    return NodeRecord(node.pk, node.collection_pk, node.parent_pk, None, request_json), body_hash
+
+
+def map_records(recs: Iterable, mapper: Callable[..., RequestTreeNode] = map_record_to_node) -> List[RequestTreeNode]:
+    nodes = (mapper(rec) for rec in recs)
     lookup = {node.pk: node for node in nodes}
 
     for node in lookup.values():
@@ -79,45 +483,288 @@ def map_records(recs: Iterable[NodeRecord]) -> List[RequestTreeNode]:
     return [node for node in lookup.values() if not node.parent]
 
 
-class RequestDAO:
+RequestMatch = namedtuple('RequestMatch', ['pk', 'collection_pk', 'name', 'method', 'path', 'rank'])
+
+
+def build_match_query(text: str) -> str:
+    """
+    An fts5 query for the words in text, each is quoted so punctuation in urls doesn't break it.
+    The last one is a prefix, unless it's a single character, which would match most of the index.
+    """
+    words = [f'"{word}"' for word in (word.replace('"', '""') for word in text.split())]
+    if words and len(words[-1]) > 3:
+        words[-1] += '*'
+    return ' '.join(words)
+
+
+# The ids of a node and every node under it, found through requests_parent_idx, the node's id is the first parameter.
+SUBTREE_CTE = '''
+with recursive subtree(id) as (
+    select id from requests where id = ?
+    union all
+    select r.id from requests r join subtree s on r.parent_id = s.id
+)
+'''
+# A random id in the form of a uuid, for nodes created in sql.
+NEW_ID_SQL = "lower(format('%s-%s-%s-%s-%s', hex(randomblob(4)), hex(randomblob(2)), hex(randomblob(2)), " \
+             "hex(randomblob(2)), hex(randomblob(6))))"
+
+
+class RequestDAO(DAO):
     def __init__(self, db: sqlite3.Connection = None):
-        self.db = db or db_local.db
+        super(RequestDAO, self).__init__(db)
+        self.blobs = BlobDAO(db)
 
+    @reads
     def get_requests(self, has_collection=True) -> List[RequestTreeNode]:
         rows = self.db.execute(f'''
-        select id, collection_id, parent_id, folder_json, request_json 
-        from requests
-        {'where collection_id is not null' if has_collection else 'where collection_id is null'}
+        select r.id, r.collection_id, r.parent_id, r.folder_json, r.request_json, b.data
+        from requests r left join blobs b on b.hash = r.body_hash
+        {'where r.collection_id is not null' if has_collection else 'where r.collection_id is null'}
         ''').fetchall()
         rows = (NodeRecord(*row) for row in rows)
         return map_records(rows)
 
+    @reads
+    def get_skeleton(self, has_collection=True) -> List[RequestTreeNode]:
+        """
+        The request trees with only what the tree shows of each request, their names and methods.
+        Read from requests_tree_idx alone, so it takes the same time however large the requests are.
+        Siblings are in the order they were added, the index holds rowids, so they're sorted without the table.
+        """
+        rows = self.db.execute(f'''
+        select id, collection_id, parent_id, folder_json, name, method
+        from requests indexed by requests_tree_idx
+        {'where collection_id is not null' if has_collection else 'where collection_id is null'}
+        order by rowid
+        ''').fetchall()
+        return map_records((SkeletonRecord(*row) for row in rows), map_skeleton_record_to_node)
+
+    @reads
+    def get_request_models(self, pks: List[str], batch_size: int = 500) -> Dict[str, RequestModel]:
+        """The requests of the nodes with pks, folders and missing nodes are left out."""
+        models = {}
+        for i in range(0, len(pks), batch_size):
+            batch = pks[i:i + batch_size]
+            rows = self.db.execute(f'''
+            select r.id, r.request_json, b.data
+            from requests r left join blobs b on b.hash = r.body_hash
+            where r.id in ({', '.join('?' * len(batch))}) and r.request_json is not null
+            ''', batch)
+            models.update((pk, load_request(request_json, body)) for pk, request_json, body in rows)
+        return models
+
     def save_request(self, node: RequestTreeNode):
-        exists = bool(self.db.execute('select count(*) > 0 from requests where id = ?', (node.pk,)).fetchone()[0])
+        self.save_many([node])
 
-        request_json, folder_json = None, None
-        if node.is_folder():
-            folder_json = json.dumps(vars(node.folder))
-        else:
-            request_json = json.dumps(vars(node.request))
+    def save_many(self, nodes: Iterable[RequestTreeNode]):
+        """
+        Inserts or updates nodes, in one statement run for all of them, in one transaction.
+        Requests which haven't been loaded keep their saved request, only their place in the tree is updated.
+        Large bodies are stored in blobs, the blobs of bodies which were replaced are deleted once nothing uses them.
+        """
+        nodes = list(nodes)
+        with transaction(self.db):
+            replaced = self._get_body_hashes([node.pk for node in nodes if node.request])
+            rows = []
+            for node in nodes:
+                rec, body_hash = map_node_to_record(node, self.blobs)
+                rows.append((*rec[:5], body_hash, node.name, node.method))
+            self.db.executemany('''
+            insert into requests (id, collection_id, parent_id, folder_json, request_json, body_hash, name, method)
+            values (?, ?, ?, ?, ?, ?, ?, ?)
+            on conflict (id) do update set collection_id = excluded.collection_id, parent_id = excluded.parent_id,
+                folder_json = excluded.folder_json, name = excluded.name, method = excluded.method,
+                request_json = coalesce(excluded.request_json, requests.request_json),
+                body_hash = case when excluded.request_json is null then requests.body_hash else excluded.body_hash end
+            ''', rows)
+            self.blobs.delete_orphans(replaced)
 
-        if exists:
-            self.db.execute('''
-            update requests set collection_id = ?, parent_id = ?, folder_json = ?, request_json = ?
-            where id = ?
-            ''', (node.collection_pk, node.parent_pk, folder_json, request_json))
+    def _get_body_hashes(self, pks: List[str], batch_size: int = 500) -> List[str]:
+        """The hashes of the saved bodies of the nodes with pks, which are kept in blobs."""
+        hashes = []
+        for i in range(0, len(pks), batch_size):
+            batch = pks[i:i + batch_size]
+            hashes.extend(row[0] for row in self.db.execute(f'''
+            select body_hash from requests where id in ({', '.join('?' * len(batch))}) and body_hash is not null
+            ''', batch))
+        return hashes
+
+    @reads
+    def search(self, text: str, limit: int = 50, max_ranked: int = 10000) -> List[RequestMatch]:
+        """
+        Saved requests matching every word of text, in a name, url, header or body, best matches first.
+        The last word also matches as a prefix, so requests are found while the query is typed.
+        Names count most, then urls, headers and bodies. Each match has the names of its collection and folders.
+        """
+        query = build_match_query(text)
+        if not query:
+            return []
+
+        # Ranking costs as much as there are matches. Past max_ranked, the words are in so many requests
+        # that they barely tell them apart, so the latest requests are shown instead, unranked.
+        count = self.db.execute('select count(*) from requests_fts where requests_fts match ?', (query,)).fetchone()[0]
+        if count > max_ranked:
+            matches = 'select rowid, null from requests_fts where requests_fts match ? order by rowid desc limit ?'
         else:
+            matches = '''
+            select rowid, bm25(requests_fts, 10.0, 5.0, 2.0, 1.0) from requests_fts
+            where requests_fts match ? order by 2 limit ?
+            '''
+
+        rows = self.db.execute(f'''
+        with recursive
+        matches(rowid, rank) as ({matches}),
+        ancestors(match_rowid, parent_id, path) as (
+            select m.rowid, r.parent_id, '' from matches m join requests r on r.rowid = m.rowid
+            union all
+            select a.match_rowid, p.parent_id, p.name || char(0) || a.path
+            from ancestors a join requests p on p.id = a.parent_id
+        )
+        select r.id, r.collection_id, r.name, r.method, coalesce(c.name, ''), a.path, m.rank
+        from matches m
+        join requests r on r.rowid = m.rowid
+        join ancestors a on a.match_rowid = m.rowid and a.parent_id is null
+        left join collections c on c.id = r.collection_id
+        order by m.rank, m.rowid desc
+        ''', (query, limit)).fetchall()
+        return [RequestMatch(pk, collection_pk, name, method, [collection, *path.split('\0')[:-1]], rank)
+                for pk, collection_pk, name, method, collection, path, rank in rows]
+
+    @reads
+    def get_subtree_skeleton(self, pk: str) -> Optional[RequestTreeNode]:
+        """The node with pk and everything under it, loaded like get_skeleton."""
+        rows = self.db.execute(SUBTREE_CTE + '''
+        select r.id, r.collection_id, r.parent_id, r.folder_json, r.name, r.method
+        from subtree s join requests r on r.id = s.id
+        order by r.rowid
+        ''', (pk,)).fetchall()
+        roots = map_records((SkeletonRecord(*row) for row in rows), map_skeleton_record_to_node)
+        return next((node for node in roots if node.pk == pk), None)
+
+    def move_subtree(self, pk: str, parent_pk: Optional[str], collection_pk: Optional[str] = None):
+        """
+        Moves a node, along with everything under it, under the folder parent_pk, or to the top of collection_pk.
+        Only the node's parent changes, its descendants are updated only if it moves to another collection.
+        """
+        with transaction(self.db):
+            if parent_pk is not None:
+                parent = self.db.execute('select collection_id, folder_json is not null from requests where id = ?',
+                                         (parent_pk,)).fetchone()
+                if not parent or not parent[1]:
+                    raise ValueError(f'{parent_pk} is not a folder')
+                if self.db.execute(SUBTREE_CTE + 'select 1 from subtree where id = ?', (pk, parent_pk)).fetchone():
+                    raise ValueError('A folder can\'t be moved under itself')
+                collection_pk = parent[0]
+
+            cur = self.db.execute('update requests set parent_id = ? where id = ?', (parent_pk, pk))
+            if not cur.rowcount:
+                raise ValueError(f'{pk} does not exist')
+            if collection_pk is not None:
+                self.db.execute(SUBTREE_CTE + '''
+                update requests set collection_id = ? where id in subtree and collection_id is not ?
+                ''', (pk, collection_pk, collection_pk))
+
+    def duplicate_subtree(self, pk: str) -> str:
+        """
+        Copies a node, along with everything under it, next to it, every copy gets a new id.
+        The copy's name gets " (copy)" added. Returns the copy's pk. Bodies kept in blobs are shared, not copied.
+        """
+        with transaction(self.db):
+            # Maps the id of each node in the subtree to the id of its copy.
+            self.db.execute('create temp table if not exists subtree_copy (old_id text primary key, new_id text)')
+            self.db.execute('delete from subtree_copy')
+            self.db.execute(SUBTREE_CTE + f'''
+            insert into subtree_copy (old_id, new_id) select id, {NEW_ID_SQL} from subtree
+            ''', (pk,))
             self.db.execute('''
-            insert into requests (id, collection_id, parent_id, folder_json, request_json) values (?, ?, ?, ?, ?)
-            ''', (node.pk, node.collection_pk, node.parent_pk, folder_json, request_json))
+            insert into requests (id, collection_id, parent_id, folder_json, request_json, body_hash, name, method)
+            select c.new_id, r.collection_id,
+                   case when r.id = :pk then r.parent_id else p.new_id end,
+                   case when r.id = :pk then json_set(r.folder_json, '$.name', r.name || ' (copy)')
+                        else r.folder_json end,
+                   case when r.id = :pk then json_set(r.request_json, '$.name', r.name || ' (copy)')
+                        else r.request_json end,
+                   r.body_hash,
+                   case when r.id = :pk then r.name || ' (copy)' else r.name end,
+                   r.method
+            from subtree_copy c
+            join requests r on r.id = c.old_id
+            left join subtree_copy p on p.old_id = r.parent_id
+            order by r.rowid
+            ''', {'pk': pk})
+            row = self.db.execute('select new_id from subtree_copy where old_id = ?', (pk,)).fetchone()
+            self.db.execute('delete from subtree_copy')
+
+        if not row:
+            raise ValueError(f'{pk} does not exist')
+        return row[0]
+
+    def delete_subtree(self, pk: str) -> List[str]:
+        """
+        Deletes a node along with everything under it, returns the pks of the nodes deleted.
+        The blobs of their bodies are deleted too, unless another request, or history, uses them.
+        """
+        with transaction(self.db):
+            # Selected then deleted, rather than with delete ... returning, which needs sqlite 3.35.
+            rows = self.db.execute(SUBTREE_CTE + '''
+            select r.id, r.body_hash from subtree s join requests r on r.id = s.id
+            ''', (pk,)).fetchall()
+            self.db.execute(SUBTREE_CTE + 'delete from requests where id in subtree', (pk,))
+            self.blobs.delete_orphans(body_hash for _, body_hash in rows if body_hash)
+        return [pk for pk, _ in rows]
 
+    @reads
+    def export_subtree(self, pk: str, out: TextIO) -> int:
+        """
+        Writes a node, with everything under it, to out as json, returns the number of nodes written.
+        Folders are {"folder": {...}, "children": [...]}, requests are {"request": {...}}. The saved json
+        of each node is written as it's read, in tree order, so nothing is decoded or held in memory,
+        apart from requests whose bodies are kept in blobs, which are written with their bodies put back.
+        """
+        rows = self.db.execute('''
+        with recursive subtree(id, path) as (
+            select id, printf('%016x', rowid) from requests where id = ?
+            union all
+            select r.id, s.path || printf('%016x', r.rowid) from requests r join subtree s on r.parent_id = s.id
+        )
+        select length(s.path) / 16, r.folder_json, r.request_json, b.data
+        from subtree s join requests r on r.id = s.id
+        left join blobs b on b.hash = r.body_hash
+        order by s.path
+        ''', (pk,))
 
-class CollectionDAO:
+        open_folders: List[int] = []  # Depths of the folders whose children are being written
+        written, needs_comma = 0, False
+        for depth, folder_json, request_json, body in rows:
+            while open_folders and open_folders[-1] >= depth:
+                open_folders.pop()
+                out.write(']}')
+                needs_comma = True
+            if needs_comma:
+                out.write(', ')
+            if folder_json:
+                out.write(f'{{"folder": {folder_json}, "children": [')
+                open_folders.append(depth)
+                needs_comma = False
+            else:
+                if body is not None:
+                    request_json = json.dumps(vars(load_request(request_json, body)))
+                out.write(f'{{"request": {request_json}}}')
+                needs_comma = True
+            written += 1
+        out.write(']}' * len(open_folders))
+        return written
+
+
+class CollectionDAO(DAO):
     def __init__(self, db: sqlite3.Connection = None, request_dao: RequestDAO = None):
-        self.db = db or db_local.db
-        self.request_dao = request_dao or RequestDAO(self.db)
+        super(CollectionDAO, self).__init__(db)
+        self.request_dao = request_dao or RequestDAO(db)
 
+    @reads
     def get_collections(self) -> List[CollectionModel]:
+        """Every collection, with the skeletons of their trees, requests are loaded through a RequestLoader."""
         query = ''' select id, name from collections c '''
 
         collections = {
@@ -125,7 +772,7 @@ class CollectionDAO:
             for row in self.db.execute(query).fetchall()
         }
 
-        nodes = self.request_dao.get_requests()
+        nodes = self.request_dao.get_skeleton()
         for node in nodes:
             col = collections[node.collection_pk]
             col.nodes.append(node)
@@ -133,8 +780,282 @@ class CollectionDAO:
         return list(collections.values())
 
     def save_collection(self, col: CollectionModel):
-        exists = bool(self.db.execute('select count(*) > 0 from collections where id = ?', (col.pk,)).fetchone()[0])
-        if exists:
-            self.db.execute('update collections set name = ? where id = ?', (col.name, col.pk))
-        else:
-            self.db.execute('insert into collections (id, name) values (?, ?)', (col.pk, col.name))
+        self.save_many([col])
+
+    def save_many(self, cols: Iterable[CollectionModel]):
+        """Inserts or updates collections, without their nodes, in one transaction."""
+        with transaction(self.db):
+            self.db.executemany('''
+            insert into collections (id, name) values (?, ?)
+            on conflict (id) do update set name = excluded.name
+            ''', ((col.pk, col.name) for col in cols))
+
+    def save_tree(self, col: CollectionModel):
+        """Saves a collection along with every node in it, e.g. once it's imported, in one transaction."""
+
+        def walk(nodes: List[RequestTreeNode]) -> Iterator[RequestTreeNode]:
+            for node in nodes:
+                yield node
+                yield from walk(node.children)
+
+        with transaction(self.db):
+            self.save_many([col])
+            self.request_dao.save_many(walk(col.nodes))
+
+
+class SaveQueue:
+    """
+    Writes collection and request saves behind, through the DB_EXECUTOR.
+
+    Saves are held for up to flush_interval, then written in one transaction. Saving
+    a node, or collection, again before then replaces the pending save, so a burst of
+    edits to the same node costs one row write, and saving many nodes costs one commit.
+    Nodes are serialized when they're written, so the latest state of each is saved.
+    """
+
+    def __init__(self,
+                 executor: Executor = DB_EXECUTOR,
+                 flush_interval: float = SAVE_FLUSH_INTERVAL,
+                 db_factory: Callable[[], sqlite3.Connection] = lambda: db_local.db):
+        self.executor = executor
+        self.flush_interval = flush_interval
+        self._db_factory = db_factory
+        self._lock = threading.Lock()
+        self._collections: Dict[str, CollectionModel] = {}
+        self._nodes: Dict[str, RequestTreeNode] = {}
+        self._timer: Optional[threading.Timer] = None
+
+    def save_collection(self, col: CollectionModel):
+        with self._lock:
+            self._collections[col.pk] = col
+            self._schedule()
+
+    def save_request(self, node: RequestTreeNode):
+        self.save_many([node])
+
+    def save_many(self, nodes: Iterable[RequestTreeNode]):
+        with self._lock:
+            self._nodes.update((node.pk, node) for node in nodes)
+            self._schedule()
+
+    def _schedule(self):
+        if self._timer:
+            return
+        self._timer = threading.Timer(self.flush_interval, self.flush)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def flush(self) -> Future:
+        """Writes the pending saves now, the future completes once they're committed."""
+        with self._lock:
+            cols, self._collections = list(self._collections.values()), {}
+            nodes, self._nodes = list(self._nodes.values()), {}
+            if self._timer:
+                self._timer.cancel()
+                self._timer = None
+        return self.executor.submit(self._write, cols, nodes)
+
+    def _write(self, cols: List[CollectionModel], nodes: List[RequestTreeNode]):
+        if not cols and not nodes:
+            return
+        try:
+            db = self._db_factory()
+            with transaction(db):
+                CollectionDAO(db).save_many(cols)
+                RequestDAO(db).save_many(nodes)
+            log.debug('Saved %d collections and %d requests', len(cols), len(nodes))
+        except Exception as e:
+            log.error('Failed to save %d collections and %d requests %s', len(cols), len(nodes), e)
+
+
+SAVE_QUEUE = SaveQueue()
+
+
+class RequestLoader:
+    """
+    Loads the requests of collection nodes, which are only loaded as summaries, when they're opened or run.
+
+    The max_loaded most recently loaded requests are cached, so opening one again doesn't go
+    back to the database. Nodes aren't changed, whoever loads a request decides whether to
+    keep it on its node, e.g. the editor does while it's open, a collection run doesn't.
+    """
+
+    def __init__(self,
+                 executor: Executor = DB_EXECUTOR,
+                 max_loaded: int = LOADED_REQUESTS_MAX,
+                 db_factory: Callable[[], sqlite3.Connection] = lambda: db_local.db):
+        self.executor = executor
+        self.max_loaded = max_loaded
+        self._db_factory = db_factory
+        self._lock = threading.Lock()
+        self._loaded: 'OrderedDict[str, RequestModel]' = OrderedDict()
+
+    def load(self, pks: Iterable[str]) -> Future:
+        """Future of the requests of the nodes with pks, by pk. Completes straight away if they're all cached."""
+        found, missing = {}, []
+        with self._lock:
+            for pk in pks:
+                if pk in self._loaded:
+                    self._loaded.move_to_end(pk)
+                    found[pk] = self._loaded[pk]
+                else:
+                    missing.append(pk)
+
+        if not missing:
+            future = Future()
+            future.set_result(found)
+            return future
+        return self.executor.submit(self._load, missing, found)
+
+    @reads
+    def _load(self, pks: List[str], found: Dict[str, RequestModel]) -> Dict[str, RequestModel]:
+        loaded = RequestDAO(self._db_factory()).get_request_models(pks)
+        with self._lock:
+            for pk, req in loaded.items():
+                # A request loaded meanwhile may already be open, so it's the one kept.
+                req = self._loaded.setdefault(pk, req)
+                self._loaded.move_to_end(pk)
+                found[pk] = req
+            while len(self._loaded) > self.max_loaded:
+                self._loaded.popitem(last=False)
+        log.debug('Loaded %d requests', len(loaded))
+        return found
+
+    def forget(self, pks: Iterable[str]):
+        """Drops cached requests, e.g. once their nodes are deleted."""
+        with self._lock:
+            for pk in pks:
+                self._loaded.pop(pk, None)
+
+
+REQUEST_LOADER = RequestLoader()
+
+
+HistoryRecord = namedtuple('HistoryRecord', ['pk', 'sent_at', 'method', 'url', 'status_code', 'reason', 'error',
+                                             'request_json', 'response_headers_json', 'timings_json', 'body_size',
+                                             'body_hash', 'request_body'])
+
+
+def map_record_to_history_entry(rec: HistoryRecord) -> HistoryEntry:
+    return HistoryEntry(
+        rec.method, rec.url, load_request(rec.request_json, rec.request_body), rec.sent_at,
+        status_code=rec.status_code,
+        reason=rec.reason,
+        response_headers=json.loads(rec.response_headers_json or '{}'),
+        timings=json.loads(rec.timings_json or '{}'),
+        body_size=rec.body_size,
+        body_hash=rec.body_hash,
+        error=rec.error,
+        pk=rec.pk)
+
+
+class HistoryDAO(DAO):
+    def __init__(self, db: sqlite3.Connection = None):
+        super(HistoryDAO, self).__init__(db)
+        self.blobs = BlobDAO(db)
+
+    def add_entries(self, entries: List[Tuple[HistoryEntry, Optional[bytes]]]):
+        """
+        Saves entries with their compressed bodies in one transaction. Bodies, and large request bodies,
+        are stored once per hash, along with the bodies of saved requests.
+        """
+        with transaction(self.db):
+            for entry, compressed_body in entries:
+                if entry.body_hash and compressed_body is not None:
+                    self.blobs.put_compressed(entry.body_hash, compressed_body)
+                request_json, request_body_hash = dump_request(entry.request, self.blobs)
+
+                cur = self.db.execute('''
+                insert into history (sent_at, method, url, host, status_code, reason, error, request_json,
+                                     response_headers_json, timings_json, body_size, body_hash, request_body_hash)
+                values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (entry.sent_at, entry.method, entry.url, entry.host, entry.status_code, entry.reason,
+                      entry.error, request_json, json.dumps(entry.response_headers), json.dumps(entry.timings),
+                      entry.body_size, entry.body_hash if compressed_body else None, request_body_hash))
+                entry.pk = cur.lastrowid
+
+    @reads
+    def get_entries(self,
+                    before_pk: Optional[int] = None,
+                    limit: int = 50,
+                    host: Optional[str] = None,
+                    status_code: Optional[int] = None) -> List[HistoryEntry]:
+        """A page of entries, newest first. Pass the pk of the last entry of a page to get the next one."""
+        clauses, args = [], []
+        if before_pk is not None:
+            clauses.append('h.id < ?')
+            args.append(before_pk)
+        if host is not None:
+            clauses.append('h.host = ?')
+            args.append(host)
+        if status_code is not None:
+            clauses.append('h.status_code = ?')
+            args.append(status_code)
+
+        rows = self.db.execute(f'''
+        select h.id, h.sent_at, h.method, h.url, h.status_code, h.reason, h.error, h.request_json,
+               h.response_headers_json, h.timings_json, h.body_size, h.body_hash, b.data
+        from history h
+        left join blobs b on b.hash = h.request_body_hash
+        {'where ' + ' and '.join(clauses) if clauses else ''}
+        order by h.id desc
+        limit ?
+        ''', (*args, limit)).fetchall()
+        return [map_record_to_history_entry(HistoryRecord(*row)) for row in rows]
+
+    @reads
+    def get_body(self, body_hash: str) -> Optional[bytes]:
+        """The compressed body stored under body_hash."""
+        return self.blobs.get(body_hash)
+
+    @reads
+    def get_size(self) -> Tuple[int, int]:
+        """The number of entries and the bytes taken up by their bodies, blobs only requests use aren't counted."""
+        count = self.db.execute('select count(*) from history').fetchone()[0]
+        size = self.db.execute('''
+        select coalesce(sum(size), 0) from blobs
+        where hash in (select body_hash from history union select request_body_hash from history)
+        ''').fetchone()[0]
+        return count, size
+
+    def apply_retention(self, max_entries: int, max_bytes: int, batch_size: int = 100) -> int:
+        """Deletes the oldest entries until there are at most max_entries taking at most max_bytes."""
+        with transaction(self.db):
+            deleted, _ = self._delete_entries('id <= (select id from history order by id desc limit 1 offset ?)',
+                                              (max_entries,))
+
+            size = self.get_size()[1]
+            while size > max_bytes:
+                count, freed = self._delete_entries('id in (select id from history order by id limit ?)', (batch_size,))
+                if not count:
+                    break
+                deleted += count
+                size -= freed
+
+        return deleted
+
+    def _delete_entries(self, where: str, params: tuple, batch_size: int = 500) -> Tuple[int, int]:
+        """
+        Deletes the entries matching where, along with the blobs only they used.
+        Returns the number of entries deleted, and the bytes no longer counted by get_size.
+        """
+        # Selected then deleted, like RequestDAO.delete_subtree, delete ... returning needs sqlite 3.35.
+        rows = self.db.execute(f'select body_hash, request_body_hash from history where {where}', params).fetchall()
+        self.db.execute(f'delete from history where {where}', params)
+        keys = list({key for row in rows for key in row if key})
+        freed = 0
+        for i in range(0, len(keys), batch_size):
+            batch = keys[i:i + batch_size]
+            freed += self.db.execute(f'''
+            select coalesce(sum(size), 0) from blobs
+            where hash in ({', '.join('?' * len(batch))})
+            and not exists (select 1 from history h where h.body_hash = blobs.hash)
+            and not exists (select 1 from history h where h.request_body_hash = blobs.hash)
+            ''', batch).fetchone()[0]
+        self.blobs.delete_orphans(keys)
+        return len(rows), freed
+
+    def clear(self):
+        with transaction(self.db):
+            self.db.execute('delete from history')
+            self.blobs.delete_orphans()
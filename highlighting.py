@@ -0,0 +1,55 @@
+import re
+from typing import Iterator, Tuple, Dict, Pattern
+
+# Token types, and the GtkSource style scheme styles used to color them.
+TOKEN_STYLES = {
+    'key': 'def:type',
+    'string': 'def:string',
+    'number': 'def:decimal',
+    'constant': 'def:special-constant',
+    'tag': 'def:keyword',
+    'attribute': 'def:type',
+    'comment': 'def:comment',
+    'entity': 'def:special-char',
+}
+
+# Lines longer than this are left unstyled, tokenizing one would take longer than a frame.
+MAX_TOKENIZED_LINE_LENGTH = 5000
+
+_JSON = re.compile(r'''
+    (?P<key>"(?:[^"\\]|\\.)*")(?=\s*:)
+  | (?P<string>"(?:[^"\\]|\\.)*")
+  | (?P<number>-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?)
+  | (?P<constant>\b(?:true|false|null)\b)
+''', re.VERBOSE)
+
+_XML = re.compile(r'''
+    (?P<comment><!--.*?(?:-->|$))
+  | (?P<tag></?[\w:.-]+|/?>|<\?[\w:.-]+|\?>|<!\w+)
+  | (?P<attribute>[\w:.-]+)(?==)
+  | (?P<string>"[^"]*"|'[^']*')
+  | (?P<entity>&[#\w]+;)
+''', re.VERBOSE)
+
+TOKENIZERS: Dict[str, Pattern] = {
+    'json': _JSON,
+    'xml': _XML,
+    'html': _XML,
+}
+
+
+def tokenize(language_id: str, line: str) -> Iterator[Tuple[int, int, str]]:
+    """(start, end, token type) of the tokens in a line, for the languages in TOKENIZERS."""
+    if len(line) > MAX_TOKENIZED_LINE_LENGTH:
+        return
+
+    pattern = TOKENIZERS[language_id]
+    for match in pattern.finditer(line):
+        kind = match.lastgroup
+        if language_id != 'json' and kind in {'attribute', 'string'} and not _inside_tag(line, match.start()):
+            continue  # Text content which happens to look like an attribute or a quoted string
+        yield match.start(kind), match.end(kind), kind
+
+
+def _inside_tag(line: str, pos: int) -> bool:
+    return line.rfind('<', 0, pos) > line.rfind('>', 0, pos)
@@ -0,0 +1,138 @@
+import copy
+import logging
+import time
+from concurrent.futures import Executor, Future
+from typing import Optional, List, Tuple, Callable
+
+import requests
+
+from config import HISTORY_MAX_ENTRIES, HISTORY_MAX_BYTES, HISTORY_MAX_BODY_SIZE, HISTORY_FLUSH_INTERVAL
+from db import DB_EXECUTOR, HistoryDAO, blob_hash, compress_blob, decompress_blob, reads, submit_after
+from models import HistoryEntry, RequestModel
+from pool import CompletionBatcher
+from response_body import ResponseBody
+from timings import RequestTimings
+
+log = logging.getLogger(__name__)
+
+
+def compress_body(body: ResponseBody, max_size: int = HISTORY_MAX_BODY_SIZE) -> Tuple[Optional[str], Optional[bytes]]:
+    """The hash and compressed bytes of a body, (None, None) if it's empty or too large to keep."""
+    if not body.size or body.size > max_size:
+        return None, None
+
+    data = body.getbuffer()
+    return blob_hash(data), compress_blob(data)
+
+
+def decompress_body(data: bytes) -> bytes:
+    return decompress_blob(data)
+
+
+class History:
+    """
+    Records every request which is sent.
+
+    Entries are built on the sending thread. They're written to the database in
+    batches through the DB_EXECUTOR, at most once per flush_interval, so a burst of
+    sends costs one transaction instead of one each. Bodies are compressed there too,
+    as the batch is written, rather than holding up the response on its way to the ui.
+    Retention limits are applied after each batch. Entries are read on a read connection,
+    once the last batch is written, so they include every entry that's been flushed.
+    """
+
+    def __init__(self,
+                 executor: Executor = DB_EXECUTOR,
+                 max_entries: int = HISTORY_MAX_ENTRIES,
+                 max_bytes: int = HISTORY_MAX_BYTES,
+                 flush_interval: float = HISTORY_FLUSH_INTERVAL,
+                 dao_factory=HistoryDAO):
+        self.executor = executor
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._dao_factory = dao_factory
+        self._batcher = CompletionBatcher(self._submit_batch, flush_interval)
+        self._last_write: Optional[Future] = None
+
+    def record(self,
+               method: str,
+               url: str,
+               request: RequestModel,
+               response: Optional[requests.Response] = None,
+               body: Optional[ResponseBody] = None,
+               timings: Optional[RequestTimings] = None,
+               error: Optional[str] = None) -> HistoryEntry:
+        """
+        Queues an entry for the request, request should be a snapshot the ui won't modify.
+        The body is kept open until it's been compressed, its hash is set on the entry then.
+        """
+        kept = body if body and 0 < body.size <= HISTORY_MAX_BODY_SIZE and body.retain() else None
+        entry = HistoryEntry(
+            method, url, request, time.time(),
+            status_code=response.status_code if response is not None else None,
+            reason=response.reason if response is not None else '',
+            response_headers=dict(response.headers) if response is not None else None,
+            timings=timings.to_dict() if timings else None,
+            body_size=body.size if body else 0,
+            error=error)
+        self._batcher.add((entry, kept))
+        return entry
+
+    def flush(self):
+        self._batcher.flush()
+
+    def _submit_batch(self, batch: List[Tuple[HistoryEntry, Optional[ResponseBody]]]):
+        self._last_write = self.executor.submit(self._write, batch)
+
+    def _write(self, batch: List[Tuple[HistoryEntry, Optional[ResponseBody]]]):
+        try:
+            rows = [(entry, self._compress_body(entry, body)) for entry, body in batch]
+            dao = self._dao_factory()
+            dao.add_entries(rows)
+            deleted = dao.apply_retention(self.max_entries, self.max_bytes)
+            log.debug('Wrote %d history entries, dropped %d old ones', len(batch), deleted)
+        except Exception as e:
+            log.error('Failed to write %d history entries %s', len(batch), e)
+        finally:
+            for _, body in batch:
+                if body is not None:
+                    body.release()
+
+    @staticmethod
+    def _compress_body(entry: HistoryEntry, body: Optional[ResponseBody]) -> Optional[bytes]:
+        if body is None:
+            return None
+        entry.body_hash, compressed = compress_body(body)
+        return compressed
+
+    def get_entries(self, before_pk: Optional[int] = None, limit: int = 50, **filters) -> Future:
+        """Future of a page of entries, newest first, see HistoryDAO.get_entries."""
+
+        @reads
+        def load():
+            return self._dao_factory().get_entries(before_pk, limit, **filters)
+
+        return self._read(load)
+
+    def get_body(self, entry: HistoryEntry) -> Future:
+        """Future of the decompressed body of entry, None if it wasn't kept."""
+
+        @reads
+        def load():
+            data = self._dao_factory().get_body(entry.body_hash) if entry.body_hash else None
+            return decompress_body(data) if data is not None else None
+
+        return self._read(load)
+
+    def _read(self, fn: Callable) -> Future:
+        last_write = self._last_write
+        if last_write is None or last_write.done():
+            return self.executor.submit(fn)
+        return submit_after(self.executor, last_write, fn)
+
+
+def snapshot_request(req: RequestModel) -> RequestModel:
+    return copy.deepcopy(req)
+
+
+HISTORY = History()
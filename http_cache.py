@@ -0,0 +1,337 @@
+import calendar
+import email.utils
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from pathlib import Path
+from typing import Optional, Dict, List, Tuple, Callable
+
+import requests
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+from config import HTTP_CACHE_DIR, HTTP_CACHE_MAX_BYTES, HTTP_CACHE_MAX_ENTRIES
+from http_engine import HttpEngine, RequestHandle
+from response_body import ResponseBody, DownloadProgress
+from timings import RequestTimings
+
+log = logging.getLogger(__name__)
+
+CACHEABLE_METHODS = {'GET', 'HEAD'}
+CACHEABLE_STATUSES = {200, 203, 300, 301, 410}
+# Headers describing how the body was sent, it's stored decoded so they don't describe the stored body.
+TRANSFER_HEADERS = {'content-length', 'content-encoding', 'transfer-encoding'}
+
+
+class CacheStatus:
+    HIT = 'cache hit'
+    REVALIDATED = 'revalidated'
+    MISS = 'full fetch'
+
+
+def parse_cache_control(value: str) -> Dict[str, Optional[str]]:
+    directives = {}
+    for part in value.split(','):
+        name, _, arg = part.strip().partition('=')
+        if name:
+            directives[name.lower()] = arg.strip('"') or None
+    return directives
+
+
+def _parse_http_date(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    parsed = email.utils.parsedate(value)
+    return calendar.timegm(parsed) if parsed else None
+
+
+class CacheEntry:
+    def __init__(self,
+                 key: str,
+                 method: str,
+                 url: str,
+                 status_code: int,
+                 reason: str,
+                 headers: Dict[str, str],
+                 vary: Dict[str, str],
+                 stored_at: float,
+                 size: int = 0):
+        self.key = key
+        self.method = method
+        self.url = url
+        self.status_code = status_code
+        self.reason = reason
+        self.headers = CaseInsensitiveDict(headers)
+        self.vary = vary  # Request header name -> the value the response was stored for
+        self.stored_at = stored_at
+        self.size = size
+
+    def is_fresh(self, now: float = None) -> bool:
+        """Whether the response may be served without asking the server, per its max-age or expires."""
+        cc = parse_cache_control(self.headers.get('cache-control', ''))
+        if 'no-cache' in cc:
+            return False
+
+        age = (now or time.time()) - self.stored_at
+        if (cc.get('max-age') or '').isdigit():
+            return age < int(cc['max-age'])
+
+        expires = _parse_http_date(self.headers.get('expires'))
+        date = _parse_http_date(self.headers.get('date'))
+        if expires is not None:
+            return age < expires - (date or self.stored_at)
+        return False
+
+    def conditional_headers(self) -> Dict[str, str]:
+        headers = {}
+        if 'etag' in self.headers:
+            headers['If-None-Match'] = self.headers['etag']
+        if 'last-modified' in self.headers:
+            headers['If-Modified-Since'] = self.headers['last-modified']
+        return headers
+
+    def to_json(self) -> str:
+        return json.dumps({
+            'method': self.method,
+            'url': self.url,
+            'status_code': self.status_code,
+            'reason': self.reason,
+            'headers': dict(self.headers),
+            'vary': self.vary,
+            'stored_at': self.stored_at,
+            'size': self.size,
+        })
+
+    @classmethod
+    def from_json(cls, key: str, data: str) -> 'CacheEntry':
+        return cls(key, **json.loads(data))
+
+
+class HttpCache:
+    """
+    Client side cache of GET responses, stored on disk.
+
+    Entries are keyed by method, url and the values of the request headers named
+    in the response's Vary header. Fresh entries are served without a request,
+    stale ones which have an ETag or Last-Modified are revalidated with a
+    conditional request, and served from disk when the server answers 304.
+    The least recently used entries are evicted past max_bytes or max_entries.
+    """
+
+    def __init__(self,
+                 directory: str = HTTP_CACHE_DIR,
+                 max_bytes: int = HTTP_CACHE_MAX_BYTES,
+                 max_entries: int = HTTP_CACHE_MAX_ENTRIES):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.hits = 0
+        self.revalidations = 0
+        self.misses = 0
+
+        self._lock = threading.RLock()
+        self._lru: Optional['OrderedDict[str, CacheEntry]'] = None
+        self._vary: Dict[str, List[str]] = {}  # Primary key -> the request headers responses for it vary on
+        self._size = 0
+
+    def _load(self):
+        """Builds the index from disk the first time the cache is used."""
+        if self._lru is not None:
+            return
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        entries = []
+        for meta in self.directory.glob('*.json'):
+            try:
+                entry = CacheEntry.from_json(meta.stem, meta.read_text())
+                entries.append((self._body_path(entry.key).stat().st_mtime, entry))
+            except (OSError, ValueError, TypeError) as e:
+                log.warning('Discarding unreadable cache entry %s: %s', meta, e)
+                self._delete_files(meta.stem)
+
+        self._lru = OrderedDict()
+        for _, entry in sorted(entries, key=lambda e: e[0]):
+            self._index(entry)
+        log.info('Loaded %d http cache entries, %d bytes', len(self._lru), self._size)
+
+    def _index(self, entry: CacheEntry):
+        self._lru[entry.key] = entry
+        self._lru.move_to_end(entry.key)
+        self._size += entry.size
+        self._vary[self._primary_key(entry.method, entry.url)] = sorted(entry.vary)
+
+    @staticmethod
+    def _primary_key(method: str, url: str) -> str:
+        return f'{method.upper()} {url}'
+
+    def _key(self, method: str, url: str, vary: Dict[str, str]) -> str:
+        raw = self._primary_key(method, url) + ''.join(f'\n{k.lower()}: {v}' for k, v in sorted(vary.items()))
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def _body_path(self, key: str) -> Path:
+        return self.directory / f'{key}.body'
+
+    def _meta_path(self, key: str) -> Path:
+        return self.directory / f'{key}.json'
+
+    def _delete_files(self, key: str):
+        for path in (self._body_path(key), self._meta_path(key)):
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+    def lookup(self, method: str, url: str, headers: Dict[str, str]) -> Optional[CacheEntry]:
+        with self._lock:
+            self._load()
+            names = self._vary.get(self._primary_key(method, url), [])
+            request_headers = CaseInsensitiveDict(headers or {})
+            entry = self._lru.get(self._key(method, url, {n: request_headers.get(n, '') for n in names}))
+            if entry:
+                self._lru.move_to_end(entry.key)
+                try:
+                    os.utime(self._body_path(entry.key))
+                except FileNotFoundError:
+                    self._remove(entry.key)
+                    return None
+            return entry
+
+    def store(self, method: str, url: str, headers: Dict[str, str], response: requests.Response,
+              body: ResponseBody) -> Optional[CacheEntry]:
+        if method not in CACHEABLE_METHODS or response.status_code not in CACHEABLE_STATUSES:
+            return None
+        if 'no-store' in parse_cache_control(response.headers.get('cache-control', '')):
+            return None
+        vary_names = [v.strip() for v in response.headers.get('vary', '').split(',') if v.strip()]
+        if '*' in vary_names or body.size > self.max_bytes:
+            return None
+
+        request_headers = CaseInsensitiveDict(headers or {})
+        vary = {name.lower(): request_headers.get(name, '') for name in vary_names}
+        key = self._key(method, url, vary)
+        stored_headers = {k: v for k, v in response.headers.items() if k.lower() not in TRANSFER_HEADERS}
+        entry = CacheEntry(key, method, url, response.status_code, response.reason, stored_headers,
+                           vary, time.time(), body.size)
+
+        with self._lock:
+            self._load()
+            self._remove(key)
+            self.directory.mkdir(parents=True, exist_ok=True)
+            tmp = self._body_path(key).with_suffix('.tmp')
+            with open(tmp, 'wb') as f:
+                body.write_to(f)
+            os.replace(tmp, self._body_path(key))
+            self._meta_path(key).write_text(entry.to_json())
+            self._index(entry)
+            self._evict()
+
+        return entry
+
+    def refresh(self, entry: CacheEntry, not_modified: requests.Response):
+        """Updates a revalidated entry with the headers of the 304 response."""
+        with self._lock:
+            if entry.key not in self._lru:
+                return  # Evicted while it was revalidated
+            for k, v in not_modified.headers.items():
+                if k.lower() not in TRANSFER_HEADERS:
+                    entry.headers[k] = v
+            entry.stored_at = time.time()
+            self._meta_path(entry.key).write_text(entry.to_json())
+
+    def open_body(self, entry: CacheEntry) -> Optional[ResponseBody]:
+        """The body of entry, None if it's been evicted since it was looked up."""
+        with self._lock:
+            try:
+                return ResponseBody.from_file(str(self._body_path(entry.key)))
+            except FileNotFoundError:
+                self._remove(entry.key)
+                return None
+
+    def _remove(self, key: str):
+        entry = self._lru.pop(key, None)
+        if entry:
+            self._size -= entry.size
+        self._delete_files(key)
+
+    def _evict(self):
+        while self._lru and (self._size > self.max_bytes or len(self._lru) > self.max_entries):
+            key = next(iter(self._lru))
+            log.debug('Evicting http cache entry %s', key)
+            self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._load()
+            for key in list(self._lru):
+                self._remove(key)
+            self._vary.clear()
+
+    def fetch(self,
+              engine: HttpEngine,
+              method: str,
+              url: str,
+              handle: RequestHandle = None,
+              on_progress: Callable[[DownloadProgress], None] = None,
+              timings: RequestTimings = None,
+              **kwargs) -> Tuple[requests.Response, ResponseBody, Optional[str]]:
+        """
+        HttpEngine.fetch through the cache. Also returns the CacheStatus of the response,
+        None if the request bypassed the cache.
+        """
+        headers = dict(kwargs.pop('headers', None) or {})
+        full_url = requests.Request(method, url, params=kwargs.pop('params', None)).prepare().url
+        request_headers = CaseInsensitiveDict(headers)
+        # The key doesn't cover a request body, so a GET with one is never served from nor stored in the cache
+        bypass = method not in CACHEABLE_METHODS or any(kwargs.get(k) for k in ('data', 'json', 'files')) \
+            or 'if-none-match' in request_headers or 'if-modified-since' in request_headers \
+            or 'no-store' in parse_cache_control(request_headers.get('cache-control', ''))
+
+        entry = None if bypass else self.lookup(method, full_url, headers)
+        if entry and entry.is_fresh():
+            cached = self.open_body(entry)
+            if cached:
+                self.hits += 1
+                return self._cached_response(entry, full_url), cached, CacheStatus.HIT
+            entry = None
+
+        conditional = dict(headers, **entry.conditional_headers()) if entry else headers
+        res, body = engine.fetch(method, full_url, handle, on_progress, timings, headers=conditional, **kwargs)
+        if bypass:
+            return res, body, None
+
+        if entry and res.status_code == 304:
+            body.close()
+            cached = self.open_body(entry)
+            if cached:
+                self.revalidations += 1
+                self.refresh(entry, res)
+                return self._cached_response(entry, full_url), cached, CacheStatus.REVALIDATED
+            # Evicted while it was revalidated, the 304 has no body to show so it's fetched in full.
+            res, body = engine.fetch(method, full_url, handle, on_progress, timings, headers=headers, **kwargs)
+
+        self.misses += 1
+        try:
+            self.store(method, full_url, headers, res, body)
+        except OSError as e:
+            log.error('Failed to store response in the http cache %s', e)
+        return res, body, CacheStatus.MISS
+
+    @staticmethod
+    def _cached_response(entry: CacheEntry, url: str) -> requests.Response:
+        res = requests.Response()
+        res.status_code = entry.status_code
+        res.reason = entry.reason
+        res.headers = CaseInsensitiveDict(entry.headers)
+        res.url = url
+        res.encoding = get_encoding_from_headers(res.headers)
+        res.elapsed = timedelta(0)
+        res.request = requests.Request(entry.method, url).prepare()
+        return res
+
+
+HTTP_CACHE = HttpCache()
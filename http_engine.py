@@ -0,0 +1,444 @@
+import logging
+import queue
+import socket
+import threading
+import time
+from concurrent.futures import Executor, Future
+from http.cookiejar import DefaultCookiePolicy
+from multiprocessing import cpu_count
+from typing import Dict, Optional, Callable, Tuple, Any, Hashable
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import NewConnectionError
+
+from pool import TPE
+from response_body import ResponseBody, DownloadProgress, read_response_body
+from timings import RequestTimings
+
+log = logging.getLogger(__name__)
+
+# The request handle and timings for the request being sent on the current thread, see HttpEngine.fetch
+_current = threading.local()
+
+
+class RequestCancelled(Exception):
+    pass
+
+
+class SendQueueFull(Exception):
+    pass
+
+
+def _abort_connection(conn):
+    """Shuts down the socket of a connection, which wakes up any thread blocked reading from it."""
+    sock = getattr(conn, 'sock', None)
+    if sock is None:
+        return
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+
+
+class RequestHandle:
+    """
+    Handle to a request submitted through a SendQueue.
+
+    Cancelling it drops the request if it hasn't started yet, otherwise the
+    connection it's using is shut down, so the worker is released right away.
+    """
+
+    def __init__(self, key: Hashable, deadline: Optional[float] = None):
+        self.key = key
+        self.deadline = deadline
+        self.future: Optional[Future] = None
+        self.reason = 'Request cancelled'
+        self._cancelled = threading.Event()
+        self._lock = threading.Lock()
+        self._connections = []
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def cancel(self, reason: str = None):
+        with self._lock:
+            if self._cancelled.is_set():
+                return
+            self.reason = reason or self.reason
+            self._cancelled.set()
+            # Shut down under the lock, so a connection can't be given back to its pool in between
+            for conn in self._connections:
+                _abort_connection(conn)
+            self._connections = []
+
+        if self.future:
+            self.future.cancel()
+
+    def raise_if_cancelled(self):
+        if self.cancelled:
+            raise RequestCancelled(self.reason)
+
+    def attach_connection(self, conn):
+        with self._lock:
+            if not self._cancelled.is_set():
+                self._connections.append(conn)
+                return
+        _abort_connection(conn)
+
+    def detach_connection(self, conn):
+        """Called as a connection is given back to its pool, other requests may use it after this."""
+        with self._lock:
+            if conn in self._connections:
+                self._connections.remove(conn)
+
+    def detach_connections(self):
+        """Called once the request is finished with its connections, they may be used by other requests after this."""
+        with self._lock:
+            self._connections = []
+
+
+class HostStats:
+    def __init__(self):
+        self.requests = 0
+        self.connections_opened = 0
+        self.connections_reused = 0
+
+
+class EngineStats:
+    """Connection reuse counters for the http engine, aggregated and per host."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hosts: Dict[str, HostStats] = {}
+        self.idle_connections_closed = 0
+
+    def record_connection(self, host: str, reused: bool):
+        with self._lock:
+            stats = self.hosts.setdefault(host, HostStats())
+            stats.requests += 1
+            if reused:
+                stats.connections_reused += 1
+            else:
+                stats.connections_opened += 1
+
+    def record_idle_closed(self, count: int):
+        with self._lock:
+            self.idle_connections_closed += count
+
+    @property
+    def requests(self) -> int:
+        with self._lock:
+            return sum(h.requests for h in self.hosts.values())
+
+    @property
+    def connections_opened(self) -> int:
+        with self._lock:
+            return sum(h.connections_opened for h in self.hosts.values())
+
+    @property
+    def connections_reused(self) -> int:
+        with self._lock:
+            return sum(h.connections_reused for h in self.hosts.values())
+
+    @property
+    def hit_ratio(self) -> float:
+        with self._lock:
+            reqs = sum(h.requests for h in self.hosts.values())
+            reused = sum(h.connections_reused for h in self.hosts.values())
+        return reused / reqs if reqs else 0.0
+
+
+def _tracked_connection(base: type) -> type:
+    class TrackedConnection(base):
+        def _new_conn(self):
+            timings: Optional[RequestTimings] = getattr(_current, 'timings', None)
+            if timings is None:
+                return super(TrackedConnection, self)._new_conn()
+
+            # Resolve the host separately from connecting, so each can be timed.
+            host = self._dns_host
+            try:
+                addrs = list(dict.fromkeys(info[4][0] for info in socket.getaddrinfo(
+                    host, self.port, 0, socket.SOCK_STREAM)))
+            except socket.gaierror:
+                return super(TrackedConnection, self)._new_conn()  # Raises urllib3's resolution error
+            timings.mark('dns')
+
+            error = None
+            for addr in addrs:
+                self._dns_host = addr
+                try:
+                    sock = super(TrackedConnection, self)._new_conn()
+                    break
+                except NewConnectionError as e:
+                    error = e
+                finally:
+                    self._dns_host = host
+            else:
+                raise error
+
+            timings.mark('connect')
+            return sock
+
+        def connect(self):
+            super(TrackedConnection, self).connect()
+            timings: Optional[RequestTimings] = getattr(_current, 'timings', None)
+            if timings and isinstance(self, HTTPSConnection):
+                timings.mark('tls')
+            # The request may have been cancelled while connecting, before there was a socket to shut down.
+            handle: Optional[RequestHandle] = getattr(_current, 'handle', None)
+            if handle and handle.cancelled:
+                _abort_connection(self)
+
+        def request(self, *args, **kwargs):
+            super(TrackedConnection, self).request(*args, **kwargs)
+            # The headers and body have been written, what follows is waiting for the response.
+            timings: Optional[RequestTimings] = getattr(_current, 'timings', None)
+            if timings:
+                timings.mark('send')
+
+    return TrackedConnection
+
+
+def _tracked_pool(base: type, stats: EngineStats) -> type:
+    """Creates a connection pool class which reports reuse to stats and remembers when it was last used."""
+
+    class TrackedPool(base):
+        ConnectionCls = _tracked_connection(base.ConnectionCls)
+        last_used = 0.0
+
+        def _get_conn(self, timeout: float = None):
+            conn = super(TrackedPool, self)._get_conn(timeout)
+            self.last_used = time.monotonic()
+            handle: Optional[RequestHandle] = getattr(_current, 'handle', None)
+            if handle:
+                handle.attach_connection(conn)
+            # Pooled connections which are still alive keep their socket, new ones connect lazily.
+            reused = getattr(conn, 'sock', None) is not None
+            stats.record_connection(self.host, reused)
+            timings: Optional[RequestTimings] = getattr(_current, 'timings', None)
+            if timings:
+                # Preparing the request and waiting for a free connection, new ones connect after this.
+                timings.mark('queueing')
+                timings.connection_reused = reused
+            return conn
+
+        def _put_conn(self, conn):
+            # The connection's released as soon as the body has been read, before fetch returns.
+            handle: Optional[RequestHandle] = getattr(_current, 'handle', None)
+            if handle and conn is not None:
+                handle.detach_connection(conn)
+            super(TrackedPool, self)._put_conn(conn)
+
+        def close_idle_connections(self) -> int:
+            """Closes the kept-alive connections in this pool, leaving the pool itself usable."""
+            pool = self.pool
+            if pool is None:
+                return 0
+
+            closed = 0
+            for _ in range(pool.qsize()):
+                try:
+                    conn = pool.get(block=False)
+                except queue.Empty:
+                    break
+                if conn is not None and getattr(conn, 'sock', None) is not None:
+                    conn.close()
+                    closed += 1
+                # Free slots are represented by None, a new connection will be made when it's taken.
+                pool.put(None, block=False)
+
+            return closed
+
+    return TrackedPool
+
+
+class PooledAdapter(HTTPAdapter):
+    def __init__(self, stats: EngineStats, *args, **kwargs):
+        self.stats = stats
+        super(PooledAdapter, self).__init__(*args, **kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super(PooledAdapter, self).init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _tracked_pool(HTTPConnectionPool, self.stats),
+            'https': _tracked_pool(HTTPSConnectionPool, self.stats),
+        }
+
+    def close_idle_connections(self, idle_timeout: float) -> int:
+        now = time.monotonic()
+        pools = self.poolmanager.pools
+        # Read the container directly, looking a pool up moves it to the recently used end of the eviction order
+        with pools.lock:
+            idle = [pool for pool in pools._container.values() if now - pool.last_used >= idle_timeout]
+        return sum(pool.close_idle_connections() for pool in idle)
+
+
+class HttpEngine:
+    """
+    Shared http client for the application.
+
+    Keeps a bounded pool of keep-alive connections per host, so that repeated
+    requests to the same host skip the tcp and tls handshakes. Safe to use
+    from the worker threads in pool.TPE. Cookies are not persisted between
+    requests, so every send behaves as if it were made from a fresh session.
+    """
+
+    def __init__(self,
+                 max_hosts: int = 32,
+                 max_connections_per_host: int = 8,
+                 idle_timeout: float = 60.0):
+        self.idle_timeout = idle_timeout
+        self.stats = EngineStats()
+
+        self._adapter = PooledAdapter(self.stats, pool_connections=max_hosts,
+                                      pool_maxsize=max_connections_per_host)
+        self._session = requests.Session()
+        self._session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        self._session.mount('http://', self._adapter)
+        self._session.mount('https://', self._adapter)
+
+        self._closed = threading.Event()
+        self._reaper: Optional[threading.Thread] = None
+        self._reaper_lock = threading.Lock()
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        self._ensure_reaper()
+        return self._session.request(method, url, **kwargs)
+
+    def fetch(self,
+              method: str,
+              url: str,
+              handle: RequestHandle = None,
+              on_progress: Callable[[DownloadProgress], None] = None,
+              timings: RequestTimings = None,
+              **kwargs) -> Tuple[requests.Response, ResponseBody]:
+        """
+        Sends a request and streams its body, see read_response_body.
+        Raises RequestCancelled if the handle is cancelled or its deadline passes before the body is read.
+        The time spent in each phase of the request is recorded to timings.
+        """
+        timer = None
+        if handle:
+            handle.raise_if_cancelled()
+            if handle.deadline:
+                timer = threading.Timer(handle.deadline, handle.cancel,
+                                        (f'Request exceeded its deadline of {handle.deadline:g}s',))
+                timer.daemon = True
+                timer.start()
+
+        _current.handle = handle
+        _current.timings = timings
+        try:
+            res = self.request(method, url, stream=True, **kwargs)
+            if timings:
+                timings.mark('ttfb')
+            body = read_response_body(res, on_progress, check_cancelled=handle.raise_if_cancelled if handle else None)
+            if timer:
+                timer.cancel()
+            if timings:
+                timings.mark('download')
+            if handle:
+                handle.raise_if_cancelled()
+            return res, body
+        except RequestCancelled:
+            raise
+        except Exception as e:
+            if handle and handle.cancelled:
+                raise RequestCancelled(handle.reason) from e
+            raise
+        finally:
+            _current.handle = None
+            _current.timings = None
+            if handle:
+                handle.detach_connections()
+            if timer:
+                timer.cancel()
+
+    def close_idle_connections(self) -> int:
+        closed = self._adapter.close_idle_connections(self.idle_timeout)
+        if closed:
+            log.debug('Closed %d idle connections', closed)
+            self.stats.record_idle_closed(closed)
+        return closed
+
+    def close(self):
+        self._closed.set()
+        self._session.close()
+
+    def _ensure_reaper(self):
+        if self._reaper or self.idle_timeout <= 0:
+            return
+        with self._reaper_lock:
+            if self._reaper:
+                return
+            self._reaper = threading.Thread(target=self._reap_idle_connections, name='http-engine-reaper', daemon=True)
+            self._reaper.start()
+
+    def _reap_idle_connections(self):
+        interval = max(self.idle_timeout / 2, 1.0)
+        while not self._closed.wait(interval):
+            try:
+                self.close_idle_connections()
+            except Exception as e:
+                log.error('Failed to close idle connections %s', e)
+
+
+class SendQueue:
+    """
+    Runs requests on an executor, bounding how many may be pending at once.
+
+    Sends are keyed by their source (e.g. the request being edited), a new send
+    for a key cancels the one still in flight for it, so repeated sends coalesce
+    into the latest one instead of queueing up behind each other.
+    """
+
+    def __init__(self, executor: Executor, max_pending: int):
+        self.executor = executor
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._handles: Dict[Hashable, RequestHandle] = {}
+
+    def submit(self, key: Hashable, fn: Callable[[RequestHandle], Any], deadline: float = None) -> RequestHandle:
+        with self._lock:
+            previous = self._handles.pop(key, None)
+            if previous:
+                previous.cancel('Superseded by a newer request')
+
+            if len(self._handles) >= self.max_pending:
+                raise SendQueueFull(f'Too many requests in flight ({len(self._handles)}), try again shortly.')
+
+            handle = RequestHandle(key, deadline)
+            self._handles[key] = handle
+
+        handle.future = self.executor.submit(self._run, handle, fn)
+        # Frees the slot once the request's done, or once it's cancelled while still queued, when _run never runs.
+        handle.future.add_done_callback(lambda future: self._release(handle))
+        return handle
+
+    def cancel(self, key: Hashable):
+        with self._lock:
+            handle = self._handles.pop(key, None)
+        if handle:
+            handle.cancel()
+
+    def __len__(self):
+        return len(self._handles)
+
+    @staticmethod
+    def _run(handle: RequestHandle, fn: Callable[[RequestHandle], Any]):
+        if not handle.cancelled:
+            return fn(handle)
+
+    def _release(self, handle: RequestHandle):
+        with self._lock:
+            if self._handles.get(handle.key) is handle:
+                del self._handles[handle.key]
+
+
+HTTP_ENGINE = HttpEngine()
+SEND_QUEUE = SendQueue(TPE, max_pending=cpu_count() * 4)
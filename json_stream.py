@@ -0,0 +1,326 @@
+import json
+import operator
+import re
+from functools import lru_cache
+from typing import List, Optional, Iterator, Tuple, Generator, Any, Callable
+
+from line_index import BytesLike
+
+# A subset of jsonpath which can be evaluated in one pass over a json document, without parsing it:
+# $, .name, ['name'], .*, [*], [index], [start:stop:step], and filters like [?(@.a.b < 3)] or [?(@.a)].
+# Recursive descent (..) and unions aren't supported.
+
+_STRING_PATTERN = rb'"[^"\\]*(?:\\.[^"\\]*)*"'
+# Values nested at most this deep, and shorter than _SKIP_WINDOW, are skipped by a single match,
+# anything else a bracket at a time.
+_SKIP_DEPTH = 8
+_SKIP_WINDOW = 64 * 1024
+
+try:
+    re.compile(rb'a++')
+    _POSSESSIVE = True
+except re.error:
+    _POSSESSIVE = False  # Before python 3.11, the skip patterns are slower without them
+
+
+def _container_patterns(depth: int) -> Tuple[bytes, bytes]:
+    """
+    Matches a json container nested at most depth deep, and the rest of one from inside it.
+    The brackets aren't paired up by type. Each alternative starts with a different character,
+    so a failed match doesn't backtrack exponentially.
+    """
+    run, repeat = (rb'[^"\[\]{}]++', rb')*+') if _POSSESSIVE else (rb'[^"\[\]{}]', rb')*')
+    container = None
+    for _ in range(depth):
+        nested = rb'|' + container if container else b''
+        rest = rb'(?:' + run + rb'|' + _STRING_PATTERN + nested + repeat + rb'[\]}]'
+        container = rb'[\[{]' + rest
+    return container, rest
+
+
+_CONTAINER_PATTERN, _REST_PATTERN = _container_patterns(_SKIP_DEPTH)
+_WS = re.compile(rb'[ \t\n\r]*')
+_STRING = re.compile(_STRING_PATTERN)
+_VALUE = re.compile(rb'(?:' + _CONTAINER_PATTERN + rb'|' + _STRING_PATTERN + rb'|[^,\[\]{}"\s][^,\]}\s]*)')
+_REST = re.compile(_REST_PATTERN)
+_KEY = re.compile(rb'(' + _STRING_PATTERN + rb')[ \t\n\r]*:[ \t\n\r]*')
+# Everything up to the next bracket which isn't in a string, strings are skipped whole.
+_SKIP = re.compile(rb'(?:[^"\[\]{}]+|' + _STRING_PATTERN + rb')*')
+_MEMBER_SEPARATOR = re.compile(rb'[ \t\n\r]*(?:,[ \t\n\r]*|(?=[\]}]))')
+
+_NAME = r'[^\W\d][\w-]*'
+_QUOTED = r'"(?:[^"\\]|\\.)*"|\'(?:[^\'\\]|\\.)*\''
+_STEP = re.compile(rf'''
+    \.(?P<name>{_NAME})
+  | \[\s*(?P<quoted>{_QUOTED})\s*\]
+  | (?P<wildcard>\.\*|\[\s*\*\s*\])
+  | \[\s*(?P<index>-?\d+)\s*\]
+  | \[\s*(?P<start>-?\d*)\s*:\s*(?P<stop>-?\d*)\s*(?::\s*(?P<step>-?\d*)\s*)?\]
+  | \[\s*\?\(\s*(?P<filter>.*?)\s*\)\s*\]
+''', re.VERBOSE)
+_FILTER = re.compile(rf'''
+    @(?P<path>(?:\.{_NAME}|\[\s*(?:-?\d+|{_QUOTED})\s*\])*)
+    (?:\s*(?P<op>==|!=|<=|>=|<|>)\s*(?P<value>{_QUOTED}|-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?|true|false|null))?$
+''', re.VERBOSE)
+
+_OPS = {'==': operator.eq, '!=': operator.ne, '<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge}
+
+
+class Child:
+    def __init__(self, name: str):
+        self.name = name
+        self.raw = json.dumps(name, ensure_ascii=False).encode('utf-8')  # The key as it usually appears
+
+
+class Wildcard:
+    pass
+
+
+class Index:
+    def __init__(self, index: int):
+        self.index = index
+
+
+class Slice:
+    def __init__(self, start: Optional[int], stop: Optional[int], step: Optional[int]):
+        if step is not None and step <= 0:
+            raise ValueError('Only positive slice steps are supported for large responses')
+        self.start, self.stop, self.step = start, stop, step or 1
+
+    def indexes(self, length: Optional[int]) -> range:
+        """The indexes selected, the length is only needed if start or stop count from the end."""
+        if length is not None:
+            return range(*slice(self.start, self.stop, self.step).indices(length))
+        return range(self.start or 0, self.stop if self.stop is not None else 2 ** 63, self.step)
+
+    @property
+    def needs_length(self) -> bool:
+        return (self.start or 0) < 0 or (self.stop or 0) < 0
+
+
+class Filter:
+    """Keeps the members for which the value at path compares to value, or exists if there's no comparison."""
+
+    def __init__(self, path: List, op: Optional[str], value: Any):
+        self.path = path
+        self.op = op
+        self.value = value
+
+    def test(self, found: Any) -> bool:
+        if self.op is None:
+            return True
+        try:
+            return _OPS[self.op](found, self.value)
+        except TypeError:
+            return False  # e.g. comparing a string to a number
+
+
+def _unquote(quoted: str) -> str:
+    if quoted.startswith("'"):
+        quoted = '"' + quoted[1:-1].replace('\\\'', '\'').replace('"', '\\"') + '"'
+    return json.loads(quoted)
+
+
+def _parse_steps(path: str, pos: int = 0) -> List:
+    steps = []
+    while pos < len(path):
+        if path.startswith('..', pos):
+            raise ValueError('Recursive descent (..) isn\'t supported for large responses')
+        match = _STEP.match(path, pos)
+        if not match:
+            raise ValueError(f'Unsupported jsonpath for large responses at: {path[pos:]}')
+        pos = match.end()
+
+        if match.group('name') or match.group('quoted'):
+            steps.append(Child(match.group('name') or _unquote(match.group('quoted'))))
+        elif match.group('wildcard'):
+            steps.append(Wildcard())
+        elif match.group('index') is not None:
+            steps.append(Index(int(match.group('index'))))
+        elif match.group('filter') is not None:
+            steps.append(_parse_filter(match.group('filter')))
+        else:
+            start, stop, step = (match.group(g) for g in ('start', 'stop', 'step'))
+            steps.append(Slice(int(start) if start else None, int(stop) if stop else None,
+                               int(step) if step else None))
+    return steps
+
+
+def _parse_filter(expr: str) -> Filter:
+    match = _FILTER.match(expr)
+    if not match:
+        raise ValueError(f'Unsupported filter for large responses: {expr}')
+
+    path = _parse_steps(match.group('path'))
+    if any(not isinstance(step, (Child, Index)) for step in path):
+        raise ValueError(f'Filters may only use names and indexes: {expr}')
+    value = match.group('value')
+    if value is not None:
+        value = _unquote(value) if value[0] in '"\'' else json.loads(value)
+    return Filter(path, match.group('op'), value)
+
+
+@lru_cache(maxsize=128)
+def parse_streaming_path(expr: str) -> List:
+    """Parses the supported subset of jsonpath, raises ValueError for anything else."""
+    expr = expr.strip()
+    if expr.startswith('$'):
+        expr = expr[1:]
+    elif expr and expr[0] not in '.[':
+        expr = '.' + expr  # Like jsonpath_rw, a leading name is relative to the root
+    return _parse_steps(expr)
+
+
+class JsonScanner:
+    """
+    Finds the values matching a path in a json document, without parsing it.
+
+    The document is scanned once, values which can't match are skipped over by
+    regular expressions, so only the matches themselves are ever decoded. Once no more
+    matches are possible the rest of the document isn't scanned. Values are assumed to
+    be valid json, an invalid document may give nonsense matches.
+    """
+
+    def __init__(self, buf: BytesLike, is_cancelled: Callable[[], bool] = None):
+        self.buf = buf
+        self.is_cancelled = is_cancelled
+
+    def find(self, steps: List) -> Iterator[Tuple[int, int]]:
+        """The (start, end) offsets of the matches, in document order, as they're found."""
+        start = self._ws(0)
+        if start < len(self.buf):
+            yield from self._walk(start, steps, 0, need_end=False)
+
+    def _ws(self, pos: int) -> int:
+        return _WS.match(self.buf, pos).end()
+
+    def _value_end(self, pos: int) -> int:
+        match = _VALUE.match(self.buf, pos, pos + _SKIP_WINDOW)
+        if match:
+            return match.end()
+
+        c = self.buf[pos:pos + 1]
+        if c in (b'{', b'['):
+            return self._container_end(pos + 1)  # Too large or too deep for a single match
+        if c == b'"':
+            return _STRING.match(self.buf, pos).end()
+        raise ValueError(f'Invalid json at offset {pos}')
+
+    def _container_end(self, pos: int) -> int:
+        """Where the container pos is inside of ends."""
+        match = _REST.match(self.buf, pos, pos + _SKIP_WINDOW)
+        if match:
+            return match.end()
+
+        buf, depth = self.buf, 1
+        while depth:
+            if self.is_cancelled and self.is_cancelled():
+                raise InterruptedError('Filter cancelled')
+            pos = _SKIP.match(buf, pos, pos + _SKIP_WINDOW).end()
+            c = buf[pos:pos + 1]
+            if c in (b'{', b'['):
+                depth += 1
+            elif c in (b'}', b']'):
+                depth -= 1
+            elif c == b'"':
+                pos = _STRING.match(buf, pos).end()  # Longer than the skip window
+                continue
+            elif not c:
+                raise ValueError('Unexpected end of json')
+            else:
+                continue  # The skip window ended in the middle of a run
+            pos += 1
+        return pos
+
+    def _members(self, pos: int, close: bytes) -> Iterator[int]:
+        """
+        Where each member of the container at pos starts. The caller sets self._end to where
+        each member ends before moving to the next one, and finds where the container ends from the last.
+        """
+        member = self._ws(pos + 1)
+        if self.buf[member:member + 1] == close:
+            self._end = member
+            return
+        while True:
+            if self.is_cancelled and self.is_cancelled():
+                raise InterruptedError('Filter cancelled')
+            yield member
+            member = _MEMBER_SEPARATOR.match(self.buf, self._end).end()
+            if self.buf[member:member + 1] == close:
+                self._end = member
+                return
+
+    def _array_length(self, pos: int) -> int:
+        length = 0
+        for member in self._members(pos, b']'):
+            self._end = self._value_end(member)
+            length += 1
+        return length
+
+    def _walk(self, pos: int, steps: List, i: int, need_end: bool = True) -> Generator[Tuple[int, int], None, int]:
+        """
+        Yields the matches of steps[i:] in the value at pos, returns where the value ends.
+        If the end isn't needed it stops once there can't be any more matches, and returns None.
+        """
+        if i == len(steps):
+            end = self._value_end(pos)
+            yield pos, end
+            return end
+
+        step = steps[i]
+        c = self.buf[pos:pos + 1]
+        if c == b'{' and isinstance(step, (Child, Wildcard, Filter)):
+            return (yield from self._walk_object(pos, steps, i, need_end))
+        if c == b'[' and isinstance(step, (Wildcard, Index, Slice, Filter)):
+            return (yield from self._walk_array(pos, steps, i, need_end))
+        return self._value_end(pos) if need_end else None
+
+    def _walk_object(self, pos: int, steps: List, i: int, need_end: bool) -> Generator[Tuple[int, int], None, int]:
+        step = steps[i]
+        name = step.raw if isinstance(step, Child) else None
+        for member in self._members(pos, b'}'):
+            key_match = _KEY.match(self.buf, member)
+            value = key_match.end()
+            if name is not None:
+                key = key_match.group(1)
+                if key == name or (b'\\' in key and json.loads(key) == step.name):
+                    # Keys are unique, the rest of the object can be skipped.
+                    end = yield from self._walk(value, steps, i + 1, need_end)
+                    return self._container_end(end) if need_end else None
+                self._end = self._value_end(value)
+            elif isinstance(step, Filter) and not self._test(value, step):
+                self._end = self._value_end(value)
+            else:
+                self._end = yield from self._walk(value, steps, i + 1)
+        return self._end + 1 if need_end else None
+
+    def _walk_array(self, pos: int, steps: List, i: int, need_end: bool) -> Generator[Tuple[int, int], None, int]:
+        step = steps[i]
+        wanted: Optional[range] = None
+        if isinstance(step, Index):
+            index = step.index + self._array_length(pos) if step.index < 0 else step.index
+            wanted = range(index, index + 1) if index >= 0 else range(0)
+        elif isinstance(step, Slice):
+            wanted = step.indexes(self._array_length(pos) if step.needs_length else None)
+
+        for idx, member in enumerate(self._members(pos, b']')):
+            if wanted is not None and (not wanted or idx > wanted[-1]):
+                # Past the last wanted index
+                return self._container_end(member) if need_end else None
+            if wanted is not None and idx not in wanted:
+                self._end = self._value_end(member)
+            elif isinstance(step, Filter) and not self._test(member, step):
+                self._end = self._value_end(member)
+            else:
+                self._end = yield from self._walk(member, steps, i + 1)
+        return self._end + 1 if need_end else None
+
+    def _test(self, pos: int, step: Filter) -> bool:
+        matches = self._walk(pos, step.path, 0, need_end=False)
+        try:
+            start, end = next(matches)
+        except StopIteration:
+            return False
+        finally:
+            matches.close()
+        return step.test(json.loads(self.buf[start:end]))
@@ -0,0 +1,106 @@
+import logging
+import mmap
+import re
+import threading
+from array import array
+from bisect import bisect_right
+from itertools import islice
+from typing import Optional, Tuple, Union
+
+from response_body import BodyHold
+
+log = logging.getLogger(__name__)
+
+BytesLike = Union[bytes, bytearray, mmap.mmap]
+
+
+class LineIndex:
+    """
+    Sparse index of where lines start in a body.
+
+    Only the offset of every stride'th line is kept, so the index of a 1 GB body is
+    a few hundred KB. Looking up any other line scans forward from the nearest
+    indexed one. The index is built incrementally by build, usually from a worker,
+    and can be queried while it's being built. If buf is a body's, hold keeps it open while it's built.
+    """
+
+    def __init__(self, buf: BytesLike, stride: int = 1024, hold: BodyHold = None):
+        self.buf = buf
+        self.hold = hold or BodyHold()
+        self.stride = stride
+        self.offsets = array('Q', [0])  # offsets[i] is where line i * stride starts
+        self.line_count: Optional[int] = None  # Known once the index is built
+        self.done = threading.Event()
+        self._cancelled = False
+
+    def build(self):
+        with self.hold.use() as usable:
+            if usable:
+                self._build()
+
+    def _build(self):
+        # Scanning for each newline happens in C, only every stride'th one is handed back to python.
+        newlines = re.finditer(b'\n', self.buf)
+        for match in islice(newlines, self.stride - 1, None, self.stride):
+            if self._cancelled:
+                log.debug('Cancelled building line index at %d', match.end())
+                return
+            self.offsets.append(match.end())
+
+        size = len(self.buf)
+        newline_count = (len(self.offsets) - 1) * self.stride + count_newlines(self.buf, self.offsets[-1], size)
+        if len(self.offsets) > 1 and self.offsets[-1] == size:
+            self.offsets.pop()  # The body ends with a newline, there's no line after it
+        self.line_count = newline_count + (1 if size and self.buf[size - 1:] != b'\n' else 0)
+        self.done.set()
+
+    def cancel(self):
+        """Stops building the index, the body is released once the build in progress stops."""
+        self._cancelled = True
+        self.hold.close()
+
+    @property
+    def indexed_lines(self) -> int:
+        """Lines which can be looked up so far."""
+        return self.line_count if self.done.is_set() else (len(self.offsets) - 1) * self.stride
+
+    def offset_of_line(self, line: int) -> Optional[int]:
+        """Where the 0 based line starts, None if it's past the end or not indexed yet."""
+        if line < 0 or line >= max(self.indexed_lines, 1):
+            return None
+
+        offset = self.offsets[line // self.stride]
+        for _ in range(line % self.stride):
+            offset = self.buf.find(b'\n', offset) + 1
+        return offset
+
+    def line_of_offset(self, offset: int) -> Optional[int]:
+        """The 0 based line containing offset, None if that part of the body isn't indexed yet."""
+        block = bisect_right(self.offsets, offset) - 1
+        if block == len(self.offsets) - 1 and not self.done.is_set():
+            return None
+        return block * self.stride + count_newlines(self.buf, self.offsets[block], offset)
+
+
+def count_newlines(buf: BytesLike, start: int, end: int, chunk_size: int = 1024 * 1024) -> int:
+    """Counts newlines in buf[start:end], a chunk at a time so a long range isn't copied at once."""
+    return sum(buf[pos:min(pos + chunk_size, end)].count(b'\n') for pos in range(start, end, chunk_size))
+
+
+def read_window(buf: BytesLike, offset: int, max_bytes: int) -> Tuple[int, int]:
+    """
+    The (start, end) of at most max_bytes of whole lines around offset. The start is moved back
+    to the beginning of its line, a single line longer than max_bytes is cut.
+    """
+    size = len(buf)
+    offset = max(0, min(offset, size))
+    start = buf.rfind(b'\n', max(0, offset - max_bytes), offset) + 1 if offset else 0
+    if start == 0 and offset > max_bytes:
+        start = offset  # No line start within reach, show the middle of the long line
+
+    end = min(size, start + max_bytes)
+    if end < size:
+        last_newline = buf.rfind(b'\n', start, end)
+        if last_newline >= start:
+            end = last_newline + 1
+    return start, end
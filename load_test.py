@@ -0,0 +1,239 @@
+import logging
+import math
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+from datetime import timedelta
+from typing import Optional, Callable, Dict, List, Tuple
+
+from aio_engine import create_request_engine
+from utils import timedelta_fmt
+
+log = logging.getLogger(__name__)
+
+MAX_CONCURRENCY = 10000
+
+
+class LatencyHistogram:
+    """
+    Log bucketed latency histogram.
+
+    Latencies are recorded into buckets which are precision wide relative to their
+    value, so percentiles are accurate to within precision regardless of how many
+    samples have been recorded. The max is exact.
+    """
+
+    def __init__(self, precision: float = 0.01):
+        self.precision = precision
+        self._log_base = math.log1p(precision)
+        self.buckets: Dict[int, int] = {}
+        self.count = 0
+        self.max = 0.0
+
+    def record(self, seconds: float):
+        micros = max(seconds * 1e6, 1.0)
+        idx = int(math.log(micros) / self._log_base)
+        self.buckets[idx] = self.buckets.get(idx, 0) + 1
+        self.count += 1
+        self.max = max(self.max, seconds)
+
+    def percentile(self, pct: float) -> float:
+        """The latency in seconds below which pct percent of samples fall."""
+        if not self.count:
+            return 0.0
+
+        rank = max(1, math.ceil(self.count * pct / 100))
+        seen = 0
+        for idx in sorted(self.buckets):
+            seen += self.buckets[idx]
+            if seen >= rank:
+                # Report the upper bound of the bucket, capped at the real max.
+                return min(math.exp((idx + 1) * self._log_base) / 1e6, self.max)
+        return self.max
+
+    def copy(self) -> 'LatencyHistogram':
+        hist = LatencyHistogram(self.precision)
+        hist.buckets = dict(self.buckets)
+        hist.count = self.count
+        hist.max = self.max
+        return hist
+
+
+class LoadTestStats:
+    def __init__(self):
+        self.histogram = LatencyHistogram()
+        self.outcomes: Counter = Counter()  # Status code, or exception name for failed requests
+        self.bytes_received = 0
+        self.elapsed = 0.0
+        self.done = False
+
+    @property
+    def completed(self) -> int:
+        return sum(self.outcomes.values())
+
+    @property
+    def errors(self) -> int:
+        return sum(n for outcome, n in self.outcomes.items() if not (type(outcome) is int and outcome < 400))
+
+    @property
+    def throughput(self) -> float:
+        """Completed requests per second."""
+        return self.completed / self.elapsed if self.elapsed > 0 else 0.0
+
+    def percentiles(self) -> List[Tuple[str, float]]:
+        hist = self.histogram
+        return [('p50', hist.percentile(50)), ('p90', hist.percentile(90)),
+                ('p99', hist.percentile(99)), ('max', hist.max)]
+
+    def format_latencies(self) -> str:
+        return ' '.join(f'{name} {timedelta_fmt(timedelta(seconds=val))}' for name, val in self.percentiles())
+
+    def format_report(self) -> str:
+        lines = [
+            f'Requests:    {self.completed} ({self.errors} errors)',
+            f'Duration:    {timedelta_fmt(timedelta(seconds=self.elapsed))}',
+            f'Throughput:  {self.throughput:.1f} req/s',
+            '',
+            'Latency',
+        ]
+        lines += [f'  {name:<5} {timedelta_fmt(timedelta(seconds=val))}' for name, val in self.percentiles()]
+        lines += ['', 'Responses']
+        for outcome, n in sorted(self.outcomes.items(), key=lambda o: str(o[0])):
+            lines.append(f'  {str(outcome):<24} {n}')
+
+        return '\n'.join(lines)
+
+    def copy(self) -> 'LoadTestStats':
+        stats = LoadTestStats()
+        stats.histogram = self.histogram.copy()
+        stats.outcomes = Counter(self.outcomes)
+        stats.bytes_received = self.bytes_received
+        stats.elapsed = self.elapsed
+        stats.done = self.done
+        return stats
+
+
+class LoadTest:
+    """
+    Sends the same request repeatedly with concurrency requests in flight, either
+    total_requests times or for duration seconds, whichever ends first.
+
+    on_progress receives a copy of the stats every report_interval seconds and once
+    more when the test is done, so the ui gets a bounded number of updates however
+    fast requests complete.
+    """
+
+    def __init__(self,
+                 method: str,
+                 url: str,
+                 total_requests: Optional[int] = None,
+                 duration: Optional[float] = None,
+                 concurrency: int = 1,
+                 on_progress: Callable[[LoadTestStats], None] = None,
+                 report_interval: float = 0.25,
+                 **request_kwargs):
+        if not total_requests and not duration:
+            raise ValueError('A load test needs a number of requests or a duration')
+
+        self.method = method
+        self.url = url
+        self.request_kwargs = request_kwargs
+        self.total_requests = total_requests
+        self.duration = duration
+        self.concurrency = max(1, min(concurrency, MAX_CONCURRENCY))
+        self.on_progress = on_progress
+        self.report_interval = report_interval
+
+        # A dedicated engine keeps one connection per worker, without evicting the app's pooled connections.
+        self.engine = create_request_engine(self.concurrency)
+        self.stats = LoadTestStats()
+        self._lock = threading.Lock()
+        self._started = 0
+        self._start_time = 0.0
+        self._running = 0
+        self._stop = threading.Event()
+        self._workers_done = threading.Event()
+        self._finished = threading.Event()
+
+    def start(self):
+        log.info('Starting load test of %s %s, concurrency %d', self.method, self.url, self.concurrency)
+        self._start_time = time.monotonic()
+        self._running = self.concurrency
+        for _ in range(self.concurrency):
+            self._send_next()
+        threading.Thread(target=self._report, name='load-test-reporter', daemon=True).start()
+
+    def run(self) -> LoadTestStats:
+        self.start()
+        return self.wait()
+
+    def wait(self, timeout: float = None) -> LoadTestStats:
+        self._finished.wait(timeout)
+        return self.snapshot()
+
+    def cancel(self):
+        self._stop.set()
+
+    def snapshot(self) -> LoadTestStats:
+        with self._lock:
+            if not self.stats.done:
+                self.stats.elapsed = time.monotonic() - self._start_time
+            return self.stats.copy()
+
+    def _next(self) -> bool:
+        """Claims the next request to send, if the test isn't over."""
+        if self._stop.is_set():
+            return False
+        if self.duration and time.monotonic() - self._start_time >= self.duration:
+            return False
+        with self._lock:
+            if self.total_requests and self._started >= self.total_requests:
+                return False
+            self._started += 1
+        return True
+
+    def _send_next(self):
+        """Each of the concurrency workers is a chain of requests, each sent when the previous one completes."""
+        if not self._next():
+            with self._lock:
+                self._running -= 1
+                if not self._running:
+                    self._workers_done.set()
+            return
+
+        start = time.perf_counter()
+        self.engine.submit(self.method, self.url, lambda future: self._handle_response(future, start),
+                           **self.request_kwargs)
+
+    def _handle_response(self, future: Future, start: float):
+        size = 0
+        try:
+            res = future.result()
+            size = len(res.content)
+            outcome = res.status_code
+            latency = res.elapsed.total_seconds()
+        except Exception as e:
+            outcome = type(e).__name__
+            latency = time.perf_counter() - start
+
+        with self._lock:
+            self.stats.histogram.record(latency)
+            self.stats.outcomes[outcome] += 1
+            self.stats.bytes_received += size
+
+        self._send_next()
+
+    def _report(self):
+        while not self._workers_done.wait(self.report_interval):
+            if self.on_progress:
+                self.on_progress(self.snapshot())
+
+        with self._lock:
+            self.stats.elapsed = time.monotonic() - self._start_time
+            self.stats.done = True
+        self.engine.close()
+        self._finished.set()
+        log.info('Load test of %s finished, %d requests', self.url, self.stats.completed)
+        if self.on_progress:
+            self.on_progress(self.snapshot())
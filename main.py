@@ -1,12 +1,7 @@
+import argparse
 import logging
 
-import gi
-gi.require_version("Gtk", "3.0")
-gi.require_version('GtkSource', '4')
-gi.require_version('WebKit2', '4.0')  # TODO: Ensure we don't crash if webkit isn't available
-from gi.repository import Gtk, GtkSource, Gdk
-
-from widgets.main_window import MainWindow
+from startup_profile import StartupProfiler
 
 logging.basicConfig(
     format='%(asctime)s - %(module)s - [%(levelname)s] %(message)s',
@@ -16,9 +11,17 @@ logging.basicConfig(
 log = logging.getLogger(__name__)
 
 
+def parse_args():
+    parser = argparse.ArgumentParser(description='Repose http client')
+    parser.add_argument('--startup-profile', action='store_true',
+                        help='Log how long each phase of startup and each import takes')
+    return parser.parse_args()
+
+
 def create_non_gtk_widgets():
-    sv = GtkSource.View()
-    sv.destroy()
+    # Registers the type so templates can use it, without building a throwaway view.
+    from gi.repository import GObject, GtkSource
+    GObject.type_ensure(GtkSource.View)
 
 
 # Can we do this during install?
@@ -29,19 +32,65 @@ def create_user_dirs():
 # TODO: Loading screen for starting db, creating user dirs etc?
 
 
-if __name__ == '__main__':
+def main():
+    args = parse_args()
+    profiler = StartupProfiler(enabled=args.startup_profile)
+    profiler.install_import_timer()
+
+    with profiler.phase('Import gtk'):
+        import gi
+        gi.require_version("Gtk", "3.0")
+        gi.require_version('GtkSource', '4')
+        try:
+            # Only imported once an html response is previewed.
+            gi.require_version('WebKit2', '4.0')
+        except ValueError as e:
+            log.warning('WebKit is unavailable, html responses won\'t be previewed: %s', e)
+        from gi.repository import Gtk, Gdk, GLib
+
+    with profiler.phase('Import application'):
+        from db import DB_EXECUTOR, SAVE_QUEUE
+        from history import HISTORY
+        from http_engine import HTTP_ENGINE
+        from widgets.main_window import MainWindow
+
     create_user_dirs()
     log.info('Bootstrapping gtk resources.')
-    create_non_gtk_widgets()
+    with profiler.phase('Register widgets and styles'):
+        create_non_gtk_widgets()
 
-    css_provider = Gtk.CssProvider()
-    css_provider.load_from_path('ui/style.css')
+        css_provider = Gtk.CssProvider()
+        css_provider.load_from_path('ui/style.css')
 
-    Gtk.StyleContext().add_provider_for_screen(
-        Gdk.Screen().get_default(),
-        css_provider,
-        Gtk.STYLE_PROVIDER_PRIORITY_APPLICATION)
+        Gtk.StyleContext().add_provider_for_screen(
+            Gdk.Screen().get_default(),
+            css_provider,
+            Gtk.STYLE_PROVIDER_PRIORITY_APPLICATION)
+
+    with profiler.phase('Create main window'):
+        window = MainWindow()
+
+    def on_first_draw(*args):
+        window.disconnect(draw_handler)
+        profiler.mark('First frame drawn')
+        # Idle callbacks run once the main loop has nothing else to do, i.e. the window responds to input.
+        GLib.idle_add(on_interactive, priority=GLib.PRIORITY_LOW)
+        return False
+
+    def on_interactive():
+        profiler.mark('Interactive')
+        profiler.log_report()
+        return False
+
+    draw_handler = window.connect_after('draw', on_first_draw)
 
-    MainWindow()
     log.info('Starting application.')
     Gtk.main()
+    HTTP_ENGINE.close()
+    HISTORY.flush()
+    SAVE_QUEUE.flush()
+    DB_EXECUTOR.shutdown(wait=True)
+
+
+if __name__ == '__main__':
+    main()
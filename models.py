@@ -1,5 +1,8 @@
 from uuid import uuid1
 from typing import Dict, List, Tuple, Optional
+from urllib.parse import urlsplit
+
+from config import DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT, DEFAULT_REQUEST_DEADLINE
 
 
 class MainModel:
@@ -16,6 +19,10 @@ class RequestModel:
                  params: List[Tuple[str, str, str]] = None,
                  request_headers: List[Tuple[str, str, str]] = None,
                  saved: bool = False,
+                 connect_timeout: float = DEFAULT_CONNECT_TIMEOUT,
+                 read_timeout: float = DEFAULT_READ_TIMEOUT,
+                 deadline: Optional[float] = DEFAULT_REQUEST_DEADLINE,
+                 use_cache: bool = False,
                  ):
         self.url = url
         self.method = method
@@ -24,11 +31,24 @@ class RequestModel:
         self.request_body = request_body
         self.request_headers = request_headers or [('', '', '')]
         self.saved = saved
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.deadline = deadline
+        self.use_cache = use_cache
 
 
 class FolderModel:
-    def __init__(self, name: str):
+    def __init__(self, name: str, ordered: bool = False):
         self.name = name
+        self.ordered = ordered  # Run children one after another, instead of in parallel
+
+
+class RequestSummary:
+    """What the tree shows of a request, its node's request is only loaded once it's needed."""
+
+    def __init__(self, name: str, method: str):
+        self.name = name
+        self.method = method
 
 
 class RequestTreeNode:
@@ -39,9 +59,10 @@ class RequestTreeNode:
                  parent=None,
                  collection=None,
                  request: Optional[RequestModel] = None,
-                 folder: Optional[FolderModel] = None
+                 folder: Optional[FolderModel] = None,
+                 summary: Optional[RequestSummary] = None
                  ):
-        assert request or folder
+        assert request or folder or summary
 
         self.pk = pk or str(uuid1())
         self.parent_pk = parent_pk
@@ -50,11 +71,28 @@ class RequestTreeNode:
         self.collection = collection
         self.folder = folder
         self.request = request
+        self.summary = summary
         self.children = []
 
     def is_folder(self) -> bool:
         return self.folder is not None
 
+    def is_loaded(self) -> bool:
+        """False for requests loaded as a summary, see RequestLoader."""
+        return self.folder is not None or self.request is not None
+
+    @property
+    def name(self) -> str:
+        if self.folder:
+            return self.folder.name
+        return self.request.name if self.request else self.summary.name
+
+    @property
+    def method(self) -> Optional[str]:
+        if self.folder:
+            return None
+        return self.request.method if self.request else self.summary.method
+
     def add_child(self, node):
         assert self.is_folder()
         node.parent = self
@@ -75,3 +113,37 @@ class CollectionModel:
         node.collection = self
         node.collection_pk = self.pk
         self.nodes.append(node)
+
+
+class HistoryEntry:
+    """A request as it was sent, and a summary of its response. The body is loaded separately."""
+
+    def __init__(self,
+                 method: str,
+                 url: str,
+                 request: RequestModel,
+                 sent_at: float,
+                 status_code: Optional[int] = None,
+                 reason: str = '',
+                 response_headers: Dict[str, str] = None,
+                 timings: Dict = None,
+                 body_size: int = 0,
+                 body_hash: Optional[str] = None,
+                 error: Optional[str] = None,
+                 pk: Optional[int] = None):
+        self.pk = pk
+        self.method = method
+        self.url = url
+        self.request = request
+        self.sent_at = sent_at
+        self.status_code = status_code
+        self.reason = reason
+        self.response_headers = response_headers or {}
+        self.timings = timings or {}
+        self.body_size = body_size
+        self.body_hash = body_hash
+        self.error = error
+
+    @property
+    def host(self) -> str:
+        return urlsplit(self.url).hostname or ''
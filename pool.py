@@ -1,4 +1,56 @@
+import multiprocessing
+import threading
+from concurrent.futures.process import ProcessPoolExecutor
 from concurrent.futures.thread import ThreadPoolExecutor
 from multiprocessing import cpu_count
+from typing import Callable, List, Any, Optional
 
 TPE = ThreadPoolExecutor(max_workers=cpu_count())
+
+_process_pool: Optional[ProcessPoolExecutor] = None
+_process_pool_lock = threading.Lock()
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """
+    Process pool for cpu bound work on large inputs, which would hold the GIL for too long in a thread.
+    Started on first use, with spawned processes since forking a process running gtk isn't safe.
+    """
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(max_workers=max(1, min(cpu_count() // 2, 4)),
+                                                mp_context=multiprocessing.get_context('spawn'))
+        return _process_pool
+
+
+class CompletionBatcher:
+    """
+    Collects completions from worker threads and hands them to on_batch in batches,
+    at most once per interval, so a burst of completions doesn't flood the main loop.
+    """
+
+    def __init__(self, on_batch: Callable[[List[Any]], None], interval: float = 0.1):
+        self.on_batch = on_batch
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._items: List[Any] = []
+        self._timer = None
+
+    def add(self, item: Any):
+        with self._lock:
+            self._items.append(item)
+            if self._timer:
+                return
+            self._timer = threading.Timer(self.interval, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self):
+        with self._lock:
+            items, self._items = self._items, []
+            if self._timer:
+                self._timer.cancel()
+                self._timer = None
+        if items:
+            self.on_batch(items)
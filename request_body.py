@@ -0,0 +1,215 @@
+import io
+import logging
+import mimetypes
+import os
+import time
+import uuid
+from typing import Optional, Callable, List, Tuple, Union, Dict, BinaryIO
+
+log = logging.getLogger(__name__)
+
+
+class UploadProgress:
+    def __init__(self, sent: int, total: int, elapsed: float, done: bool = False):
+        self.sent = sent
+        self.total = total
+        self.elapsed = elapsed
+        self.done = done
+
+    @property
+    def rate(self) -> float:
+        """Bytes per second sent so far."""
+        return self.sent / self.elapsed if self.elapsed > 0 else 0.0
+
+
+class FilePart:
+    """A file sent as a request body, or as a multipart field, it's read from disk as it's sent."""
+
+    def __init__(self, path: str, filename: str = None, content_type: str = None):
+        self.path = path
+        self.filename = filename or os.path.basename(path)
+        self.content_type = content_type or mimetypes.guess_type(self.filename)[0] or 'application/octet-stream'
+
+    @property
+    def size(self) -> int:
+        return os.path.getsize(self.path)
+
+
+class MultipartForm:
+    """Form data fields, string values or files, sent as multipart/form-data."""
+
+    def __init__(self, fields: List[Tuple[str, Union[str, FilePart]]]):
+        self.fields = fields
+
+    @classmethod
+    def from_values(cls, values: List[Tuple[str, str, bool]]) -> 'MultipartForm':
+        """A form from (name, value, is_file) fields, the values of file fields are paths."""
+        return cls([(name, FilePart(os.path.expanduser(value)) if is_file else value)
+                    for name, value, is_file in values])
+
+    @property
+    def files(self) -> List[FilePart]:
+        return [value for _, value in self.fields if isinstance(value, FilePart)]
+
+
+class UploadBody:
+    """
+    A request body made of byte strings and files, read a block at a time as it's sent.
+
+    Files are only opened once they're reached and are read straight into the blocks
+    handed to the connection, so memory use doesn't grow with the size of the upload.
+    Its length is known up front, so it's sent with a Content-Length rather than chunked.
+    on_progress is called at most once per progress_interval seconds, and once more when
+    the body has been sent. check_cancelled is called for each block, and may raise to
+    abandon the upload.
+    """
+
+    def __init__(self,
+                 segments: List[Union[bytes, FilePart]],
+                 on_progress: Callable[[UploadProgress], None] = None,
+                 check_cancelled: Callable[[], None] = None,
+                 progress_interval: float = 0.1):
+        self.segments = segments
+        self.sizes = [seg.size if isinstance(seg, FilePart) else len(seg) for seg in segments]
+        self.size = sum(self.sizes)
+        self.on_progress = on_progress
+        self.check_cancelled = check_cancelled
+        self.progress_interval = progress_interval
+        self._position = 0
+        self._segment = 0
+        self._segment_offset = 0
+        self._file: Optional[BinaryIO] = None
+        self._started: Optional[float] = None
+        self._last_progress = 0.0
+        self._done_reported = False
+
+    def __len__(self):
+        return self.size
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        """Only absolute seeks are supported, requests rewinds bodies with them to resend after a redirect."""
+        if whence != io.SEEK_SET:
+            raise io.UnsupportedOperation('Upload bodies only support absolute seeks')
+
+        self._close_file()
+        self._done_reported = False
+        self._position = min(max(offset, 0), self.size)
+        self._segment, self._segment_offset = 0, self._position
+        while self._segment < len(self.segments) and self._segment_offset >= self.sizes[self._segment]:
+            self._segment_offset -= self.sizes[self._segment]
+            self._segment += 1
+        return self._position
+
+    def read(self, size: int = -1) -> bytes:
+        if self.check_cancelled:
+            self.check_cancelled()
+        if self._started is None:
+            self._started = self._last_progress = time.monotonic()
+
+        if size is None or size < 0:
+            size = self.size - self._position
+
+        block = bytearray()
+        while len(block) < size and self._segment < len(self.segments):
+            data = self._read_segment(size - len(block))
+            if not data:
+                self._close_file()
+                self._segment += 1
+                self._segment_offset = 0
+                continue
+            block += data
+            self._segment_offset += len(data)
+
+        self._position += len(block)
+        self._report_progress()
+        return bytes(block)
+
+    def _read_segment(self, size: int) -> bytes:
+        segment = self.segments[self._segment]
+        if not isinstance(segment, FilePart):
+            return segment[self._segment_offset:self._segment_offset + size]
+
+        if self._file is None:
+            self._file = open(segment.path, 'rb')
+            self._file.seek(self._segment_offset)
+        # The file may have grown since it was measured, the length sent is the one measured.
+        return self._file.read(min(size, self.sizes[self._segment] - self._segment_offset))
+
+    def _report_progress(self):
+        if not self.on_progress:
+            return
+        now = time.monotonic()
+        done = self._position >= self.size
+        if done and self._done_reported:
+            return  # The connection reads past the end once to find it
+        if done or now - self._last_progress >= self.progress_interval:
+            self._last_progress = now
+            self._done_reported = done
+            self.on_progress(UploadProgress(self._position, self.size, now - self._started, done))
+
+    def _close_file(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def close(self):
+        self._close_file()
+
+
+def _quote_param(value: str) -> str:
+    # Escaped the way browsers do, see the html spec's multipart/form-data encoding algorithm.
+    return value.replace('"', '%22').replace('\r', '%0D').replace('\n', '%0A')
+
+
+def encode_multipart(form: MultipartForm, boundary: str = None, **kwargs) -> Tuple[UploadBody, str]:
+    """
+    Encodes a form as a streamed multipart/form-data body, returns it and its Content-Type.
+    kwargs go to UploadBody.
+    """
+    boundary = boundary or uuid.uuid4().hex
+    segments: List[Union[bytes, FilePart]] = []
+    for name, value in form.fields:
+        disposition = f'form-data; name="{_quote_param(name)}"'
+        if isinstance(value, FilePart):
+            disposition += f'; filename="{_quote_param(value.filename)}"'
+            head = f'--{boundary}\r\nContent-Disposition: {disposition}\r\nContent-Type: {value.content_type}\r\n\r\n'
+            segments += [head.encode('utf-8'), value, b'\r\n']
+        else:
+            head = f'--{boundary}\r\nContent-Disposition: {disposition}\r\n\r\n'
+            segments.append(head.encode('utf-8') + value.encode('utf-8') + b'\r\n')
+    segments.append(f'--{boundary}--\r\n'.encode('utf-8'))
+
+    return UploadBody(segments, **kwargs), f'multipart/form-data; boundary={boundary}'
+
+
+def _set_content_type(headers: Dict[str, str], content_type: str, replace: bool) -> Dict[str, str]:
+    existing = next((k for k in headers if k.lower() == 'content-type'), None)
+    if existing and not replace:
+        return headers
+    headers = {k: v for k, v in headers.items() if k != existing}
+    headers['Content-Type'] = content_type
+    return headers
+
+
+def prepare_upload(data,
+                   headers: Dict[str, str],
+                   on_progress: Callable[[UploadProgress], None] = None,
+                   check_cancelled: Callable[[], None] = None) -> Tuple[object, Dict[str, str]]:
+    """
+    Turns a request body from the editor into one that can be sent, along with the headers to send it with.
+    Files and multipart forms become UploadBody's, which stream from disk, and should be closed once sent.
+    Text is encoded as utf-8, anything else is sent as it is.
+    """
+    if isinstance(data, FilePart):
+        body = UploadBody([data], on_progress, check_cancelled)
+        return body, _set_content_type(headers, data.content_type, replace=False)
+    if isinstance(data, MultipartForm):
+        # The boundary is generated here, so any content type set in the editor is replaced.
+        body, content_type = encode_multipart(data, on_progress=on_progress, check_cancelled=check_cancelled)
+        return body, _set_content_type(headers, content_type, replace=True)
+    if isinstance(data, str):
+        return data.encode('utf-8'), headers
+    return data, headers
@@ -0,0 +1,226 @@
+import logging
+import mmap
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional, Callable, Union, Iterator
+
+import requests
+
+from config import RESPONSE_SPILL_THRESHOLD, RESPONSE_CHUNK_SIZE
+
+log = logging.getLogger(__name__)
+
+
+class DownloadProgress:
+    def __init__(self, received: int, total: Optional[int], elapsed: float, done: bool = False):
+        self.received = received
+        self.total = total
+        self.elapsed = elapsed
+        self.done = done
+
+    @property
+    def rate(self) -> float:
+        """Bytes per second received so far."""
+        return self.received / self.elapsed if self.elapsed > 0 else 0.0
+
+
+class ResponseBody:
+    """
+    Holds a response body as it's received.
+
+    Small bodies are kept in memory, once the body grows past spill_threshold it's
+    moved to an anonymous temporary file, which is memory mapped when the body is finished.
+    Workers using the buffer retain the body, see BodyHold, it's only closed once they've all released it,
+    since a memory map can't be closed while e.g. a regex search over it is still running.
+    """
+
+    def __init__(self, spill_threshold: int = RESPONSE_SPILL_THRESHOLD):
+        self.spill_threshold = spill_threshold
+        self.size = 0
+        self._buf = bytearray()
+        self._file = None
+        self._mmap: Optional[mmap.mmap] = None
+        self._lock = threading.Lock()
+        self._users = 0
+        self._closing = False
+
+    @classmethod
+    def from_file(cls, path: str, spill_threshold: int = RESPONSE_SPILL_THRESHOLD) -> 'ResponseBody':
+        """A finished body read from a file, which is memory mapped instead of read if it's large."""
+        body = cls(spill_threshold)
+        f = open(path, 'rb')
+        body.size = os.fstat(f.fileno()).st_size
+        if body.size > spill_threshold:
+            body._file = f
+            body.finish()
+        else:
+            with f:
+                body._buf = bytearray(f.read())
+        return body
+
+    def write_to(self, f):
+        """Writes the whole body to a file object."""
+        f.write(self.getbuffer())
+
+    @property
+    def spilled(self) -> bool:
+        return self._file is not None
+
+    def write(self, chunk: bytes):
+        self.size += len(chunk)
+        if self._file:
+            self._file.write(chunk)
+            return
+
+        self._buf += chunk
+        if len(self._buf) > self.spill_threshold:
+            log.debug('Spilling response body of %d bytes to disk', len(self._buf))
+            self._file = tempfile.TemporaryFile(prefix='repose-body-')
+            self._file.write(self._buf)
+            self._buf = bytearray()
+
+    def finish(self):
+        if self._file and self._mmap is None:
+            self._file.flush()
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def getbuffer(self) -> Union[bytearray, mmap.mmap]:
+        """Bytes-like view of the whole body, without copying it."""
+        if self._file:
+            self.finish()
+            return self._mmap
+        return self._buf
+
+    def read(self, offset: int = 0, length: int = -1) -> bytes:
+        end = self.size if length < 0 else min(self.size, offset + length)
+        return bytes(self.getbuffer()[offset:end])
+
+    def text(self, encoding: Optional[str] = None) -> str:
+        return str(self.getbuffer(), encoding or 'utf-8', errors='replace')
+
+    def retain(self) -> bool:
+        """Keeps the buffer open until release is called, False if the body's already been closed."""
+        with self._lock:
+            if self._closing:
+                return False
+            self._users += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self._users -= 1
+            close = self._closing and not self._users
+        if close:
+            self._close()
+
+    def close(self):
+        """Closes the body, or once every worker which retained it has released it."""
+        with self._lock:
+            self._closing = True
+            if self._users:
+                return
+        self._close()
+
+    def _close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._file:
+            self._file.close()
+            self._file = None
+        self._buf = bytearray()
+
+    def __len__(self):
+        return self.size
+
+    def __del__(self):
+        self.close()
+
+
+class BodyHold:
+    """
+    Keeps a body open for work on its buffer in other threads, e.g. indexing or searching it.
+
+    The work runs in `with hold.use() as usable:`, and mustn't touch the buffer if it isn't
+    usable. Closing the hold stops further work from using the buffer, the body is released
+    once the work in progress has finished. A hold on no body holds nothing.
+    """
+
+    def __init__(self, body: Optional[ResponseBody] = None):
+        self._body = body
+        self._lock = threading.Lock()
+        self._active = 0
+        self._closed = body is not None and not body.retain()
+
+    @contextmanager
+    def use(self) -> Iterator[bool]:
+        with self._lock:
+            usable = not self._closed
+            if usable:
+                self._active += 1
+        if not usable:
+            yield False
+            return
+
+        try:
+            yield True
+        finally:
+            with self._lock:
+                self._active -= 1
+                release = self._closed and not self._active
+            if release:
+                self._release()
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            release = not self._active
+        if release:
+            self._release()
+
+    def _release(self):
+        if self._body is not None:
+            self._body.release()
+
+
+def read_response_body(response: requests.Response,
+                       on_progress: Callable[[DownloadProgress], None] = None,
+                       progress_interval: float = 0.1,
+                       chunk_size: int = RESPONSE_CHUNK_SIZE,
+                       spill_threshold: int = RESPONSE_SPILL_THRESHOLD,
+                       check_cancelled: Callable[[], None] = None) -> ResponseBody:
+    """
+    Reads the body of a response sent with stream=True in chunks.
+    on_progress is called at most once per progress_interval seconds, and once more when the body is done.
+    check_cancelled is called between chunks, and may raise to abandon the download.
+    """
+    body = ResponseBody(spill_threshold)
+    cl = response.headers.get('content-length')
+    total = int(cl) if cl and cl.isdigit() else None
+
+    start = last_progress = time.monotonic()
+    try:
+        for chunk in response.iter_content(chunk_size):
+            if check_cancelled:
+                check_cancelled()
+            body.write(chunk)
+            now = time.monotonic()
+            if on_progress and now - last_progress >= progress_interval:
+                last_progress = now
+                on_progress(DownloadProgress(body.size, total, now - start))
+    except BaseException:
+        body.close()
+        raise
+    finally:
+        response.close()
+
+    body.finish()
+    if on_progress:
+        on_progress(DownloadProgress(body.size, total, time.monotonic() - start, done=True))
+
+    return body
@@ -0,0 +1,257 @@
+import importlib.util
+import json
+import logging
+import re
+import threading
+from concurrent.futures import Executor
+from concurrent.futures.thread import ThreadPoolExecutor
+from functools import lru_cache
+from itertools import islice
+from typing import Callable, Optional, Any, List
+
+from json_stream import JsonScanner, parse_streaming_path
+from line_index import BytesLike
+from response_body import ResponseBody, BodyHold
+from utils import sizeof_fmt
+
+# jsonpath_rw, lxml and cssselect are imported when a response is first filtered, to keep them out of startup.
+
+log = logging.getLogger(__name__)
+
+# Filters showing more matches than this only show the first ones, the text is cut past MAX_FILTER_OUTPUT characters.
+MAX_FILTER_MATCHES = 1000
+MAX_FILTER_OUTPUT = 1024 * 1024
+FILTER_DEBOUNCE = 0.2
+
+XML_CONTENT_TYPES = {'text/xml', 'application/xml'}
+FILTERABLE_CONTENT_TYPES = {'application/json', 'text/html'} | XML_CONTENT_TYPES
+
+# cssselect is optional, without it only xpath filters are supported.
+HAS_CSSSELECT = importlib.util.find_spec('cssselect') is not None
+
+# Filters which look like xpath, anything else is taken to be a css selector. Only ., ./ and .. start
+# xpath with a dot, a dot followed by a name is a css class.
+_XPATH_PATTERN = re.compile(r'^\s*(?:[/(@]|\.(?:$|[/.\s])|[\w-]+\()|::')
+
+
+@lru_cache(maxsize=128)
+def compile_jsonpath(expr: str):
+    import jsonpath_rw
+    return jsonpath_rw.parse(expr)
+
+
+@lru_cache(maxsize=128)
+def compile_selector(expr: str):
+    """
+    Compiles an xpath expression, or a css selector, which is translated to xpath, to an etree.XPath.
+    Either can be forced with an xpath: or css: prefix.
+    """
+    from lxml import etree
+
+    if expr.startswith('xpath:'):
+        return etree.XPath(expr[len('xpath:'):])
+
+    css = expr[len('css:'):] if expr.startswith('css:') else expr
+    if expr.startswith('css:') or not _XPATH_PATTERN.search(expr):
+        if not HAS_CSSSELECT:
+            raise ValueError('CSS selectors need the cssselect package, use an xpath expression instead')
+        from lxml.cssselect import CSSSelector
+        return CSSSelector(css)
+
+    return etree.XPath(expr)
+
+
+def _serialize_match(match: Any) -> str:
+    """Serializes a match in place, moving it into another tree would remove it from the response's tree."""
+    from lxml import etree
+
+    if isinstance(match, etree._Element):
+        return etree.tostring(match, encoding='unicode', pretty_print=True, with_tail=False).rstrip('\n')
+    return str(match)
+
+
+class FilterResult:
+    def __init__(self, text: str, total: Optional[int], shown: int):
+        self.text = text
+        self.total = total  # None if the filter stopped looking once enough matches were shown
+        self.shown = shown
+
+    @property
+    def truncated(self) -> bool:
+        return self.total is None or self.shown < self.total
+
+
+class ResponseDocument:
+    """
+    A response body parsed for filtering.
+
+    The body is parsed the first time it's filtered, and the parsed document is kept
+    for as long as the response is, instead of being parsed again for each filter.
+    """
+
+    def __init__(self, content_type: str, text: str):
+        self.content_type = content_type
+        self.text = text
+        self._parsed: Any = None
+        self._lock = threading.Lock()
+
+    def parsed(self) -> Any:
+        with self._lock:
+            if self._parsed is None:
+                self._parsed = self._parse()
+            return self._parsed
+
+    def _parse(self) -> Any:
+        from lxml import etree, html
+
+        if self.content_type == 'application/json':
+            return json.loads(self.text)
+        if self.content_type in XML_CONTENT_TYPES:
+            try:
+                return etree.fromstring(self.text)
+            except ValueError:
+                # lxml refuses str with an encoding declaration, the text is already decoded.
+                return etree.fromstring(self.text.encode('utf-8'), etree.XMLParser(encoding='utf-8'))
+        if self.content_type == 'text/html':
+            return html.fromstring(self.text)
+        raise ValueError(f'Can\'t filter {self.content_type} responses')
+
+    def evaluate(self,
+                 expr: str,
+                 max_matches: int = MAX_FILTER_MATCHES,
+                 is_cancelled: Callable[[], bool] = None) -> FilterResult:
+        # Parsing and evaluating can't be interrupted, is_cancelled is only taken for StreamingJsonDocument's sake.
+        if self.content_type == 'application/json':
+            values = [match.value for match in compile_jsonpath(expr).find(self.parsed())]
+            return self._format(values, max_matches, lambda shown: json.dumps(shown, indent=4))
+
+        if self.content_type in FILTERABLE_CONTENT_TYPES:
+            matches = compile_selector(expr)(self.parsed())
+            if not isinstance(matches, list):
+                matches = [matches]  # Expressions like count(//a) evaluate to a single value
+            return self._format(matches, max_matches, lambda shown: '\n'.join(map(_serialize_match, shown)))
+
+        raise ValueError(f'Can\'t filter {self.content_type} responses')
+
+    @staticmethod
+    def _format(matches: List[Any], max_matches: int, dump: Callable[[List[Any]], str]) -> FilterResult:
+        if not matches:
+            return FilterResult('No matches found', 0, 0)
+
+        shown = matches[:max_matches]
+        text = dump(shown)
+        if len(text) > MAX_FILTER_OUTPUT:
+            text = text[:MAX_FILTER_OUTPUT] + '\n…'
+        if len(shown) < len(matches):
+            text = f'Showing the first {len(shown)} of {len(matches)} matches\n\n{text}'
+        return FilterResult(text, len(matches), len(shown))
+
+
+class StreamingJsonDocument:
+    """
+    A json body too large to parse, which is filtered by scanning it, see JsonScanner.
+
+    Only a subset of jsonpath is supported. Matches are decoded as they're found, and
+    scanning stops once max_matches have been, or once they'd be more than can be shown,
+    so the total isn't known. The body is held open until the document's closed.
+    """
+    content_type = 'application/json'
+
+    def __init__(self, buf: BytesLike, body: ResponseBody = None):
+        self.buf = buf
+        self._hold = BodyHold(body)
+
+    def close(self):
+        """Stops using the body, it's released once any filter in progress stops."""
+        self._hold.close()
+
+    def evaluate(self,
+                 expr: str,
+                 max_matches: int = MAX_FILTER_MATCHES,
+                 is_cancelled: Callable[[], bool] = None) -> FilterResult:
+        with self._hold.use() as usable:
+            if not usable:
+                raise InterruptedError('The response has been closed')
+            return self._evaluate(expr, max_matches, is_cancelled)
+
+    def _evaluate(self, expr: str, max_matches: int, is_cancelled: Optional[Callable[[], bool]]) -> FilterResult:
+        matches = JsonScanner(self.buf, is_cancelled).find(parse_streaming_path(expr))
+        values, size, more = [], 0, False
+        for start, end in islice(matches, max_matches + 1):
+            if len(values) == max_matches or size > MAX_FILTER_OUTPUT:
+                more = True
+                break
+            size += end - start
+            if end - start > MAX_FILTER_OUTPUT:
+                values.append(f'<{sizeof_fmt(end - start)} value, too large to show>')
+            else:
+                values.append(json.loads(self.buf[start:end]))
+        matches.close()
+
+        if not values:
+            return FilterResult('No matches found', 0, 0)
+        text = json.dumps(values, indent=4)
+        if len(text) > MAX_FILTER_OUTPUT:
+            text = text[:MAX_FILTER_OUTPUT] + '\n…'
+        if more:
+            text = f'Showing the first {len(values)} matches\n\n{text}'
+        return FilterResult(text, None if more else len(values), len(values))
+
+
+class FilterRunner:
+    """
+    Evaluates filters as they're typed.
+
+    Evaluation starts once the filter hasn't changed for debounce seconds, on a worker
+    thread. Only the latest filter's result is handed to on_result, along with the
+    filter, results of superseded filters are dropped, and ones which haven't started
+    yet are skipped. Also runs find in response, documents only need an evaluate method.
+    """
+
+    def __init__(self,
+                 on_result: Callable[[str, Optional[FilterResult], Optional[Exception]], None],
+                 debounce: float = FILTER_DEBOUNCE,
+                 executor: Executor = None):
+        self.on_result = on_result
+        self.debounce = debounce
+        self.executor = executor or ThreadPoolExecutor(max_workers=1, thread_name_prefix='response-filter')
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._timer: Optional[threading.Timer] = None
+
+    def submit(self, document: ResponseDocument, expr: str):
+        with self._lock:
+            self._generation += 1
+            generation = self._generation
+            if self._timer:
+                self._timer.cancel()
+            self._timer = threading.Timer(self.debounce, self.executor.submit,
+                                          (self._evaluate, generation, document, expr))
+            self._timer.daemon = True
+            self._timer.start()
+
+    def cancel(self):
+        """Drops the filter in flight, if any."""
+        with self._lock:
+            self._generation += 1
+            if self._timer:
+                self._timer.cancel()
+                self._timer = None
+
+    def _is_current(self, generation: int) -> bool:
+        return generation == self._generation
+
+    def _evaluate(self, generation: int, document: ResponseDocument, expr: str):
+        if not self._is_current(generation):
+            return
+
+        result, error = None, None
+        try:
+            result = document.evaluate(expr, is_cancelled=lambda: not self._is_current(generation))
+        except Exception as e:
+            error = e
+
+        if self._is_current(generation):
+            self.on_result(expr, result, error)
+        else:
+            log.debug('Dropping result of superseded filter %s', expr)
@@ -0,0 +1,141 @@
+import logging
+import re
+import threading
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from functools import lru_cache
+from typing import NamedTuple, Optional, Union, List, Tuple, Pattern, Callable
+
+from line_index import BytesLike
+from response_body import ResponseBody, BodyHold
+
+log = logging.getLogger(__name__)
+
+# Searches stop counting past this many matches, the count is shown as a lower bound.
+MAX_SEARCH_MATCHES = 100_000
+SEARCH_DEBOUNCE = 0.1
+# Results of this many queries are kept per response, so going back to an earlier query is instant.
+SEARCH_CACHE_SIZE = 16
+
+
+class SearchQuery(NamedTuple):
+    pattern: str
+    regex: bool = False
+    case_sensitive: bool = False
+
+
+@lru_cache(maxsize=64)
+def compile_query(query: SearchQuery, encoding: Optional[str] = None) -> Pattern:
+    """
+    Compiles a query, to a bytes pattern in encoding if one's given, for searching undecoded bodies.
+    Case insensitive matching of bytes patterns only folds ascii letters.
+    """
+    pattern = query.pattern if query.regex else re.escape(query.pattern)
+    flags = 0 if query.case_sensitive else re.IGNORECASE
+    if encoding:
+        return re.compile(pattern.encode(encoding), flags)
+    return re.compile(pattern, flags)
+
+
+class SearchResult:
+    """Where a query matched, as offsets into what was searched, in the order they appear."""
+
+    def __init__(self, starts: array, ends: array, truncated: bool):
+        self.starts = starts
+        self.ends = ends
+        self.truncated = truncated
+
+    def __len__(self):
+        return len(self.starts)
+
+    def span(self, idx: int) -> Tuple[int, int]:
+        return self.starts[idx], self.ends[idx]
+
+    def index_after(self, offset: int) -> Optional[int]:
+        """The first match starting at or after offset, wrapping around to the first one."""
+        if not self.starts:
+            return None
+        idx = bisect_left(self.starts, offset)
+        return idx if idx < len(self.starts) else 0
+
+    def index_before(self, offset: int) -> Optional[int]:
+        """The last match starting before offset, wrapping around to the last one."""
+        if not self.starts:
+            return None
+        return (bisect_left(self.starts, offset) - 1) % len(self.starts)
+
+    def spans_in(self, start: int, end: int, limit: int) -> List[Tuple[int, int]]:
+        """Up to limit matches starting between start and end."""
+        first = bisect_left(self.starts, start)
+        last = min(bisect_left(self.starts, end), first + limit)
+        return [(self.starts[i], self.ends[i]) for i in range(first, last)]
+
+
+class ResponseSearch:
+    """
+    Finds matches in a response's text, or in its undecoded body if it's too large to decode.
+
+    Results are cached per query for as long as the response is shown, so stepping
+    through matches, or going back to a previous query, doesn't search again. Bodies
+    are searched as bytes in their encoding, match offsets are then byte offsets.
+    A body's buffer is searched with the body, which is held open until the search is cancelled.
+    """
+
+    def __init__(self,
+                 source: Union[str, BytesLike],
+                 encoding: Optional[str] = None,
+                 max_matches: int = MAX_SEARCH_MATCHES,
+                 cache_size: int = SEARCH_CACHE_SIZE,
+                 body: ResponseBody = None):
+        self.source = source
+        self.encoding = None if isinstance(source, str) else (encoding or 'utf-8')
+        self.max_matches = max_matches
+        self.cache_size = cache_size
+        self._cache: 'OrderedDict[SearchQuery, SearchResult]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._cancelled = False
+        self._hold = BodyHold(body)
+
+    def cached(self, query: SearchQuery) -> Optional[SearchResult]:
+        with self._lock:
+            return self._cache.get(query)
+
+    def cancel(self):
+        """Stops any search in progress for good, the body is released once it stops."""
+        self._cancelled = True
+        self._hold.close()
+
+    def evaluate(self, query: SearchQuery, is_cancelled: Callable[[], bool] = None) -> SearchResult:
+        with self._lock:
+            if query in self._cache:
+                self._cache.move_to_end(query)
+                return self._cache[query]
+
+        cancelled = (lambda: self._cancelled or is_cancelled()) if is_cancelled else (lambda: self._cancelled)
+        with self._hold.use() as usable:
+            result = self._search(query, cancelled) if usable else SearchResult(array('Q'), array('Q'), False)
+        if cancelled():
+            return result  # Incomplete, so it isn't cached
+
+        with self._lock:
+            self._cache[query] = result
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return result
+
+    def _search(self, query: SearchQuery, cancelled: Callable[[], bool]) -> SearchResult:
+        starts, ends = array('Q'), array('Q')
+        truncated = False
+        for match in compile_query(query, self.encoding).finditer(self.source):
+            if cancelled():
+                log.debug('Cancelled search for %s', query.pattern)
+                break
+            if match.start() == match.end():
+                continue  # Empty matches, e.g. of a*, can't be selected or highlighted
+            if len(starts) >= self.max_matches:
+                truncated = True
+                break
+            starts.append(match.start())
+            ends.append(match.end())
+        return SearchResult(starts, ends, truncated)
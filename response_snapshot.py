@@ -0,0 +1,119 @@
+import json
+import logging
+from typing import Optional
+from xml.sax.saxutils import escape
+
+import requests
+
+from config import FORMAT_IN_PROCESS_THRESHOLD, LARGE_BODY_VIEWER_THRESHOLD
+from highlighting import TOKENIZERS
+from pool import get_process_pool
+from response_body import ResponseBody
+from utils import get_content_type, get_language_for_mime_type
+
+log = logging.getLogger(__name__)
+
+# Lines longer than this make GtkSource highlighting too slow, such responses are shown as plain text.
+MAX_HIGHLIGHTED_LINE_LENGTH = 5000
+
+
+def format_response_text(content_type: str, txt: str) -> str:
+    """Pretty prints json, xml and html, other content is returned as is."""
+    from lxml import etree, html  # Only needed once a response arrives, keeps it out of startup
+
+    try:
+        if content_type == 'application/json':
+            j = json.loads(txt)
+            txt = json.dumps(j, indent=2)
+        elif content_type in {'text/xml', 'application/xml'}:
+            root = etree.fromstring(txt)
+            txt = etree.tostring(root, encoding='unicode', pretty_print=True)
+        elif content_type == 'text/html':
+            root = html.fromstring(txt)
+            txt = etree.tostring(root, encoding='unicode', pretty_print=True)
+        elif not txt:
+            txt = 'Empty Response'
+    except Exception as e:
+        log.warning('Failed to parse %s response: %s', content_type, e)
+        txt = 'Failed to parse response.'
+
+    return txt
+
+
+def get_highlight_language(content_type: str, txt: str) -> str:
+    lang_id = get_language_for_mime_type(content_type)
+    if lang_id in TOKENIZERS:
+        return lang_id  # Highlighted incrementally, long lines are skipped as they're reached
+
+    # Disable GtkSource highlighting for files with really long lines
+    if any(len(line) > MAX_HIGHLIGHTED_LINE_LENGTH for line in txt.splitlines()):
+        lang_id = 'text'
+
+    return lang_id
+
+
+class ResponseSnapshot:
+    """Everything the response pane shows for a response, computed before it's handed to the ui."""
+
+    def __init__(self,
+                 response: requests.Response,
+                 body: ResponseBody,
+                 text: str,
+                 content_type: str,
+                 formatted_text: str,
+                 language_id: str,
+                 headers_markup: str,
+                 cache_status: Optional[str] = None,
+                 large: bool = False):
+        self.response = response
+        self.body = body
+        self.text = text
+        self.content_type = content_type
+        self.formatted_text = formatted_text
+        self.language_id = language_id
+        self.headers_markup = headers_markup
+        self.cache_status = cache_status
+        self.large = large  # Too large to decode whole, text and formatted_text are empty
+
+    @property
+    def size(self) -> int:
+        return self.body.size
+
+    @property
+    def status_markup(self) -> str:
+        status_markup = f'{self.response.status_code} {escape(self.response.reason or "")}'
+        if not self.response.ok:
+            status_markup = f'<span foreground="red">{status_markup}</span>'
+        if self.cache_status:
+            status_markup += f' <small>({self.cache_status})</small>'
+        return status_markup
+
+
+def build_response_snapshot(response: requests.Response,
+                            body: ResponseBody,
+                            cache_status: Optional[str] = None,
+                            process_threshold: int = FORMAT_IN_PROCESS_THRESHOLD,
+                            large_threshold: int = LARGE_BODY_VIEWER_THRESHOLD) -> ResponseSnapshot:
+    """
+    Decodes the body once and formats it, meant to be called from the thread which sent the request.
+
+    Bodies larger than process_threshold are formatted in a separate process, so
+    parsing them doesn't hold the GIL the main loop needs. Bodies larger than large_threshold
+    aren't decoded at all, they're left to the large body viewer.
+    """
+    content_type = get_content_type(response)
+    headers_markup = '\n'.join(f'<b>{escape(k)}</b> → {escape(v)}'
+                               for k, v in response.headers.items())
+    if body.size > large_threshold:
+        return ResponseSnapshot(response, body, '', content_type, '', 'text', headers_markup, cache_status, True)
+
+    text = body.text(response.encoding)
+    if body.size > process_threshold and content_type in {'application/json', 'text/xml', 'application/xml',
+                                                          'text/html'}:
+        log.debug('Formatting %d byte %s response in a process', body.size, content_type)
+        formatted = get_process_pool().submit(format_response_text, content_type, text).result()
+    else:
+        formatted = format_response_text(content_type, text)
+
+    return ResponseSnapshot(response, body, text, content_type, formatted,
+                            get_highlight_language(content_type, formatted), headers_markup, cache_status)
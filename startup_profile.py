@@ -0,0 +1,115 @@
+import importlib.abc
+import logging
+import sys
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Tuple, Optional
+
+log = logging.getLogger(__name__)
+
+
+class _TimedLoader(importlib.abc.Loader):
+    """Wraps a module's loader to time executing the module, everything else is passed through."""
+
+    def __init__(self, loader, profiler: 'StartupProfiler'):
+        self._loader = loader
+        self._profiler = profiler
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        self._profiler._enter_import()
+        try:
+            self._loader.exec_module(module)
+        finally:
+            self._profiler._exit_import(module.__name__)
+
+    def __getattr__(self, name):
+        return getattr(self._loader, name)
+
+
+class _ImportTimer(importlib.abc.MetaPathFinder):
+    def __init__(self, profiler: 'StartupProfiler'):
+        self._profiler = profiler
+
+    def find_spec(self, fullname, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, 'find_spec'):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is not None:
+                if spec.loader is not None and hasattr(spec.loader, 'exec_module'):
+                    spec.loader = _TimedLoader(spec.loader, self._profiler)
+                return spec
+        return None
+
+
+class StartupProfiler:
+    """
+    Records how long each phase of startup takes, and how long each module took to import.
+
+    Import times are split into the time spent in the module itself and the total
+    including the modules it imported. Does nothing unless enabled.
+    """
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.start = time.perf_counter()
+        self.phases: List[Tuple[str, float, float]] = []  # (name, started at, duration)
+        self.imports: Dict[str, Tuple[float, float]] = {}  # module -> (self time, total time)
+        self._import_stack: List[List[float]] = []  # [started at, time spent in nested imports]
+        self._finder: Optional[_ImportTimer] = None
+
+    def install_import_timer(self):
+        if self.enabled and not self._finder:
+            self._finder = _ImportTimer(self)
+            sys.meta_path.insert(0, self._finder)
+
+    def uninstall_import_timer(self):
+        if self._finder:
+            sys.meta_path.remove(self._finder)
+            self._finder = None
+
+    def _enter_import(self):
+        self._import_stack.append([time.perf_counter(), 0.0])
+
+    def _exit_import(self, name: str):
+        started, nested = self._import_stack.pop()
+        total = time.perf_counter() - started
+        self.imports[name] = (total - nested, total)
+        if self._import_stack:
+            self._import_stack[-1][1] += total
+
+    @contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            if self.enabled:
+                self.phases.append((name, started - self.start, time.perf_counter() - started))
+
+    def mark(self, name: str):
+        """Records a point in startup, e.g. the first frame being drawn."""
+        if self.enabled:
+            self.phases.append((name, time.perf_counter() - self.start, 0.0))
+
+    def report(self, top_imports: int = 20) -> str:
+        lines = ['Startup phases (started at, took):']
+        for name, started, duration in self.phases:
+            took = f'{duration * 1000:8.1f} ms' if duration else ''
+            lines.append(f'  {started * 1000:8.1f} ms {took:>11}  {name}')
+
+        if self.imports:
+            lines.append(f'Slowest imports of {len(self.imports)} (self, total):')
+            slowest = sorted(self.imports.items(), key=lambda i: i[1][0], reverse=True)[:top_imports]
+            for name, (self_time, total) in slowest:
+                lines.append(f'  {self_time * 1000:8.1f} ms {total * 1000:8.1f} ms  {name}')
+
+        return '\n'.join(lines)
+
+    def log_report(self):
+        if self.enabled:
+            self.uninstall_import_timer()
+            log.info('%s', self.report())
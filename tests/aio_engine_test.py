@@ -0,0 +1,150 @@
+import gc
+import gzip
+import json
+import time
+import unittest
+from concurrent.futures import wait
+
+from aio_engine import AsyncHttpEngine, ThreadedHttpEngine
+from tests.echo import EchoServer, EchoHandler
+
+
+class FeatureHandler(EchoHandler):
+    def do_GET(self):
+        if self.path == '/redirect':
+            self.send_response(302)
+            self.send_header('Location', '/gzip')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+        elif self.path == '/gzip':
+            body = gzip.compress(b'compressed body')
+            self.send_response(200)
+            self.send_header('Content-Encoding', 'gzip')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        elif self.path == '/headers':
+            body = json.dumps({k.lower(): v for k, v in self.headers.items()}).encode()
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        elif self.path == '/cross-host':
+            self.send_response(302)
+            self.send_header('Location', f'http://localhost:{self.server.server_port}/headers')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+        elif self.path == '/slow':
+            self.send_response(200)
+            self.send_header('Content-Length', '4')
+            self.end_headers()
+            for chunk in (b'a', b'b', b'c', b'd'):
+                self.wfile.write(chunk)
+                self.wfile.flush()
+                time.sleep(0.2)
+        elif self.path == '/chunked':
+            self.send_response(200)
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for chunk in (b'hello ', b'chunked ', b'world'):
+                self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+            self.wfile.write(b'0\r\n\r\n')
+        else:
+            self._echo()
+
+    def do_POST(self):
+        if self.path == '/post-redirect':
+            self.rfile.read(int(self.headers.get('content-length') or 0))
+            self.send_response(302)
+            self.send_header('Location', '/headers')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+        else:
+            self._echo()
+
+
+class AsyncHttpEngineTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.server = EchoServer(FeatureHandler).__enter__()
+        self.engine = AsyncHttpEngine()
+
+    def tearDown(self) -> None:
+        self.engine.close()
+        self.server.__exit__()
+
+    def _get(self, path: str, **kwargs):
+        return self.engine.submit('GET', self.server.url + path, **kwargs).result(5)
+
+    def test_echo(self):
+        res = self.engine.submit('POST', self.server.url, params=[('a', '1')], data=b'body',
+                                 headers={'x-response-code': '201'}).result(5)
+        self.assertEqual(201, res.status_code)
+        self.assertEqual(b'body', res.content)
+
+    def test_chunked(self):
+        self.assertEqual(b'hello chunked world', self._get('chunked').content)
+
+    def test_redirect_and_gzip(self):
+        res = self._get('redirect')
+        self.assertEqual(200, res.status_code)
+        self.assertTrue(res.url.endswith('/gzip'))
+        self.assertEqual(b'compressed body', res.content)
+
+    def test_post_redirected_to_get_drops_its_body(self):
+        res = self.engine.submit('POST', self.server.url + 'post-redirect', data=b'0123456789',
+                                 headers={'Content-Type': 'text/plain'}).result(5)
+        self.assertEqual(200, res.status_code)
+        headers = json.loads(res.content)
+        self.assertNotIn('content-length', headers)
+        self.assertNotIn('content-type', headers)
+
+    def test_credentials_are_not_sent_to_another_host(self):
+        headers = {'Authorization': 'Bearer secret', 'Cookie': 'session=1', 'x-other': '1'}
+        sent = json.loads(self._get('cross-host', headers=headers).content)
+        self.assertNotIn('authorization', sent)
+        self.assertNotIn('cookie', sent)
+        self.assertEqual('1', sent['x-other'])
+        self.assertEqual('Bearer secret', json.loads(self._get('headers', headers=headers).content)['authorization'])
+
+    def test_read_timeout_applies_to_each_read(self):
+        self.assertEqual(b'abcd', self._get('slow', timeout=(1, 0.5)).content)
+        with self.assertRaises(TimeoutError):
+            self._get('slow', timeout=(1, 0.1))
+
+    def test_requests_in_flight_are_not_garbage_collected(self):
+        future = self.engine.submit('GET', self.server.url + 'slow')
+        time.sleep(0.1)
+        gc.collect()
+        self.assertEqual(b'abcd', future.result(5).content)
+
+    def test_many_requests_in_flight(self):
+        start = time.monotonic()
+        futures = [self.engine.submit('GET', self.server.url, headers={'x-sleep': '0.5'}) for _ in range(500)]
+        wait(futures, 10)
+        self.assertTrue(all(f.result().status_code == 200 for f in futures))
+        # Serially, or on a thread per core, this would take minutes.
+        self.assertLess(time.monotonic() - start, 5)
+
+    def test_connection_errors_are_raised(self):
+        with self.assertRaises(OSError):
+            self.engine.submit('GET', 'http://127.0.0.1:1/').result(5)
+
+    def test_callback_called_when_done(self):
+        done = []
+        future = self.engine.submit('GET', self.server.url, done.append)
+        future.result(5)
+        time.sleep(0.05)
+        self.assertEqual([future], done)
+
+
+class ThreadedHttpEngineTest(unittest.TestCase):
+    def test_echo(self):
+        with EchoServer() as server:
+            engine = ThreadedHttpEngine(2)
+            res = engine.submit('POST', server.url, data=b'body').result(5)
+            engine.close()
+        self.assertEqual(b'body', res.content)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import time
+import unittest
+
+from collection_runner import CollectionRun
+from models import RequestTreeNode, RequestModel, FolderModel, RequestSummary
+from tests.echo import EchoServer
+
+
+def request_node(url: str, name: str = '', sleep: float = 0.0) -> RequestTreeNode:
+    headers = [('x-sleep', str(sleep), '')] if sleep else None
+    return RequestTreeNode(request=RequestModel(url=url, name=name, request_headers=headers))
+
+
+class CollectionRunTest(unittest.TestCase):
+    def test_siblings_run_in_parallel(self):
+        with EchoServer() as server:
+            folder = RequestTreeNode(folder=FolderModel('smoke'))
+            for i in range(300):
+                folder.add_child(request_node(server.url, str(i), sleep=0.05))
+
+            batches = []
+            start = time.monotonic()
+            results = CollectionRun([folder], on_results=batches.append, concurrency=50).run()
+            elapsed = time.monotonic() - start
+
+        self.assertEqual(300, len(results))
+        self.assertTrue(all(r.ok for r in results))
+        # 300 x 50ms in sequence would take 15 seconds.
+        self.assertLess(elapsed, 5)
+        self.assertEqual(300, sum(len(b) for b in batches))
+        self.assertLess(len(batches), 300)
+
+    def test_ordered_folder_runs_in_sequence(self):
+        with EchoServer() as server:
+            folder = RequestTreeNode(folder=FolderModel('ordered', ordered=True))
+            nodes = [request_node(server.url, str(i), sleep=0.02) for i in range(5)]
+            for node in nodes:
+                folder.add_child(node)
+            # A slow request first, which would finish last if it ran in parallel.
+            nodes[0].request.request_headers = [('x-sleep', '0.2', '')]
+
+            results = CollectionRun([folder], concurrency=8).run()
+
+        self.assertEqual([n.pk for n in nodes], [r.node_pk for r in results])
+
+    def test_failed_requests_are_reported(self):
+        node = request_node('http://127.0.0.1:1/')
+        results = CollectionRun([node]).run()
+        self.assertEqual(1, len(results))
+        self.assertFalse(results[0].ok)
+        self.assertIsNotNone(results[0].error)
+
+    def test_requests_of_summary_nodes_are_given_to_the_run(self):
+        with EchoServer() as server:
+            loaded = RequestTreeNode(summary=RequestSummary('loaded', 'GET'))
+            missing = RequestTreeNode(summary=RequestSummary('missing', 'GET'))
+            results = CollectionRun([loaded, missing], requests={loaded.pk: RequestModel(url=server.url)}).run()
+
+        results = {r.node_pk: r for r in results}
+        self.assertTrue(results[loaded.pk].ok)
+        self.assertEqual('Request not found', results[missing.pk].error)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,8 +1,15 @@
-import pathlib
+import io
+import json
+import sqlite3
+import threading
 import unittest
+import zlib
+from concurrent.futures.thread import ThreadPoolExecutor
 
-from db import RequestDAO, CollectionDAO, get_connection
-from models import RequestModel, CollectionModel, RequestTreeNode, FolderModel
+from db import RequestDAO, CollectionDAO, HistoryDAO, SaveQueue, RequestLoader, StoreExecutor, get_connection, \
+    get_schema_version, migrate, transaction, reads, submit_after, db_local, MIGRATIONS
+from models import RequestModel, CollectionModel, RequestTreeNode, FolderModel, HistoryEntry
+from tests.store import delete_db
 
 TEST_DB_PATH = '/tmp/repose_test.db'
 
@@ -14,7 +21,8 @@ class RequestDAOTest(unittest.TestCase):
         self.collection_dao = CollectionDAO(self.db, self.request_dao)
 
     def tearDown(self) -> None:
-        pathlib.Path(TEST_DB_PATH).unlink()
+        self.db.close()
+        delete_db(TEST_DB_PATH)
 
     def test_saving_collection(self):
         test_col = CollectionModel('Test collection')
@@ -40,7 +48,530 @@ class RequestDAOTest(unittest.TestCase):
         self.assertEqual(None, first_col.nodes[0].parent_pk)
         self.assertEqual(0, len(first_col.nodes[0].children))
         self.assertEqual(1, len(first_col.nodes[2].children))
-        self.assertEqual('dir1 req1', first_col.nodes[2].children[0].request.name)
+        self.assertEqual('dir1 req1', first_col.nodes[2].children[0].name)
+
+    def test_updating_folder(self):
+        test_col = CollectionModel('Test collection')
+        self.collection_dao.save_collection(test_col)
+
+        dir1 = RequestTreeNode(None, test_col.pk, folder=FolderModel('dir1'))
+        self.request_dao.save_request(dir1)
+        dir1.folder.ordered = True
+        self.request_dao.save_request(dir1)
+
+        first_col = self.collection_dao.get_collections()[0]
+        self.assertEqual(1, len(first_col.nodes))
+        self.assertTrue(first_col.nodes[0].folder.ordered)
+
+    def test_saving_a_tree_in_one_transaction(self):
+        col = CollectionModel('Imported')
+        for i in range(10):
+            folder = RequestTreeNode(None, col.pk, folder=FolderModel(f'dir{i}'))
+            col.add_node(folder)
+            for j in range(100):
+                folder.add_child(RequestTreeNode(None, col.pk, request=RequestModel(name=f'req{i}.{j}')))
+
+        commits = []
+        self.db.set_trace_callback(lambda sql: sql == 'commit' and commits.append(sql))
+        self.collection_dao.save_tree(col)
+        self.db.set_trace_callback(None)
+        self.assertEqual(1, len(commits))
+
+        saved = self.collection_dao.get_collections()[0]
+        self.assertEqual(10, len(saved.nodes))
+        self.assertEqual(1000, sum(len(node.children) for node in saved.nodes))
+
+    def test_save_many_updates_existing_nodes(self):
+        col = CollectionModel('Test collection')
+        self.collection_dao.save_collection(col)
+        nodes = [RequestTreeNode(None, col.pk, request=RequestModel(name=f'req{i}')) for i in range(3)]
+        self.request_dao.save_many(nodes)
+        nodes[1].request.name = 'renamed'
+        self.request_dao.save_many(nodes[1:])
+        col.name = 'Renamed collection'
+        self.collection_dao.save_collection(col)
+
+        saved = self.collection_dao.get_collections()
+        self.assertEqual(['Renamed collection'], [c.name for c in saved])
+        self.assertEqual(['req0', 'renamed', 'req2'], [node.name for node in saved[0].nodes])
+
+
+class SkeletonTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.db = get_connection(TEST_DB_PATH)
+        self.col = CollectionModel('Test collection')
+        folder = RequestTreeNode(None, self.col.pk, folder=FolderModel('dir1', ordered=True))
+        self.req = RequestTreeNode(None, self.col.pk, request=RequestModel(name='req1', method='POST',
+                                                                         request_body='x' * 100_000))
+        self.col.add_node(folder)
+        folder.add_child(self.req)
+        CollectionDAO(self.db).save_tree(self.col)
+
+    def tearDown(self) -> None:
+        self.db.close()
+        delete_db(TEST_DB_PATH)
+
+    def test_collections_are_loaded_without_their_requests(self):
+        folder = CollectionDAO(self.db).get_collections()[0].nodes[0]
+        self.assertTrue(folder.folder.ordered)
+        node = folder.children[0]
+        self.assertFalse(node.is_loaded())
+        self.assertEqual(('req1', 'POST'), (node.name, node.method))
+
+        queries = []
+        self.db.set_trace_callback(queries.append)
+        RequestDAO(self.db).get_skeleton()
+        self.db.set_trace_callback(None)
+        plan = self.db.execute('explain query plan ' + queries[-1]).fetchall()
+        self.assertIn('COVERING INDEX requests_tree_idx', plan[0][-1])
+
+    def test_saving_a_skeleton_node_keeps_its_request(self):
+        node = CollectionDAO(self.db).get_collections()[0].nodes[0].children[0]
+        node.parent_pk = None
+        RequestDAO(self.db).save_request(node)
+
+        self.assertEqual(2, len(CollectionDAO(self.db).get_collections()[0].nodes))
+        self.assertEqual('x' * 100_000, RequestDAO(self.db).get_request_models([node.pk])[node.pk].request_body)
+
+    def test_loaded_requests_are_cached(self):
+        local = threading.local()
+        executor = ThreadPoolExecutor(max_workers=1, initializer=lambda: setattr(local, 'db',
+                                                                                get_connection(TEST_DB_PATH)))
+        loader = RequestLoader(executor, max_loaded=1, db_factory=lambda: local.db)
+        try:
+            folder_pk = self.col.nodes[0].pk
+            loaded = loader.load([self.req.pk, folder_pk, 'missing']).result()
+            self.assertEqual(['req1'], [req.name for req in loaded.values()])
+
+            again = loader.load([self.req.pk])
+            self.assertTrue(again.done())
+            self.assertIs(loaded[self.req.pk], again.result()[self.req.pk])
+
+            loader.forget([self.req.pk])
+            self.assertIsNot(loaded[self.req.pk], loader.load([self.req.pk]).result()[self.req.pk])
+        finally:
+            executor.shutdown(wait=True)
+
+
+class SubtreeTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.db = get_connection(TEST_DB_PATH)
+        self.dao = RequestDAO(self.db)
+        self.col = CollectionModel('Test collection')
+        self.other_col = CollectionModel('Other collection')
+        # dir1 > (req1, dir2 > (req2, dir3)), req3
+        self.dir1 = self.folder('dir1', self.col)
+        self.req1 = self.request('req1', self.dir1)
+        self.dir2 = self.folder('dir2', self.dir1)
+        self.req2 = self.request('req2', self.dir2)
+        self.dir3 = self.folder('dir3', self.dir2)
+        self.req3 = RequestTreeNode(None, self.col.pk, request=RequestModel(name='req3'))
+        self.col.add_node(self.req3)
+        dao = CollectionDAO(self.db, self.dao)
+        dao.save_tree(self.col)
+        dao.save_tree(self.other_col)
+
+    def tearDown(self) -> None:
+        self.db.close()
+        delete_db(TEST_DB_PATH)
+
+    @staticmethod
+    def folder(name, parent) -> RequestTreeNode:
+        if isinstance(parent, CollectionModel):
+            node = RequestTreeNode(None, parent.pk, folder=FolderModel(name))
+            parent.add_node(node)
+        else:
+            node = RequestTreeNode(None, parent.collection_pk, folder=FolderModel(name))
+            parent.add_child(node)
+        return node
+
+    @staticmethod
+    def request(name, parent) -> RequestTreeNode:
+        node = RequestTreeNode(None, parent.collection_pk, request=RequestModel(name=name, url=f'{name}.com'))
+        parent.add_child(node)
+        return node
+
+    def tree(self, col: CollectionModel = None):
+        def names(nodes):
+            return [(node.name, names(node.children)) if node.is_folder() else node.name for node in nodes]
+
+        cols = {c.pk: c for c in CollectionDAO(self.db, self.dao).get_collections()}
+        return names(cols[(col or self.col).pk].nodes)
+
+    def test_move(self):
+        self.dao.move_subtree(self.dir2.pk, None)
+        self.assertEqual([('dir1', ['req1']), ('dir2', ['req2', ('dir3', [])]), 'req3'], self.tree())
+
+        self.dao.move_subtree(self.dir1.pk, self.dir3.pk)
+        self.assertEqual([('dir2', ['req2', ('dir3', [('dir1', ['req1'])])]), 'req3'], self.tree())
+
+    def test_move_to_another_collection(self):
+        self.dao.move_subtree(self.dir2.pk, None, self.other_col.pk)
+        self.assertEqual([('dir1', ['req1']), 'req3'], self.tree())
+        self.assertEqual([('dir2', ['req2', ('dir3', [])])], self.tree(self.other_col))
+
+    def test_invalid_moves(self):
+        for pk, parent_pk in ((self.dir1.pk, self.dir3.pk), (self.dir1.pk, self.dir1.pk),
+                              (self.dir2.pk, self.req1.pk), ('missing', self.dir1.pk)):
+            with self.assertRaises(ValueError):
+                self.dao.move_subtree(pk, parent_pk)
+        self.assertEqual([('dir1', ['req1', ('dir2', ['req2', ('dir3', [])])]), 'req3'], self.tree())
+
+    def test_duplicate(self):
+        copy_pk = self.dao.duplicate_subtree(self.dir2.pk)
+        dir2 = ['req2', ('dir3', [])]
+        self.assertEqual([('dir1', ['req1', ('dir2', dir2), ('dir2 (copy)', dir2)]), 'req3'], self.tree())
+
+        copy = self.dao.get_subtree_skeleton(copy_pk)
+        self.assertEqual('dir2 (copy)', copy.folder.name)
+        copied_pks = {copy.pk, copy.children[0].pk, copy.children[1].pk}
+        self.assertEqual(3, len(copied_pks))
+        self.assertFalse(copied_pks & {self.dir2.pk, self.req2.pk, self.dir3.pk})
+        self.assertEqual('req2.com', self.dao.get_request_models([copy.children[0].pk])[copy.children[0].pk].url)
+
+        request_copy_pk = self.dao.duplicate_subtree(self.req3.pk)
+        self.assertEqual('req3 (copy)', self.dao.get_request_models([request_copy_pk])[request_copy_pk].name)
+
+    def test_delete(self):
+        deleted = self.dao.delete_subtree(self.dir2.pk)
+        self.assertEqual({self.dir2.pk, self.req2.pk, self.dir3.pk}, set(deleted))
+        self.assertEqual([('dir1', ['req1']), 'req3'], self.tree())
+        self.assertEqual([], self.dao.delete_subtree('missing'))
+
+    def test_export(self):
+        out = io.StringIO()
+        self.assertEqual(5, self.dao.export_subtree(self.dir1.pk, out))
+        exported = json.loads(out.getvalue())
+        self.assertEqual('dir1', exported['folder']['name'])
+        req1, dir2 = exported['children']
+        self.assertEqual('req1.com', req1['request']['url'])
+        self.assertEqual(['req2', 'dir3'], [c.get('request', c.get('folder'))['name'] for c in dir2['children']])
+        self.assertEqual([], dir2['children'][1]['children'])
+
+        out = io.StringIO()
+        self.assertEqual(1, self.dao.export_subtree(self.req3.pk, out))
+        self.assertEqual('req3', json.loads(out.getvalue())['request']['name'])
+
+
+class SearchTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.db = get_connection(TEST_DB_PATH)
+        self.dao = RequestDAO(self.db)
+        self.col = CollectionModel('Test collection')
+        self.folder = RequestTreeNode(None, self.col.pk, folder=FolderModel('Users'))
+        self.col.add_node(self.folder)
+        self.list_users = RequestTreeNode(None, self.col.pk, request=RequestModel(
+            name='List users', url='https://api.example.com/v1/users',
+            request_headers=[('Authorization', 'Bearer s3cret', '')]))
+        self.create_user = RequestTreeNode(None, self.col.pk, request=RequestModel(
+            name='Create user', method='POST', url='https://api.example.com/v1/users',
+            request_body='{"email": "someone@example.com"}'))
+        self.folder.add_child(self.list_users)
+        self.folder.add_child(self.create_user)
+        CollectionDAO(self.db, self.dao).save_tree(self.col)
+
+    def tearDown(self) -> None:
+        self.db.close()
+        delete_db(TEST_DB_PATH)
+
+    def names(self, text: str, **kwargs):
+        return [match.name for match in self.dao.search(text, **kwargs)]
+
+    def test_matches_every_column_with_their_path(self):
+        self.assertEqual(['List users'], self.names('s3cret'))
+        self.assertEqual(['Create user'], self.names('someone@example.com'))
+        self.assertEqual({'List users', 'Create user'}, set(self.names('api.example.com/v1')))
+        match = self.dao.search('list')[0]
+        self.assertEqual((self.list_users.pk, 'GET', ['Test collection', 'Users']),
+                         (match.pk, match.method, match.path))
+        self.assertEqual([], self.names(''))
+        self.assertEqual([], self.names('"'))
+
+    def test_prefixes_and_ranking(self):
+        self.assertEqual(['Create user'], self.names('crea'))
+        self.assertEqual([], self.names('c'))
+        # Names rank above headers.
+        self.dao.save_request(RequestTreeNode(None, self.col.pk, request=RequestModel(name='Bearer tokens')))
+        self.assertEqual(['Bearer tokens', 'List users'], self.names('bearer'))
+        self.assertEqual('Create user', self.names('create someone')[0])
+        # Too many matches to rank, the latest come first.
+        self.assertEqual(['Create user', 'List users'], self.names('example', max_ranked=1))
+
+    def test_index_follows_changes(self):
+        self.list_users.request.name = 'Find people'
+        self.dao.save_request(self.list_users)
+        self.assertEqual([], self.names('list'))
+        self.assertEqual(['Find people'], self.names('people'))
+
+        self.dao.delete_subtree(self.folder.pk)
+        self.assertEqual([], self.names('example'))
+        self.assertEqual(0, self.db.execute("select count(*) from requests_fts where requests_fts match 'api'")
+                         .fetchone()[0])
+
+
+class BlobTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.db = get_connection(TEST_DB_PATH)
+        self.dao = RequestDAO(self.db)
+        self.col = CollectionModel('Test collection')
+        self.body = json.dumps([{'id': i, 'name': f'user{i}'} for i in range(5000)])
+        self.req = RequestTreeNode(None, self.col.pk, request=RequestModel(name='req1', request_body=self.body))
+        self.col.add_node(self.req)
+        CollectionDAO(self.db).save_tree(self.col)
+
+    def tearDown(self) -> None:
+        self.db.close()
+        delete_db(TEST_DB_PATH)
+
+    def blob_count(self) -> int:
+        return self.db.execute('select count(*) from blobs').fetchone()[0]
+
+    def test_large_bodies_are_kept_in_blobs(self):
+        request_json, size = self.db.execute(
+            'select r.request_json, b.size from requests r join blobs b on b.hash = r.body_hash').fetchone()
+        self.assertLess(len(request_json), 1000)
+        self.assertLess(size, len(self.body) / 2)
+        self.assertEqual(self.body, self.dao.get_request_models([self.req.pk])[self.req.pk].request_body)
+
+        small = RequestTreeNode(None, self.col.pk, request=RequestModel(name='small', request_body='{}'))
+        self.dao.save_request(small)
+        self.assertEqual(1, self.blob_count())
+        self.assertEqual('{}', self.dao.get_request_models([small.pk])[small.pk].request_body)
+
+    def test_unchanged_bodies_are_not_written_again(self):
+        self.req.request.name = 'renamed'
+        queries = []
+        self.db.set_trace_callback(queries.append)
+        self.dao.save_request(self.req)
+        self.db.set_trace_callback(None)
+        self.assertEqual([], [sql for sql in queries if 'into blobs' in sql])
+        self.assertEqual(1, self.blob_count())
+
+        self.req.request.request_body = self.body.replace('user', 'member')
+        self.dao.save_request(self.req)
+        self.assertEqual(1, self.blob_count())
+        self.assertEqual(self.req.request.request_body,
+                         self.dao.get_request_models([self.req.pk])[self.req.pk].request_body)
+
+    def test_copies_share_blobs_until_deleted(self):
+        copy_pk = self.dao.duplicate_subtree(self.req.pk)
+        self.assertEqual(1, self.blob_count())
+        self.assertEqual(self.body, self.dao.get_request_models([copy_pk])[copy_pk].request_body)
+
+        out = io.StringIO()
+        self.dao.export_subtree(copy_pk, out)
+        self.assertEqual(self.body, json.loads(out.getvalue())['request']['request_body'])
+
+        self.dao.delete_subtree(self.req.pk)
+        self.assertEqual(1, self.blob_count())
+        self.dao.delete_subtree(copy_pk)
+        self.assertEqual(0, self.blob_count())
+
+    def test_history_shares_blobs_with_requests(self):
+        history = HistoryDAO(self.db)
+        history.add_entries([(HistoryEntry('POST', 'http://foo.com', self.req.request, 0.0), None)])
+        self.assertEqual(1, self.blob_count())
+        self.assertEqual(self.body, history.get_entries()[0].request.request_body)
+
+        self.dao.delete_subtree(self.req.pk)
+        self.assertEqual(1, self.blob_count())
+        history.clear()
+        self.assertEqual(0, self.blob_count())
+
+
+class SaveQueueTest(unittest.TestCase):
+    def setUp(self) -> None:
+        local = threading.local()
+
+        def init():
+            local.db = get_connection(TEST_DB_PATH)
+
+        self.executor = ThreadPoolExecutor(max_workers=1, initializer=init)
+        self.queue = SaveQueue(self.executor, flush_interval=10, db_factory=lambda: local.db)
+        self.db = get_connection(TEST_DB_PATH)
+
+    def tearDown(self) -> None:
+        self.executor.shutdown(wait=True)
+        self.db.close()
+        delete_db(TEST_DB_PATH)
+
+    def test_repeated_saves_are_merged(self):
+        col = CollectionModel('Test collection')
+        node = RequestTreeNode(None, col.pk, folder=FolderModel('dir1'))
+        self.queue.save_collection(col)
+        self.queue.save_request(node)
+        node.folder.ordered = True
+        self.queue.save_request(node)
+        self.assertEqual([], CollectionDAO(self.db).get_collections())
+
+        self.queue.flush().result()
+        saved = CollectionDAO(self.db).get_collections()
+        self.assertEqual(1, len(saved[0].nodes))
+        self.assertTrue(saved[0].nodes[0].folder.ordered)
+
+    def test_saves_are_flushed_after_the_interval(self):
+        self.queue.flush_interval = 0.01
+        self.queue.save_collection(CollectionModel('Test collection'))
+        for _ in range(100):
+            if CollectionDAO(self.db).get_collections():
+                break
+            threading.Event().wait(0.02)
+        self.assertEqual(['Test collection'], [c.name for c in CollectionDAO(self.db).get_collections()])
+
+
+class StoreExecutorTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.executor = StoreExecutor(readers=2, path=TEST_DB_PATH)
+
+    def tearDown(self) -> None:
+        self.executor.shutdown(wait=True)
+        delete_db(TEST_DB_PATH)
+
+    def test_reads_run_alongside_a_write(self):
+        db = get_connection(TEST_DB_PATH)
+        CollectionDAO(db).save_collection(CollectionModel('Test collection'))
+        db.close()
+        writing, release = threading.Event(), threading.Event()
+
+        def slow_write():
+            with transaction(db_local.db):
+                db_local.db.execute("insert into collections values ('c2', 'Other collection')")
+                writing.set()
+                release.wait(5)
+
+        write = self.executor.submit(slow_write)
+        self.assertTrue(writing.wait(5))
+        queued_write = self.executor.submit(lambda: None)
+        reads = [self.executor.submit(CollectionDAO().get_collections) for _ in range(4)]
+        for future in reads:
+            self.assertEqual(['Test collection'], [c.name for c in future.result(5)])
+        self.assertFalse(write.done())
+
+        stats = self.executor.write_stats
+        self.assertEqual((1, 1), (stats.queued, stats.running))
+        release.set()
+        queued_write.result(5)
+        self.assertEqual((0, 0, 2), (stats.queued, stats.running, self.executor.write_stats.completed))
+        self.assertEqual(4, self.executor.read_stats.completed)
+        self.assertGreater(stats.max_wait, 0)
+
+    def test_read_connections_cant_write(self):
+        write = self.executor.submit(reads(lambda: CollectionDAO().save_collection(CollectionModel('Test'))))
+        with self.assertRaises(sqlite3.OperationalError):
+            write.result(5)
+
+    def test_reads_submitted_after_a_write_see_it(self):
+        write = self.executor.submit(CollectionDAO().save_collection, CollectionModel('Test collection'))
+        read = submit_after(self.executor, write, CollectionDAO().get_collections)
+        self.assertEqual(['Test collection'], [c.name for c in read.result(5)])
+
+
+class MigrationTest(unittest.TestCase):
+    def tearDown(self) -> None:
+        delete_db(TEST_DB_PATH)
+
+    def test_new_store_is_at_latest_version(self):
+        db = get_connection(TEST_DB_PATH)
+        self.assertEqual(len(MIGRATIONS), get_schema_version(db))
+        self.assertEqual('wal', db.execute('pragma journal_mode').fetchone()[0])
+        plan = db.execute('explain query plan select id from requests where parent_id = ?', ('a',)).fetchall()
+        self.assertIn('requests_parent_idx', plan[0][-1])
+        db.close()
+
+    def test_unversioned_store_is_migrated_and_keeps_its_data(self):
+        db = sqlite3.connect(TEST_DB_PATH)
+        db.execute('create table collections (id text primary key, name text unique not null)')
+        db.execute("insert into collections values ('c1', 'Old collection')")
+        db.commit()
+        db.close()
+
+        db = get_connection(TEST_DB_PATH)
+        self.assertEqual(len(MIGRATIONS), get_schema_version(db))
+        self.assertEqual(['Old collection'], [c.name for c in CollectionDAO(db).get_collections()])
+        db.close()
+
+        # Reopening doesn't migrate again.
+        db = get_connection(TEST_DB_PATH)
+        self.assertEqual(len(MIGRATIONS), get_schema_version(db))
+        db.close()
+
+    def test_failed_migration_is_rolled_back(self):
+        db = sqlite3.connect(TEST_DB_PATH, isolation_level=None)
+        migrations = [('create table a (id integer)',), ('create table b (id integer)', 'not sql')]
+        with self.assertRaises(sqlite3.OperationalError):
+            migrate(db, migrations)
+        self.assertEqual(1, get_schema_version(db))
+        tables = [row[0] for row in db.execute("select name from sqlite_master where type = 'table'")]
+        self.assertEqual(['a'], tables)
+        db.close()
+
+    def test_names_are_backfilled_from_saved_requests(self):
+        db = sqlite3.connect(TEST_DB_PATH, isolation_level=None)
+        migrate(db, MIGRATIONS[:2])
+        db.execute("insert into collections values ('c1', 'Col')")
+        db.execute("insert into requests (id, collection_id, request_json) values ('r1', 'c1', ?)",
+                   ('{"name": "req1", "method": "PUT", "url": "foo.com"}',))
+        db.execute("insert into requests (id, collection_id, folder_json) values ('f1', 'c1', ?)",
+                   ('{"name": "dir1", "ordered": false}',))
+        migrate(db)
+
+        nodes = RequestDAO(db).get_skeleton()
+        self.assertEqual([('req1', 'PUT'), ('dir1', None)], [(node.name, node.method) for node in nodes])
+        db.close()
+
+    def test_history_bodies_are_kept_as_blobs(self):
+        db = sqlite3.connect(TEST_DB_PATH, isolation_level=None)
+        migrate(db, MIGRATIONS[:4])
+        db.execute("insert into history_bodies values ('h1', 13, ?)", (zlib.compress(b'hello'),))
+        db.execute('''
+        insert into history (sent_at, method, url, host, request_json, body_hash)
+        values (0, 'GET', 'http://foo.com', 'foo.com', '{}', 'h1')
+        ''')
+        migrate(db)
+
+        self.assertEqual((1, 13), HistoryDAO(db).get_size())
+        self.assertEqual(b'hello', zlib.decompress(HistoryDAO(db).get_body('h1')))
+        self.assertIn('references blobs', db.execute("select sql from sqlite_master where name = 'history'")
+                      .fetchone()[0])
+        db.close()
+
+
+class TransactionTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.db = get_connection(TEST_DB_PATH)
+
+    def tearDown(self) -> None:
+        self.db.close()
+        delete_db(TEST_DB_PATH)
+
+    def names(self):
+        return [row[0] for row in self.db.execute('select name from collections order by name')]
+
+    def test_commits_and_rolls_back(self):
+        with transaction(self.db):
+            self.db.execute("insert into collections values ('1', 'a')")
+        with self.assertRaises(ValueError):
+            with transaction(self.db):
+                self.db.execute("insert into collections values ('2', 'b')")
+                raise ValueError()
+        self.assertEqual(['a'], self.names())
+        self.assertFalse(self.db.in_transaction)
+
+    def test_nested_transactions_roll_back_their_own_statements(self):
+        with transaction(self.db):
+            self.db.execute("insert into collections values ('1', 'a')")
+            with self.assertRaises(sqlite3.IntegrityError):
+                with transaction(self.db):
+                    self.db.execute("insert into collections values ('2', 'b')")
+                    self.db.execute("insert into collections values ('3', 'a')")
+            self.db.execute("insert into collections values ('4', 'c')")
+        self.assertEqual(['a', 'c'], self.names())
+
+    def test_saves_are_committed(self):
+        CollectionDAO(self.db).save_collection(CollectionModel('Test collection'))
+        other = get_connection(TEST_DB_PATH)
+        self.assertEqual(['Test collection'], [c.name for c in CollectionDAO(other).get_collections()])
+        other.close()
 
 
 if __name__ == '__main__':
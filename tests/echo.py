@@ -0,0 +1,45 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class EchoHandler(BaseHTTPRequestHandler):
+    """Mirrors echo_server/server.py without flask: honours x-sleep and x-response-code."""
+    protocol_version = 'HTTP/1.1'
+
+    def _echo(self):
+        length = int(self.headers.get('content-length') or 0)
+        body = self.rfile.read(length) if length else b''
+        code = int(self.headers.get('x-response-code', 200))
+        timeout = float(self.headers.get('x-sleep', 0.0))
+        if timeout:
+            time.sleep(timeout)
+
+        self.send_response(code)
+        for k, v in self.headers.items():
+            if k.lower() not in {'content-length', 'connection', 'host', 'transfer-encoding'}:
+                self.send_header(k, v)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = _echo
+
+    def log_message(self, *args):
+        pass
+
+
+class EchoServer:
+    def __init__(self, handler=EchoHandler):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self.server.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self.server.server_port}/'
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,29 @@
+import unittest
+
+from highlighting import tokenize, MAX_TOKENIZED_LINE_LENGTH
+
+
+def tokens(language_id, line):
+    return [(line[start:end], kind) for start, end, kind in tokenize(language_id, line)]
+
+
+class TokenizeTest(unittest.TestCase):
+    def test_json(self):
+        self.assertEqual([('"a"', 'key'), ('"b\\"c"', 'string'), ('-1.5e3', 'number'), ('null', 'constant')],
+                         tokens('json', '{"a": ["b\\"c", -1.5e3, null]}'))
+
+    def test_xml(self):
+        self.assertEqual([('<a', 'tag'), ('href', 'attribute'), ('"x"', 'string'), ('>', 'tag'),
+                          ('&amp;', 'entity'), ('</a', 'tag'), ('>', 'tag'), ('<!-- c -->', 'comment')],
+                         tokens('xml', '<a href="x">&amp;</a><!-- c -->'))
+
+    def test_text_content_is_not_styled_as_attributes(self):
+        self.assertEqual([('<p', 'tag'), ('>', 'tag'), ('</p', 'tag'), ('>', 'tag')],
+                         tokens('html', '<p>a=b "quoted"</p>'))
+
+    def test_long_lines_are_skipped(self):
+        self.assertEqual([], tokens('json', '1' * (MAX_TOKENIZED_LINE_LENGTH + 1)))
+
+
+if __name__ == '__main__':
+    unittest.main()
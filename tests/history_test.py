@@ -0,0 +1,118 @@
+import threading
+import unittest
+import zlib
+from concurrent.futures.thread import ThreadPoolExecutor
+
+from db import HistoryDAO, get_connection
+from history import History
+from models import HistoryEntry, RequestModel
+from response_body import ResponseBody
+from tests.store import delete_db
+
+TEST_DB_PATH = '/tmp/repose_history_test.db'
+
+
+def make_body(data: bytes) -> ResponseBody:
+    body = ResponseBody()
+    body.write(data)
+    body.finish()
+    return body
+
+
+class HistoryDAOTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.db = get_connection(TEST_DB_PATH)
+        self.dao = HistoryDAO(self.db)
+
+    def tearDown(self) -> None:
+        self.db.close()
+        delete_db(TEST_DB_PATH)
+
+    def add(self, n: int, body: bytes = b'', host: str = 'foo.com', status_code: int = 200):
+        for i in range(n):
+            entry = HistoryEntry('GET', f'http://{host}/{i}', RequestModel(url=f'{host}/{i}'), float(i),
+                                 status_code=status_code, body_size=len(body),
+                                 body_hash=str(hash(body)) if body else None)
+            self.dao.add_entries([(entry, zlib.compress(body) if body else None)])
+
+    def test_pages_newest_first(self):
+        self.add(5)
+        first = self.dao.get_entries(limit=3)
+        self.assertEqual(['http://foo.com/4', 'http://foo.com/3', 'http://foo.com/2'], [e.url for e in first])
+        second = self.dao.get_entries(first[-1].pk, limit=3)
+        self.assertEqual(['http://foo.com/1', 'http://foo.com/0'], [e.url for e in second])
+        self.assertEqual('foo.com/0', second[-1].request.url)
+
+    def test_filters_by_host_and_status(self):
+        self.add(2, host='foo.com')
+        self.add(3, host='bar.com', status_code=500)
+        self.assertEqual(3, len(self.dao.get_entries(host='bar.com')))
+        self.assertEqual(2, len(self.dao.get_entries(status_code=200)))
+
+    def test_identical_bodies_are_stored_once(self):
+        self.add(3, body=b'hello' * 100)
+        self.assertEqual((3, len(zlib.compress(b'hello' * 100))), self.dao.get_size())
+
+    def test_retention_by_count_and_bytes(self):
+        self.add(10)
+        self.assertEqual(6, self.dao.apply_retention(max_entries=4, max_bytes=1024))
+        self.assertEqual(['http://foo.com/9', 'http://foo.com/8', 'http://foo.com/7', 'http://foo.com/6'],
+                         [e.url for e in self.dao.get_entries()])
+
+        for i in range(3):
+            self.add(1, body=bytes([i]) * 1000, host=f'{i}.com')
+        self.dao.apply_retention(max_entries=100, max_bytes=60, batch_size=1)
+        count, size = self.dao.get_size()
+        self.assertLessEqual(size, 60)
+        self.assertEqual('http://2.com/0', self.dao.get_entries()[0].url)
+
+    def test_retention_counts_shared_bodies_until_their_last_entry_goes(self):
+        self.add(2, body=b'a' * 1000, host='a.com')
+        self.add(1, body=b'b' * 1000, host='b.com')
+        self.dao.apply_retention(max_entries=100, max_bytes=len(zlib.compress(b'b' * 1000)), batch_size=1)
+        self.assertEqual(['http://b.com/0'], [e.url for e in self.dao.get_entries()])
+        self.assertEqual((1, len(zlib.compress(b'b' * 1000))), self.dao.get_size())
+
+
+class HistoryTest(unittest.TestCase):
+    def setUp(self) -> None:
+        local = threading.local()
+
+        def init():
+            local.db = get_connection(TEST_DB_PATH)
+
+        self.executor = ThreadPoolExecutor(max_workers=1, initializer=init)
+        self.history = History(self.executor, flush_interval=10, dao_factory=lambda: HistoryDAO(local.db))
+
+    def tearDown(self) -> None:
+        self.executor.shutdown(wait=True)
+        delete_db(TEST_DB_PATH)
+
+    def test_entries_are_written_in_batches(self):
+        req = RequestModel(url='foo.com')
+        for i in range(3):
+            self.history.record('GET', 'http://foo.com', req, body=make_body(b'{"a": 1}'))
+        self.history.record('GET', 'http://foo.com', req, error='Connection refused')
+        self.assertEqual([], self.history.get_entries().result())
+
+        self.history.flush()
+        entries = self.history.get_entries().result()
+        self.assertEqual(4, len(entries))
+        self.assertEqual('Connection refused', entries[0].error)
+        self.assertEqual(b'{"a": 1}', self.history.get_body(entries[1]).result())
+        self.assertIsNone(self.history.get_body(entries[0]).result())
+
+    def test_body_is_kept_until_it_is_written(self):
+        body = make_body(b'x' * 1000)
+        self.history.record('GET', 'http://foo.com', RequestModel(url='foo.com'), body=body)
+        body.close()  # As the response view does once the next response arrives
+        self.assertEqual(1000, len(body.getbuffer()))
+
+        self.history.flush()
+        entry, = self.history.get_entries().result()
+        self.assertEqual(b'x' * 1000, self.history.get_body(entry).result())
+        self.assertEqual(0, len(body.getbuffer()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+import gzip
+import tempfile
+import unittest
+from http.server import BaseHTTPRequestHandler
+
+from http_cache import HttpCache, CacheStatus, CacheEntry
+from http_engine import HttpEngine
+from tests.echo import EchoServer
+
+
+class CachingHandler(BaseHTTPRequestHandler):
+    """Serves the path as the body, with an ETag, and the query string as its cache-control."""
+    protocol_version = 'HTTP/1.1'
+    hits = 0
+
+    def do_GET(self):
+        CachingHandler.hits += 1
+        self.rfile.read(int(self.headers.get('content-length', 0)))
+        path, _, cache_control = self.path.partition('?')
+        etag = f'"{path}"'
+        if self.headers.get('if-none-match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        body = path.encode('utf-8')
+        self.send_response(200)
+        if path.endswith('.gz'):
+            body = gzip.compress(body)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', cache_control.replace('%20', ' ').replace('&', ', '))
+        self.send_header('Vary', 'Accept')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class HttpCacheTest(unittest.TestCase):
+    def setUp(self):
+        CachingHandler.hits = 0
+        self.dir = tempfile.TemporaryDirectory()
+        self.cache = HttpCache(self.dir.name)
+        self.engine = HttpEngine(idle_timeout=0)
+
+    def tearDown(self):
+        self.engine.close()
+        self.dir.cleanup()
+
+    def fetch(self, url, **kwargs):
+        res, body, status = self.cache.fetch(self.engine, 'GET', url, **kwargs)
+        return res.status_code, body.text(res.encoding), status
+
+    def test_fresh_response_is_served_from_cache(self):
+        with EchoServer(CachingHandler) as server:
+            self.assertEqual((200, '/a', CacheStatus.MISS), self.fetch(server.url + 'a?max-age=60'))
+            self.assertEqual((200, '/a', CacheStatus.HIT), self.fetch(server.url + 'a?max-age=60'))
+
+        self.assertEqual(1, CachingHandler.hits)
+
+    def test_stale_response_is_revalidated(self):
+        with EchoServer(CachingHandler) as server:
+            self.fetch(server.url + 'b?no-cache')
+            self.assertEqual((200, '/b', CacheStatus.REVALIDATED), self.fetch(server.url + 'b?no-cache'))
+
+        self.assertEqual(2, CachingHandler.hits)
+        self.assertEqual(1, self.cache.revalidations)
+
+    def test_vary_headers_are_part_of_the_key(self):
+        with EchoServer(CachingHandler) as server:
+            self.fetch(server.url + 'c?max-age=60', headers={'Accept': 'text/plain'})
+            _, _, status = self.fetch(server.url + 'c?max-age=60', headers={'Accept': 'application/json'})
+            self.assertEqual(CacheStatus.MISS, status)
+            _, _, status = self.fetch(server.url + 'c?max-age=60', headers={'Accept': 'text/plain'})
+            self.assertEqual(CacheStatus.HIT, status)
+
+    def test_no_store_is_not_cached(self):
+        with EchoServer(CachingHandler) as server:
+            self.fetch(server.url + 'd?no-store')
+            self.assertEqual(CacheStatus.MISS, self.fetch(server.url + 'd?no-store')[2])
+
+        self.assertEqual(2, CachingHandler.hits)
+
+    def test_request_with_a_body_bypasses_the_cache(self):
+        with EchoServer(CachingHandler) as server:
+            self.assertEqual((200, '/i', None), self.fetch(server.url + 'i?max-age=60', data=b'one'))
+            self.assertEqual((200, '/i', None), self.fetch(server.url + 'i?max-age=60', data=b'two'))
+            self.assertEqual(CacheStatus.MISS, self.fetch(server.url + 'i?max-age=60')[2])
+
+        self.assertEqual(3, CachingHandler.hits)
+
+    def test_max_age_without_a_value_is_stale(self):
+        entry = CacheEntry('k', 'GET', 'http://localhost/', 200, 'OK', {'Cache-Control': 'max-age'}, {}, 0)
+        self.assertFalse(entry.is_fresh(now=1))
+
+    def test_stored_headers_describe_the_decoded_body(self):
+        with EchoServer(CachingHandler) as server:
+            self.fetch(server.url + 'j.gz?max-age=60')
+            res, body, status = self.cache.fetch(self.engine, 'GET', server.url + 'j.gz?max-age=60')
+
+        self.assertEqual(CacheStatus.HIT, status)
+        self.assertEqual(b'/j.gz', body.read())
+        self.assertNotIn('content-encoding', res.headers)
+        self.assertNotIn('content-length', res.headers)
+
+    def test_entry_evicted_after_it_is_looked_up_is_a_miss(self):
+        with EchoServer(CachingHandler) as server:
+            self.fetch(server.url + 'k?max-age=60')
+            entry = self.cache.lookup('GET', server.url + 'k?max-age=60', {})
+            self.cache.clear()  # As an eviction from another thread would
+            self.assertIsNone(self.cache.open_body(entry))
+            self.assertEqual((200, '/k', CacheStatus.MISS), self.fetch(server.url + 'k?max-age=60'))
+
+    def test_index_is_loaded_from_disk(self):
+        with EchoServer(CachingHandler) as server:
+            self.fetch(server.url + 'e?max-age=60')
+            self.cache = HttpCache(self.dir.name)
+            self.assertEqual(CacheStatus.HIT, self.fetch(server.url + 'e?max-age=60')[2])
+
+    def test_least_recently_used_entries_are_evicted(self):
+        self.cache.max_entries = 2
+        with EchoServer(CachingHandler) as server:
+            for path in ('f', 'g', 'f', 'h'):
+                self.fetch(server.url + path + '?max-age=60')
+            self.assertEqual(CacheStatus.HIT, self.fetch(server.url + 'f?max-age=60')[2])
+            self.assertEqual(CacheStatus.MISS, self.fetch(server.url + 'g?max-age=60')[2])
+
+
+if __name__ == '__main__':
+    unittest.main()
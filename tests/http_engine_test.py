@@ -0,0 +1,142 @@
+import time
+import unittest
+from concurrent.futures.thread import ThreadPoolExecutor
+
+from http_engine import HttpEngine, SendQueue, RequestHandle, RequestCancelled, SendQueueFull
+from request_body import UploadBody
+from tests.echo import EchoServer
+from timings import RequestTimings
+
+
+class HttpEngineTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.server = EchoServer().__enter__()
+        self.engine = HttpEngine(idle_timeout=0)
+
+    def tearDown(self) -> None:
+        self.engine.close()
+        self.server.__exit__()
+
+    def test_reuses_connections_to_same_host(self):
+        for _ in range(5):
+            res = self.engine.request('POST', self.server.url, data=b'hello')
+            self.assertEqual(b'hello', res.content)
+
+        self.assertEqual(5, self.engine.stats.requests)
+        self.assertEqual(1, self.engine.stats.connections_opened)
+        self.assertEqual(4, self.engine.stats.connections_reused)
+
+    def test_close_idle_connections(self):
+        self.engine.request('GET', self.server.url)
+        self.assertEqual(1, self.engine.close_idle_connections())
+
+        self.engine.request('GET', self.server.url)
+        self.assertEqual(2, self.engine.stats.connections_opened)
+
+    def test_closing_idle_connections_keeps_the_eviction_order(self):
+        self.engine.request('GET', self.server.url)
+        self.engine.request('GET', self.server.url.replace('127.0.0.1', 'localhost'))
+        pools = self.engine._adapter.poolmanager.pools
+        order = list(pools._container)
+        self.assertEqual(2, self.engine.close_idle_connections())
+        self.assertEqual(order, list(pools._container))
+
+    def test_records_phase_timings(self):
+        first = RequestTimings()
+        self.engine.fetch('GET', self.server.url, timings=first)
+        self.assertEqual(['queueing', 'dns', 'connect', 'send', 'ttfb', 'download'], list(first.phases))
+        self.assertFalse(first.connection_reused)
+
+        second = RequestTimings()
+        self.engine.fetch('GET', self.server.url, timings=second)
+        self.assertEqual(['queueing', 'send', 'ttfb', 'download'], list(second.phases))
+        self.assertTrue(second.connection_reused)
+        self.assertEqual(round(second.total * 1000, 3), second.to_dict()['total'])
+
+    def test_upload_is_timed_as_sending(self):
+        timings = RequestTimings()
+        body = UploadBody([b'x' * 1000], check_cancelled=lambda: time.sleep(0.1))
+        self.engine.fetch('POST', self.server.url, timings=timings, data=body)
+        self.assertGreaterEqual(timings.phases['send'], 0.1)
+        self.assertLess(timings.phases['ttfb'], 0.1)
+
+    def test_cancelling_after_the_body_is_read_leaves_the_pooled_connection(self):
+        handle = RequestHandle('a')
+
+        def on_progress(progress):
+            if progress.done:
+                handle.cancel('Request exceeded its deadline')  # As the deadline timer would, once the body's read
+
+        with self.assertRaises(RequestCancelled):
+            self.engine.fetch('GET', self.server.url, handle, on_progress)
+
+        timings = RequestTimings()
+        res, _ = self.engine.fetch('GET', self.server.url, timings=timings)
+        self.assertEqual(200, res.status_code)
+        self.assertTrue(timings.connection_reused)
+
+    def test_does_not_persist_cookies(self):
+        self.engine.request('GET', self.server.url, headers={'Set-Cookie': 'a=b'})
+        res = self.engine.request('GET', self.server.url)
+        self.assertNotIn('cookie', {k.lower() for k in res.headers})
+
+
+
+class SendQueueTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.server = EchoServer().__enter__()
+        self.engine = HttpEngine(idle_timeout=0)
+        self.executor = ThreadPoolExecutor(max_workers=2)
+        self.queue = SendQueue(self.executor, max_pending=2)
+
+    def tearDown(self) -> None:
+        self.executor.shutdown()
+        self.engine.close()
+        self.server.__exit__()
+
+    def _slow_request(self, handle: RequestHandle):
+        return self.engine.fetch('GET', self.server.url, handle, headers={'x-sleep': '5'})
+
+    def test_cancel_releases_worker(self):
+        handle = self.queue.submit('a', self._slow_request)
+        time.sleep(0.2)
+        start = time.monotonic()
+        handle.cancel()
+        with self.assertRaises(RequestCancelled):
+            handle.future.result(timeout=2)
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(0, len(self.queue))
+
+    def test_deadline_cancels_request(self):
+        handle = self.queue.submit('a', self._slow_request, deadline=0.2)
+        with self.assertRaisesRegex(RequestCancelled, 'deadline'):
+            handle.future.result(timeout=2)
+
+    def test_new_send_supersedes_previous(self):
+        first = self.queue.submit('a', self._slow_request)
+        second = self.queue.submit('a', lambda handle: self.engine.fetch('GET', self.server.url, handle))
+        self.assertTrue(first.cancelled)
+        res, body = second.future.result(timeout=2)
+        self.assertEqual(200, res.status_code)
+
+    def test_rejects_when_full(self):
+        self.queue.submit('a', self._slow_request)
+        self.queue.submit('b', self._slow_request)
+        with self.assertRaises(SendQueueFull):
+            self.queue.submit('c', self._slow_request)
+        self.queue.cancel('a')
+        self.queue.cancel('b')
+
+    def test_cancelling_a_queued_request_frees_its_slot(self):
+        queue = SendQueue(ThreadPoolExecutor(max_workers=1), max_pending=2)
+        running = queue.submit('a', self._slow_request)
+        queued = queue.submit('b', self._slow_request)
+        queued.cancel()
+        self.assertEqual(1, len(queue))
+        queue.submit('c', lambda handle: None).cancel()
+        running.cancel()
+        queue.executor.shutdown()
+
+
+if __name__ == '__main__':
+    unittest.main()
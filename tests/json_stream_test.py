@@ -0,0 +1,101 @@
+import json
+import unittest
+
+from json_stream import JsonScanner, parse_streaming_path, Child, Wildcard, Index, Slice, Filter
+from response_filter import StreamingJsonDocument
+
+DOC = {
+    'store': {
+        'book': [
+            {'title': 'Sayings', 'price': 8.95, 'tags': ['a', 'b'], 'meta': {'isbn': None}},
+            {'title': 'Sword "of" Honour', 'price': 12.99, 'tags': []},
+            {'title': 'Moby Dick', 'price': 8.99, 'isbn': '0-553-21311-3'},
+            {'title': 'The Lord', 'price': 22.99, 'deep': [[[[[[[[[[[1]]]]]]]]]]]},
+        ],
+        'bicycle': {'color': 'red', 'price': 19.95},
+    },
+    'a.b': 1,
+    'ünïcode': 'ok',
+}
+
+
+def find(doc, expr, **kwargs):
+    buf = json.dumps(doc, **kwargs).encode('utf-8')
+    return [json.loads(buf[start:end]) for start, end in JsonScanner(buf).find(parse_streaming_path(expr))]
+
+
+class ParseStreamingPathTest(unittest.TestCase):
+    def test_steps(self):
+        steps = parse_streaming_path("$.store.book[*]['title']")
+        self.assertEqual([Child, Child, Wildcard, Child], [type(step) for step in steps])
+        self.assertEqual('title', steps[-1].name)
+        self.assertIsInstance(parse_streaming_path('items[2]')[1], Index)
+        self.assertIsInstance(parse_streaming_path('$[1:5:2]')[0], Slice)
+        self.assertIsInstance(parse_streaming_path('$[?(@.price < 10)]')[0], Filter)
+
+    def test_unsupported(self):
+        for expr in ('$..price', '$.a[1,2]', '$[?(@..a)]', '$.a[?(@.b[*])]'):
+            with self.assertRaises(ValueError, msg=expr):
+                parse_streaming_path(expr)
+
+
+class JsonScannerTest(unittest.TestCase):
+    def test_children_and_wildcards(self):
+        self.assertEqual(['Sayings', 'Sword "of" Honour', 'Moby Dick', 'The Lord'],
+                         find(DOC, '$.store.book[*].title'))
+        self.assertEqual([DOC['store']], find(DOC, '$.store'))
+        self.assertEqual([1], find(DOC, "$['a.b']"))
+        self.assertEqual(['ok'], find(DOC, '$.ünïcode'))
+        self.assertEqual(['ok'], find(DOC, '$.ünïcode', ensure_ascii=False))
+        self.assertEqual([], find(DOC, '$.store.missing'))
+
+    def test_indexes_and_slices(self):
+        self.assertEqual(['Sword "of" Honour'], find(DOC, '$.store.book[1].title'))
+        self.assertEqual(['The Lord'], find(DOC, '$.store.book[-1].title'))
+        self.assertEqual(['Sayings', 'Moby Dick'], find(DOC, '$.store.book[::2].title'))
+        self.assertEqual(['Sword "of" Honour', 'Moby Dick'], find(DOC, '$.store.book[1:3].title'))
+        self.assertEqual([], find(DOC, '$.store.book[10]'))
+
+    def test_filters(self):
+        self.assertEqual(['Sayings', 'Moby Dick'], find(DOC, '$.store.book[?(@.price < 10)].title'))
+        self.assertEqual(['Moby Dick'], find(DOC, '$.store.book[?(@.isbn)].title'))
+        self.assertEqual(['Moby Dick'], find(DOC, "$.store.book[?(@.title == 'Moby Dick')].title"))
+        self.assertEqual(['Sayings'], find(DOC, '$.store.book[?(@.tags[1] == "b")].title'))
+
+    def test_deeply_nested_values_are_skipped(self):
+        self.assertEqual([22.99], find(DOC, '$.store.book[3].price'))
+        self.assertEqual([{'color': 'red', 'price': 19.95}], find(DOC, '$.store.bicycle'))
+        self.assertEqual([1], find({'a': [[[[[[[[[[[[1]]]]]]]]]]]], 'b': 1}, '$.b'))
+
+    def test_whitespace(self):
+        self.assertEqual([8.95, 12.99, 8.99, 22.99], find(DOC, '$.store.book[*].price', indent=4))
+        self.assertEqual(['red'], find(DOC, '$.store.bicycle.color', indent='\t'))
+
+    def test_stops_once_the_matches_are_found(self):
+        buf = b'{"a": 1, "b": [' + b'1, ' * 100_000 + b'"unterminated'
+        scanner = JsonScanner(buf)
+        self.assertEqual([(6, 7)], list(scanner.find(parse_streaming_path('$.a'))))
+
+    def test_cancelled(self):
+        buf = json.dumps(list(range(1000))).encode()
+        with self.assertRaises(InterruptedError):
+            list(JsonScanner(buf, lambda: True).find(parse_streaming_path('$[*]')))
+
+
+class StreamingJsonDocumentTest(unittest.TestCase):
+    def test_evaluate(self):
+        doc = StreamingJsonDocument(json.dumps(DOC).encode())
+        result = doc.evaluate('$.store.book[*].price')
+        self.assertEqual([8.95, 12.99, 8.99, 22.99], json.loads(result.text))
+        self.assertEqual(4, result.total)
+        self.assertFalse(result.truncated)
+
+    def test_matches_are_capped_without_counting_the_rest(self):
+        doc = StreamingJsonDocument(json.dumps(list(range(50))).encode())
+        result = doc.evaluate('[*]', max_matches=10)
+        self.assertTrue(result.truncated)
+        self.assertIsNone(result.total)
+        self.assertTrue(result.text.startswith('Showing the first 10 matches'))
+
+    def test_no_matches(self):
+        self.assertEqual('No matches found', StreamingJsonDocument(b'{"a": 1}').evaluate('b').text)
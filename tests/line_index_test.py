@@ -0,0 +1,91 @@
+import threading
+import time
+import unittest
+
+from line_index import LineIndex, read_window
+from response_body import ResponseBody, BodyHold
+
+
+class LineIndexTest(unittest.TestCase):
+    def test_looks_up_lines_between_indexed_ones(self):
+        buf = b''.join(b'line %d\n' % i for i in range(100))
+        index = LineIndex(buf, stride=8)
+        index.build()
+        self.assertEqual(100, index.line_count)
+        self.assertEqual(13, len(index.offsets))
+        for line in (0, 7, 8, 9, 63, 99):
+            offset = index.offset_of_line(line)
+            self.assertTrue(buf[offset:].startswith(b'line %d\n' % line))
+            self.assertEqual(line, index.line_of_offset(offset + 2))
+        self.assertIsNone(index.offset_of_line(100))
+
+    def test_last_line_without_newline(self):
+        index = LineIndex(b'a\nb\nc', stride=2)
+        index.build()
+        self.assertEqual(3, index.line_count)
+        self.assertEqual(4, index.offset_of_line(2))
+
+    def test_unbuilt_part_is_not_looked_up(self):
+        index = LineIndex(b'a\nb\nc\n', stride=2)
+        self.assertIsNone(index.offset_of_line(1))
+        self.assertIsNone(index.line_of_offset(3))
+
+    def test_indexes_a_memory_mapped_body(self):
+        body = ResponseBody(spill_threshold=1024)
+        for i in range(10000):
+            body.write(b'%d\n' % i)
+        body.finish()
+        self.assertTrue(body.spilled)
+
+        index = LineIndex(body.getbuffer(), stride=100)
+        index.build()
+        self.assertEqual(10000, index.line_count)
+        self.assertEqual(b'5000\n', body.read(index.offset_of_line(5000), 5))
+        body.close()
+
+    def test_body_replaced_while_it_is_indexed(self):
+        body = ResponseBody(spill_threshold=1024)
+        for i in range(500_000):
+            body.write(b'%d\n' % i)
+        body.finish()
+        index = LineIndex(body.getbuffer(), stride=1, hold=BodyHold(body))
+        worker = threading.Thread(target=index.build)
+        worker.start()
+        while len(index.offsets) < 100:
+            time.sleep(0.001)
+
+        # What the response view does once the next response arrives, closing the map now would raise BufferError.
+        index.cancel()
+        body.close()
+        self.assertEqual(b'0\n', body.read(0, 2))
+        worker.join(5)
+        self.assertFalse(index.done.is_set())
+        self.assertEqual(0, len(body.getbuffer()))
+
+    def test_body_closed_before_it_is_indexed(self):
+        body = ResponseBody(spill_threshold=1024)
+        body.write(b'a\n' * 1000)
+        body.finish()
+        index = LineIndex(body.getbuffer(), hold=BodyHold(body))
+        body.close()
+        index.cancel()
+        self.assertEqual(0, len(body.getbuffer()))
+        index.build()
+        self.assertFalse(index.done.is_set())
+
+
+class ReadWindowTest(unittest.TestCase):
+    def test_window_is_whole_lines(self):
+        buf = b'aaaa\nbbbb\ncccc\ndddd\n'
+        self.assertEqual((5, 15), read_window(buf, 7, 12))
+        self.assertEqual((0, 10), read_window(buf, 0, 12))
+        self.assertEqual((15, 20), read_window(buf, 17, 12))
+
+    def test_long_line_is_cut(self):
+        buf = b'x' * 100
+        self.assertEqual((0, 10), read_window(buf, 0, 10))
+        self.assertEqual((50, 60), read_window(buf, 50, 10))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import unittest
+
+from load_test import LatencyHistogram, LoadTest
+from tests.echo import EchoServer
+
+
+class LatencyHistogramTest(unittest.TestCase):
+    def test_percentiles(self):
+        hist = LatencyHistogram()
+        for ms in range(1, 1001):
+            hist.record(ms / 1000)
+
+        self.assertAlmostEqual(0.5, hist.percentile(50), delta=0.5 * 0.011)
+        self.assertAlmostEqual(0.99, hist.percentile(99), delta=0.99 * 0.011)
+        self.assertEqual(1.0, hist.max)
+        self.assertEqual(1.0, hist.percentile(100))
+
+    def test_empty(self):
+        self.assertEqual(0.0, LatencyHistogram().percentile(50))
+
+
+class LoadTestTest(unittest.TestCase):
+    def test_total_requests(self):
+        progress = []
+        with EchoServer() as server:
+            test = LoadTest('GET', server.url, total_requests=200, concurrency=4,
+                            on_progress=progress.append, headers={'x-response-code': '404'})
+            stats = test.run()
+
+        self.assertEqual(200, stats.completed)
+        self.assertEqual({404: 200}, dict(stats.outcomes))
+        self.assertEqual(200, stats.errors)
+        self.assertTrue(stats.done)
+        self.assertTrue(progress[-1].done)
+        self.assertIn('404', stats.format_report())
+
+    def test_duration(self):
+        with EchoServer() as server:
+            test = LoadTest('GET', server.url, duration=0.5, concurrency=4, headers={'x-sleep': '0.05'})
+            stats = test.run()
+
+        # Four workers each sending a 50ms request back to back for half a second.
+        self.assertGreater(stats.completed, 20)
+        self.assertLess(stats.completed, 60)
+        self.assertGreaterEqual(stats.histogram.percentile(50), 0.05)
+        self.assertEqual(0, stats.errors)
+
+    def test_requires_a_limit(self):
+        with self.assertRaises(ValueError):
+            LoadTest('GET', 'http://localhost')
+
+
+if __name__ == '__main__':
+    unittest.main()
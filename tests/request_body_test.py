@@ -0,0 +1,70 @@
+import os
+import tempfile
+import unittest
+from email.parser import BytesParser
+from email.policy import HTTP
+
+from http_engine import HttpEngine
+from request_body import FilePart, MultipartForm, UploadBody, encode_multipart, prepare_upload
+from tests.echo import EchoServer
+
+
+class RequestBodyTest(unittest.TestCase):
+    def setUp(self) -> None:
+        fd, self.path = tempfile.mkstemp(suffix='.json')
+        self.payload = os.urandom(100_000)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(self.payload)
+
+    def tearDown(self) -> None:
+        os.remove(self.path)
+
+    def test_reads_segments_in_blocks(self):
+        body = UploadBody([b'head', FilePart(self.path), b'tail'])
+        self.assertEqual(len(self.payload) + 8, len(body))
+        blocks = list(iter(lambda: body.read(4096), b''))
+        self.assertEqual(b'head' + self.payload + b'tail', b''.join(blocks))
+        self.assertTrue(all(len(block) <= 4096 for block in blocks))
+
+        body.seek(2)
+        self.assertEqual(b'ad' + self.payload[:2], body.read(4))
+        body.close()
+
+    def test_form_values(self):
+        form = MultipartForm.from_values([('handle', '@handle', False), ('upload', self.path, True)])
+        self.assertEqual('@handle', form.fields[0][1])
+        self.assertEqual([self.path], [part.path for part in form.files])
+        self.assertEqual('application/json', form.files[0].content_type)
+
+    def test_multipart_form(self):
+        form = MultipartForm([('name', 'välue'), ('upload', FilePart(self.path, 'a "b".bin'))])
+        body, content_type = encode_multipart(form)
+        message = BytesParser(policy=HTTP).parsebytes(
+            f'Content-Type: {content_type}\r\n\r\n'.encode('utf-8') + body.read())
+        name, upload = message.iter_parts()
+        self.assertEqual('name', name.get_param('name', header='content-disposition'))
+        self.assertEqual('välue', name.get_payload(decode=True).decode('utf-8'))
+        self.assertEqual('a %22b%22.bin', upload.get_filename())
+        self.assertEqual(self.payload, upload.get_content())
+
+    def test_uploads_with_progress(self):
+        progress = []
+        data, headers = prepare_upload(FilePart(self.path), {}, progress.append)
+        self.assertEqual({'Content-Type': 'application/json'}, headers)
+        with EchoServer() as server:
+            engine = HttpEngine(idle_timeout=0)
+            res = engine.request('POST', server.url, data=data, headers=headers)
+            engine.close()
+
+        self.assertEqual(self.payload, res.content)
+        self.assertEqual(1, sum(p.done for p in progress))
+        self.assertEqual(len(self.payload), progress[-1].sent)
+
+    def test_multipart_content_type_replaces_the_editors(self):
+        _, headers = prepare_upload(MultipartForm([('a', 'b')]), {'content-type': 'multipart/form-data'})
+        self.assertEqual(['Content-Type'], list(headers))
+        self.assertTrue(headers['Content-Type'].startswith('multipart/form-data; boundary='))
+
+
+if __name__ == '__main__':
+    unittest.main()
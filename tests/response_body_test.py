@@ -0,0 +1,45 @@
+import unittest
+
+from http_engine import HttpEngine
+from response_body import ResponseBody, read_response_body
+from tests.echo import EchoServer
+
+
+class ResponseBodyTest(unittest.TestCase):
+    def test_small_body_stays_in_memory(self):
+        body = ResponseBody(spill_threshold=10)
+        body.write(b'hello')
+        body.finish()
+        self.assertFalse(body.spilled)
+        self.assertEqual('hello', body.text())
+
+    def test_large_body_spills_to_disk(self):
+        body = ResponseBody(spill_threshold=10)
+        for _ in range(10):
+            body.write('héllo'.encode('utf-8'))
+        body.finish()
+        self.assertTrue(body.spilled)
+        self.assertEqual(60, body.size)
+        self.assertEqual('héllo' * 10, body.text('utf-8'))
+        self.assertEqual(b'llo', body.read(3, 3))
+        body.close()
+
+    def test_read_response_body_reports_progress(self):
+        progress = []
+        payload = b'x' * 100_000
+        with EchoServer() as server:
+            engine = HttpEngine(idle_timeout=0)
+            res = engine.request('POST', server.url, data=payload, stream=True)
+            body = read_response_body(res, progress.append, progress_interval=0, chunk_size=1024, spill_threshold=4096)
+            engine.close()
+
+        self.assertTrue(body.spilled)
+        self.assertEqual(payload, body.read())
+        self.assertTrue(progress[-1].done)
+        self.assertEqual(len(payload), progress[-1].received)
+        self.assertEqual(len(payload), progress[-1].total)
+        self.assertGreater(len(progress), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import json
+import threading
+import unittest
+
+from response_filter import ResponseDocument, FilterRunner, compile_jsonpath, compile_selector, HAS_CSSSELECT
+
+
+class ResponseDocumentTest(unittest.TestCase):
+    def test_json_is_parsed_once(self):
+        doc = ResponseDocument('application/json', json.dumps({'items': [{'id': 1}, {'id': 2}]}))
+        self.assertEqual('[\n    1,\n    2\n]', doc.evaluate('items[*].id').text)
+        parsed = doc.parsed()
+        doc.evaluate('items[0]')
+        self.assertIs(parsed, doc.parsed())
+
+    def test_expressions_are_cached(self):
+        self.assertIs(compile_jsonpath('$.a.b'), compile_jsonpath('$.a.b'))
+
+    def test_matches_are_capped(self):
+        doc = ResponseDocument('application/json', json.dumps(list(range(50))))
+        result = doc.evaluate('[*]', max_matches=10)
+        self.assertTrue(result.truncated)
+        self.assertEqual(50, result.total)
+        self.assertTrue(result.text.startswith('Showing the first 10 of 50 matches'))
+
+    def test_no_matches(self):
+        doc = ResponseDocument('application/json', '{"a": 1}')
+        self.assertEqual('No matches found', doc.evaluate('b').text)
+
+
+class XPathFilterTest(unittest.TestCase):
+    XML = '<?xml version="1.0" encoding="utf-8"?><items><item id="1">a</item><item id="2">b</item></items>'
+
+    def test_matches_are_serialized_without_moving_them(self):
+        doc = ResponseDocument('application/xml', self.XML)
+        self.assertEqual('<item id="1">a</item>\n<item id="2">b</item>', doc.evaluate('//item').text)
+        self.assertEqual(2, len(doc.parsed()))
+        self.assertEqual('2.0', doc.evaluate('count(//item)').text)
+
+    def test_string_results(self):
+        doc = ResponseDocument('text/xml', self.XML)
+        self.assertEqual('1\n2', doc.evaluate('//item/@id').text)
+
+    def test_expressions_are_cached(self):
+        self.assertIs(compile_selector('//a'), compile_selector('//a'))
+
+    @unittest.skipIf(not HAS_CSSSELECT, 'cssselect is not installed')
+    def test_css_selectors(self):
+        doc = ResponseDocument('text/html', '<html><body><p class="x">a</p><p>b</p></body></html>')
+        self.assertEqual('<p class="x">a</p>', doc.evaluate('p.x').text)
+        self.assertEqual('<p class="x">a</p>', doc.evaluate('css:.x').text)
+
+    @unittest.skipIf(not HAS_CSSSELECT, 'cssselect is not installed')
+    def test_bare_class_selectors_are_css(self):
+        doc = ResponseDocument('text/html', '<html><body><p class="item">a</p><div><p>b</p></div></body></html>')
+        self.assertEqual('<p class="item">a</p>', doc.evaluate('.item').text)
+        self.assertEqual('<p>b</p>', doc.evaluate('.item ~ div p').text)
+        self.assertEqual('<p class="item">a</p>\n<p>b</p>', doc.evaluate('.//p').text)
+        self.assertEqual('<p class="item">a</p>', doc.evaluate('./body/p').text)
+
+    def test_css_without_cssselect(self):
+        if HAS_CSSSELECT:
+            self.skipTest('cssselect is installed')
+        doc = ResponseDocument('text/html', '<html><body><p>a</p></body></html>')
+        self.assertRaises(ValueError, doc.evaluate, 'p')
+        self.assertEqual('<p>a</p>', doc.evaluate('//p').text)
+
+
+class FilterRunnerTest(unittest.TestCase):
+    def test_only_the_latest_filter_is_evaluated(self):
+        results = []
+        done = threading.Event()
+
+        def on_result(expr, result, error):
+            results.append((expr, result and result.text, error))
+            done.set()
+
+        runner = FilterRunner(on_result, debounce=0.05)
+        doc = ResponseDocument('application/json', '{"abc": 1}')
+        for expr in ('a', 'ab', 'abc'):
+            runner.submit(doc, expr)
+        self.assertTrue(done.wait(5))
+        runner.executor.shutdown(wait=True)
+        self.assertEqual([('abc', '[\n    1\n]', None)], results)
+
+    def test_errors_are_reported(self):
+        done = threading.Event()
+        errors = []
+        runner = FilterRunner(lambda expr, result, error: (errors.append(error), done.set()), debounce=0)
+        runner.submit(ResponseDocument('application/json', '{'), 'a')
+        self.assertTrue(done.wait(5))
+        self.assertIsInstance(errors[0], ValueError)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import re
+import unittest
+
+from response_body import ResponseBody
+from response_search import ResponseSearch, SearchQuery
+
+
+class ResponseSearchTest(unittest.TestCase):
+    def test_plain_text_is_case_insensitive_by_default(self):
+        result = ResponseSearch('Foo foo f.o FOO').evaluate(SearchQuery('foo'))
+        self.assertEqual([(0, 3), (4, 7), (12, 15)], [result.span(i) for i in range(len(result))])
+        self.assertEqual(1, len(ResponseSearch('Foo foo').evaluate(SearchQuery('foo', case_sensitive=True))))
+        self.assertEqual(1, len(ResponseSearch('Foo foo f.o').evaluate(SearchQuery('f.o'))))
+
+    def test_regex(self):
+        result = ResponseSearch('a1 b22 c333').evaluate(SearchQuery(r'\d+', regex=True))
+        self.assertEqual([(1, 2), (4, 6), (8, 11)], [result.span(i) for i in range(len(result))])
+        self.assertEqual(0, len(ResponseSearch('abc').evaluate(SearchQuery('x*', regex=True))))
+        with self.assertRaises(re.error):
+            ResponseSearch('abc').evaluate(SearchQuery('(', regex=True))
+
+    def test_bodies_are_searched_as_bytes(self):
+        body = bytearray('héllo wörld héllo'.encode('utf-8'))
+        result = ResponseSearch(body, 'utf-8').evaluate(SearchQuery('héllo'))
+        self.assertEqual([(0, 6), (14, 20)], [result.span(i) for i in range(len(result))])
+
+    def test_body_is_held_open_until_the_search_is_cancelled(self):
+        body = ResponseBody(spill_threshold=16)
+        body.write(b'needle in a haystack ' * 100)
+        body.finish()
+        search = ResponseSearch(body.getbuffer(), body=body)
+        self.assertEqual(100, len(search.evaluate(SearchQuery('needle'))))
+
+        body.close()
+        self.assertEqual(b'needle', body.read(0, 6))
+        search.cancel()
+        self.assertEqual(0, len(body.getbuffer()))
+        self.assertEqual(0, len(search.evaluate(SearchQuery('hay'))))
+
+    def test_results_are_cached_and_capped(self):
+        search = ResponseSearch('x' * 10, max_matches=4)
+        result = search.evaluate(SearchQuery('x'))
+        self.assertEqual(4, len(result))
+        self.assertTrue(result.truncated)
+        self.assertIs(result, search.evaluate(SearchQuery('x')))
+        self.assertIs(result, search.cached(SearchQuery('x')))
+
+    def test_navigation(self):
+        result = ResponseSearch('ab ab ab ab').evaluate(SearchQuery('ab'))
+        self.assertEqual(1, result.index_after(1))
+        self.assertEqual(0, result.index_after(10))  # Wraps around
+        self.assertEqual(1, result.index_before(4))
+        self.assertEqual(3, result.index_before(0))
+        self.assertEqual([(3, 5), (6, 8)], result.spans_in(2, 7, limit=10))
+        self.assertEqual([(3, 5)], result.spans_in(2, 7, limit=1))
+
+
+if __name__ == '__main__':
+    unittest.main()
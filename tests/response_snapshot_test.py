@@ -0,0 +1,60 @@
+import unittest
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from response_body import ResponseBody
+from response_snapshot import build_response_snapshot, format_response_text
+
+
+def make_response(content_type: str, data: bytes):
+    res = requests.Response()
+    res.status_code = 200
+    res.reason = 'OK'
+    res.headers = CaseInsensitiveDict({'Content-Type': content_type, 'X-Tag': '<a>'})
+    res.encoding = 'utf-8'
+    body = ResponseBody()
+    body.write(data)
+    body.finish()
+    return res, body
+
+
+class ResponseSnapshotTest(unittest.TestCase):
+    def test_formats_json(self):
+        res, body = make_response('application/json; charset=utf-8', b'{"a": [1]}')
+        snapshot = build_response_snapshot(res, body, 'cache hit')
+        self.assertEqual('{"a": [1]}', snapshot.text)
+        self.assertEqual('{\n  "a": [\n    1\n  ]\n}', snapshot.formatted_text)
+        self.assertEqual('json', snapshot.language_id)
+        self.assertIn('<b>X-Tag</b> → &lt;a&gt;', snapshot.headers_markup)
+        self.assertEqual('200 OK <small>(cache hit)</small>', snapshot.status_markup)
+
+    def test_large_documents_are_formatted_in_a_process(self):
+        res, body = make_response('application/xml', b'<a><b>1</b></a>')
+        snapshot = build_response_snapshot(res, body, process_threshold=0)
+        self.assertEqual('<a>\n  <b>1</b>\n</a>\n', snapshot.formatted_text)
+
+    def test_long_lines_are_not_highlighted(self):
+        res, body = make_response('application/javascript', b'"' + b'x' * 6000 + b'"')
+        self.assertEqual('text', build_response_snapshot(res, body).language_id)
+
+    def test_incrementally_highlighted_languages_keep_long_lines(self):
+        res, body = make_response('application/json', b'"' + b'x' * 6000 + b'"')
+        self.assertEqual('json', build_response_snapshot(res, body).language_id)
+        res, body = make_response('text/html', b'<p>hi</p>')
+        self.assertEqual('html', build_response_snapshot(res, body).language_id)
+
+    def test_large_bodies_are_left_undecoded(self):
+        res, body = make_response('application/json', b'[1, 2, 3]')
+        snapshot = build_response_snapshot(res, body, large_threshold=4)
+        self.assertTrue(snapshot.large)
+        self.assertEqual('', snapshot.text)
+        self.assertEqual(9, snapshot.size)
+
+    def test_unparseable_and_empty_responses(self):
+        self.assertEqual('Failed to parse response.', format_response_text('application/json', '{'))
+        self.assertEqual('Empty Response', format_response_text('text/plain', ''))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,37 @@
+import importlib
+import sys
+import unittest
+
+from startup_profile import StartupProfiler
+
+
+class StartupProfilerTest(unittest.TestCase):
+    def test_records_phases_and_imports(self):
+        sys.modules.pop('colorsys', None)
+        profiler = StartupProfiler(enabled=True)
+        profiler.install_import_timer()
+        try:
+            with profiler.phase('Import colorsys'):
+                colorsys = importlib.import_module('colorsys')
+            profiler.mark('Done')
+        finally:
+            profiler.uninstall_import_timer()
+
+        self.assertEqual((0.0, 0.0, 0.0), colorsys.rgb_to_hsv(0, 0, 0))
+        self.assertEqual(['Import colorsys', 'Done'], [name for name, _, _ in profiler.phases])
+        self.assertIn('colorsys', profiler.imports)
+        self_time, total = profiler.imports['colorsys']
+        self.assertLessEqual(self_time, total)
+        self.assertIn('colorsys', profiler.report())
+
+    def test_disabled_profiler_records_nothing(self):
+        profiler = StartupProfiler()
+        profiler.install_import_timer()
+        with profiler.phase('Nothing'):
+            pass
+        self.assertEqual([], profiler.phases)
+        self.assertNotIn(profiler._finder, sys.meta_path)
+
+
+if __name__ == '__main__':
+    unittest.main()
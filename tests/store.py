@@ -0,0 +1,7 @@
+import pathlib
+
+
+def delete_db(path: str):
+    """Deletes a test store, along with the files WAL mode keeps beside it."""
+    for suffix in ('', '-wal', '-shm'):
+        pathlib.Path(path + suffix).unlink(missing_ok=True)
@@ -0,0 +1,63 @@
+import time
+from typing import Dict, List, Tuple, Optional
+
+# Phases of a request, in the order they happen.
+PHASES = ['queueing', 'dns', 'connect', 'tls', 'send', 'ttfb', 'download', 'process']
+PHASE_LABELS = {
+    'queueing': 'Queueing',
+    'dns': 'DNS lookup',
+    'connect': 'TCP connect',
+    'tls': 'TLS handshake',
+    'send': 'Request sent',
+    'ttfb': 'Waiting (TTFB)',
+    'download': 'Content download',
+    'process': 'Processing',
+}
+
+
+class RequestTimings:
+    """
+    Time spent in each phase of a request.
+
+    Phases are recorded with mark, which attributes the time since the previous
+    mark to the phase, so the phases always add up to the total.
+    Phases which didn't happen, e.g. dns for a reused connection, are absent.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self._last = self.start
+        self.phases: Dict[str, float] = {}
+        self.connection_reused: Optional[bool] = None
+
+    def mark(self, phase: str) -> float:
+        now = time.perf_counter()
+        duration = now - self._last
+        self._last = now
+        self.add(phase, duration)
+        return duration
+
+    def add(self, phase: str, seconds: float):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    @property
+    def total(self) -> float:
+        return sum(self.phases.values())
+
+    def waterfall(self) -> List[Tuple[str, float, float]]:
+        """(phase, offset from start, duration) of each phase which happened, in seconds."""
+        offset = 0.0
+        rows = []
+        for phase in PHASES:
+            if phase in self.phases:
+                rows.append((phase, offset, self.phases[phase]))
+                offset += self.phases[phase]
+        return rows
+
+    def to_dict(self) -> Dict:
+        """Timings in milliseconds, for exporting."""
+        return {
+            'phases': {phase: round(dur * 1000, 3) for phase, _, dur in self.waterfall()},
+            'total': round(self.total * 1000, 3),
+            'connection_reused': self.connection_reused,
+        }
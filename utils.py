@@ -11,6 +11,13 @@ def get_content_type(response: requests.Response) -> str:
     return parse_content_type(response.headers.get('content-type', ''))
 
 
+def format_request_url(url: str) -> str:
+    """Defaults urls without a scheme to http."""
+    if not (url.startswith('http://') or url.startswith('https://')):
+        url = 'http://' + url
+    return url
+
+
 language_map = {
     'text': 'text',
     'text-plain': 'text',
@@ -65,9 +72,3 @@ def timedelta_fmt(delta: timedelta) -> str:
 
     return str(delta)
 
-
-def format_response_size(response: requests.Response) -> str:
-    cl = response.headers.get('content-length')
-    if cl:
-        return sizeof_fmt(float(cl))
-    return sizeof_fmt(float(len(response.content)))
\ No newline at end of file
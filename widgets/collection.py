@@ -1,12 +1,26 @@
 import logging
+from concurrent.futures import Future
+from datetime import timedelta
+from typing import Dict, List, Optional, Callable, Any
 
-from gi.repository import Gtk
+from gi.repository import Gtk, Gdk, GLib
 
+from collection_runner import CollectionRun, RunResult, iter_requests
+from db import DB_EXECUTOR, SAVE_QUEUE, REQUEST_LOADER, RequestDAO
 from models import CollectionModel, RequestTreeNode
+from utils import sizeof_fmt, timedelta_fmt
 
 log = logging.getLogger(__name__)
 
 
+def format_run_result(result: RunResult) -> str:
+    if result.error:
+        return f'<span foreground="red">{GLib.markup_escape_text(result.error[:40])}</span>'
+
+    status = f'<span foreground="{"green" if result.ok else "red"}">{result.status_code}</span>'
+    return f'{status} <small>{timedelta_fmt(timedelta(seconds=result.elapsed))} {sizeof_fmt(result.size)}</small>'
+
+
 @Gtk.Template.from_file("ui/Collection.glade")
 class Collection(Gtk.Box):
     __gtype_name__ = "Collection"
@@ -23,30 +37,215 @@ class Collection(Gtk.Box):
     def __init__(self, model: CollectionModel):
         super(Collection, self).__init__()
         self.model = model
+        self.active_run: Optional[CollectionRun] = None
+        self._nodes: Dict[str, RequestTreeNode] = {}
+        self._iters: Dict[str, Gtk.TreeIter] = {}
         self.collection_name_label.set_text(model.name)
         self.populate_collection()
 
     @Gtk.Template.Callback('tree_view_row_activated')
     def _tree_view_row_activated(self, view: Gtk.TreeView, path: Gtk.TreePath, col: Gtk.TreeViewColumn):
         it = self.requests_tree_store.get_iter(path)
-        req_pk = self.requests_tree_store.get_value(it, 1)
-        log.info('')
-        # print(view, path, col)
+        node = self._nodes.get(self.requests_tree_store.get_value(it, 1))
+        if node and not node.is_folder():
+            self.open_node(node)
+
+    def find_node(self, pk: str) -> Optional[RequestTreeNode]:
+        return self._nodes.get(pk)
+
+    def open_node(self, node: RequestTreeNode):
+        """Opens a request in the editor, loading it first if only its summary has been."""
+        it = self._iters[node.pk]
+        self.collection_revealer.set_reveal_child(True)
+        path = self.requests_tree_store.get_path(it)
+        self.requests_tree_view.expand_to_path(path)
+        self.requests_tree_view.get_selection().select_path(path)
+        if node.is_loaded():
+            self.get_toplevel().open_request(node, True)
+            return
+        REQUEST_LOADER.load([node.pk]).add_done_callback(
+            lambda future: GLib.idle_add(self._open_loaded_request, node, future))
+
+    def _open_loaded_request(self, node: RequestTreeNode, future: Future):
+        try:
+            requests = future.result()
+        except Exception as e:
+            log.error('Failed to load request %s %s', node.pk, e)
+            return
+        if node.pk not in requests:
+            log.warning('Request %s was not found', node.pk)
+            return
+        # Kept on the node while it's open, so it's edited and saved like any other request.
+        node.request = node.request or requests[node.pk]
+        self.get_toplevel().open_request(node, True)
+
+    @Gtk.Template.Callback('tree_view_button_pressed')
+    def _tree_view_button_pressed(self, view: Gtk.TreeView, event: Gdk.EventButton):
+        if event.button != Gdk.BUTTON_SECONDARY:
+            return False
+
+        node = None
+        path_info = view.get_path_at_pos(int(event.x), int(event.y))
+        if path_info:
+            path = path_info[0]
+            view.get_selection().select_path(path)
+            node = self._nodes.get(self.requests_tree_store[path][1])
+
+        menu = Gtk.Menu()
+        if node:
+            run_node: Gtk.MenuItem = Gtk.MenuItem().new_with_label('Run folder' if node.is_folder() else 'Run request')
+            run_node.connect('activate', lambda item: self.run([node]))
+            menu.append(run_node)
+
+        run_collection: Gtk.MenuItem = Gtk.MenuItem().new_with_label('Run collection')
+        run_collection.connect('activate', lambda item: self.run(self.model.nodes))
+        menu.append(run_collection)
+
+        if node and node.is_folder():
+            ordered_toggle: Gtk.CheckMenuItem = Gtk.CheckMenuItem().new_with_label('Run children in order')
+            ordered_toggle.set_active(node.folder.ordered)
+            ordered_toggle.connect('toggled', self._on_ordered_toggled, node)
+            menu.append(ordered_toggle)
+
+        if node:
+            for label, handler in (('Duplicate', self._duplicate_node), ('Export…', self._export_node),
+                                   ('Delete', self._delete_node)):
+                item: Gtk.MenuItem = Gtk.MenuItem().new_with_label(label)
+                item.connect('activate', lambda i, h=handler: h(node))
+                menu.append(item)
+
+        if self.active_run:
+            cancel_run: Gtk.MenuItem = Gtk.MenuItem().new_with_label('Cancel run')
+            cancel_run.connect('activate', lambda item: self.active_run and self.active_run.cancel())
+            menu.append(cancel_run)
+
+        menu.show_all()
+        menu.popup_at_pointer(event)
+        return True
+
+    def _on_ordered_toggled(self, item: Gtk.CheckMenuItem, node: RequestTreeNode):
+        node.folder.ordered = item.get_active()
+        SAVE_QUEUE.save_request(node)
+
+    def _run_subtree_op(self, op: Callable[[RequestDAO], Any], on_done: Callable[[Any], None]):
+        """Runs a subtree operation on the DB_EXECUTOR, after any saves still queued, then on_done on the main loop."""
+        SAVE_QUEUE.flush()
+
+        def run():
+            try:
+                result = op(RequestDAO())
+            except Exception as e:
+                log.error('Failed to update collection %s %s', self.model.pk, e)
+                return
+            GLib.idle_add(on_done, result)
+
+        DB_EXECUTOR.submit(run)
+
+    def _duplicate_node(self, node: RequestTreeNode):
+        def duplicate(dao: RequestDAO) -> RequestTreeNode:
+            return dao.get_subtree_skeleton(dao.duplicate_subtree(node.pk))
+
+        def add_copy(copy: RequestTreeNode):
+            parent_it = self.requests_tree_store.iter_parent(self._iters[node.pk])
+            if node.parent:
+                node.parent.add_child(copy)
+            else:
+                self.model.add_node(copy)
+            self.add_request_node(parent_it, copy)
+
+        self._run_subtree_op(duplicate, add_copy)
+
+    def _delete_node(self, node: RequestTreeNode):
+        def remove(deleted: List[str]):
+            REQUEST_LOADER.forget(deleted)
+            self.requests_tree_store.remove(self._iters[node.pk])
+            for pk in deleted:
+                self._nodes.pop(pk, None)
+                self._iters.pop(pk, None)
+            siblings = node.parent.children if node.parent else self.model.nodes
+            siblings.remove(node)
+
+        self._run_subtree_op(lambda dao: dao.delete_subtree(node.pk), remove)
+
+    def _export_node(self, node: RequestTreeNode):
+        dialog = Gtk.FileChooserNative.new('Export', self.get_toplevel(), Gtk.FileChooserAction.SAVE)
+        dialog.set_current_name(f'{node.name}.json')
+        dialog.set_do_overwrite_confirmation(True)
+        try:
+            if dialog.run() != Gtk.ResponseType.ACCEPT:
+                return
+            path = dialog.get_filename()
+        finally:
+            dialog.destroy()
+
+        def export(dao: RequestDAO) -> int:
+            with open(path, 'w') as out:
+                return dao.export_subtree(node.pk, out)
+
+        self._run_subtree_op(export, lambda written: log.info('Exported %d nodes to %s', written, path))
 
     @Gtk.Template.Callback()
     def name_label_pressed(self, *args):
         self.collection_revealer.set_reveal_child(not self.collection_revealer.get_reveal_child())
 
+    def run(self, nodes: List[RequestTreeNode]):
+        """Runs every request under nodes, showing their results in the tree as they arrive."""
+        if self.active_run:
+            self.active_run.cancel()
+
+        requests = list(iter_requests(nodes))
+        for node in requests:
+            self.requests_tree_store.set_value(self._iters[node.pk], 3, '<small>…</small>')
+
+        run = CollectionRun(
+            nodes,
+            on_results=lambda results: GLib.idle_add(self._handle_run_results, run, results),
+            on_finished=lambda results: GLib.idle_add(self._handle_run_finished, run, results))
+        self.active_run = run
+        self.collection_revealer.set_reveal_child(True)
+        # The run keeps the requests it loads to itself, they aren't left on the tree's nodes.
+        REQUEST_LOADER.load(node.pk for node in requests if not node.is_loaded()).add_done_callback(
+            lambda future: GLib.idle_add(self._start_run, run, future))
+
+    def _start_run(self, run: CollectionRun, future: Future):
+        if run is not self.active_run:
+            return
+        try:
+            run.requests = future.result()
+        except Exception as e:
+            log.error('Failed to load requests to run %s', e)
+        run.start()
+
+    def _handle_run_results(self, run: CollectionRun, results: List[RunResult]):
+        if run is not self.active_run:
+            return
+
+        for result in results:
+            it = self._iters.get(result.node_pk)
+            if it:
+                self.requests_tree_store.set_value(it, 3, format_run_result(result))
+
+    def _handle_run_finished(self, run: CollectionRun, results: List[RunResult]):
+        if run is not self.active_run:
+            return
+
+        self.active_run = None
+        passed = sum(1 for r in results if r.ok)
+        summary = f'{passed}/{len(results)} passed in {timedelta_fmt(timedelta(seconds=run.elapsed))}'
+        if passed != len(results):
+            summary = f'<span foreground="red">{summary}</span>'
+        self.collection_name_label.set_markup(
+            f'{GLib.markup_escape_text(self.model.name)} <small>{summary}</small>')
+
     def populate_collection(self):
         it: Gtk.TreeIter = self.requests_tree_store.get_iter_first()
         for node in self.model.nodes:
             self.add_request_node(it, node)
 
     def add_request_node(self, it: Gtk.TreeIter, node: RequestTreeNode):
-        if node.is_folder():
-            parent_it = self.requests_tree_store.append(it, [node.folder.name, node.pk, None])
-        else:
-            parent_it = self.requests_tree_store.append(it, [node.request.name, node.pk, None])
+        parent_it = self.requests_tree_store.append(it, [node.name, node.pk, None, ''])
 
+        self._nodes[node.pk] = node
+        self._iters[node.pk] = parent_it
         for child in node.children:
             self.add_request_node(parent_it, child)
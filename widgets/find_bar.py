@@ -0,0 +1,219 @@
+import logging
+from concurrent.futures.thread import ThreadPoolExecutor
+from typing import Optional, List, Tuple
+
+from gi.repository import Gtk, Gdk, GLib
+
+from response_filter import FilterRunner
+from response_search import ResponseSearch, SearchQuery, SearchResult, SEARCH_DEBOUNCE
+
+log = logging.getLogger(__name__)
+
+# Only matches this far either side of what's in view are highlighted, and at most this many of them.
+HIGHLIGHT_MARGIN = 64 * 1024
+MAX_HIGHLIGHTED_MATCHES = 1000
+
+
+class FindTarget:
+    """
+    A view the find bar searches, offsets are whatever the view's ResponseSearch reports.
+    on_scrolled is set by the find bar, and should be called when what's in view changes.
+    """
+    on_scrolled = None
+
+    def visible_range(self) -> Tuple[int, int]:
+        raise NotImplementedError()
+
+    def show_match(self, start: int, end: int):
+        raise NotImplementedError()
+
+    def highlight(self, spans: List[Tuple[int, int]], current: Optional[Tuple[int, int]]):
+        raise NotImplementedError()
+
+
+def create_find_tags(buf: Gtk.TextBuffer) -> Tuple[Gtk.TextTag, Gtk.TextTag]:
+    match_tag = buf.create_tag('find-match', background='#fce94f')
+    current_tag = buf.create_tag('find-current', background='#fcaf3e')
+    return match_tag, current_tag
+
+
+class TextViewFindTarget(FindTarget):
+    """Searches a text view's whole text, offsets are character offsets into its buffer."""
+
+    def __init__(self, view: Gtk.TextView):
+        self.view = view
+        buf = view.get_buffer()
+        self.match_tag = buf.get_tag_table().lookup('find-match')
+        self.current_tag = buf.get_tag_table().lookup('find-current')
+        if not self.match_tag:
+            self.match_tag, self.current_tag = create_find_tags(buf)
+        self._highlighted: Optional[Tuple[int, int]] = None
+        view.get_vadjustment().connect('value-changed', lambda adj: self.on_scrolled and self.on_scrolled())
+
+    def visible_range(self) -> Tuple[int, int]:
+        rect = self.view.get_visible_rect()
+        _, start = self.view.get_iter_at_location(rect.x, rect.y)
+        _, end = self.view.get_iter_at_location(rect.x + rect.width, rect.y + rect.height)
+        return start.get_offset(), end.get_offset()
+
+    def show_match(self, start: int, end: int):
+        buf = self.view.get_buffer()
+        start_iter, end_iter = buf.get_iter_at_offset(start), buf.get_iter_at_offset(end)
+        buf.select_range(start_iter, end_iter)
+        self.view.scroll_to_iter(start_iter, 0.1, False, 0, 0.5)
+
+    def highlight(self, spans: List[Tuple[int, int]], current: Optional[Tuple[int, int]]):
+        buf = self.view.get_buffer()
+        if self._highlighted:
+            # Only the range highlighted last time is cleared, rather than the whole buffer.
+            start, end = self._highlighted
+            for tag in (self.match_tag, self.current_tag):
+                buf.remove_tag(tag, buf.get_iter_at_offset(start), buf.get_iter_at_offset(end))
+            self._highlighted = None
+
+        if current:
+            spans = spans + [current]
+        if not spans:
+            return
+        for start, end in spans:
+            tag = self.current_tag if (start, end) == current else self.match_tag
+            buf.apply_tag(tag, buf.get_iter_at_offset(start), buf.get_iter_at_offset(end))
+        self._highlighted = (min(s for s, _ in spans), max(e for _, e in spans))
+
+
+class FindBar(Gtk.SearchBar):
+    """
+    Find in the response, searched in a worker as it's typed.
+
+    The match count is shown once the search finishes, stepping through matches uses the
+    cached result, and only the matches near what's in view are highlighted.
+    """
+
+    def __init__(self):
+        super(FindBar, self).__init__(show_close_button=True)
+        self.search: Optional[ResponseSearch] = None
+        self.target: Optional[FindTarget] = None
+        self.result: Optional[SearchResult] = None
+        self.current: Optional[int] = None
+        self.runner = FilterRunner(
+            lambda query, result, error: GLib.idle_add(self._handle_result, query, result, error),
+            SEARCH_DEBOUNCE,
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix='response-search'))
+
+        box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=3)
+        self.entry = Gtk.SearchEntry(placeholder_text='Find in response', width_chars=30)
+        self.entry.connect('search-changed', lambda entry: self.run())
+        self.entry.connect('activate', lambda entry: self.step(backwards=False))
+        self.entry.connect('key-press-event', self._on_entry_key_press)
+        self.connect_entry(self.entry)
+        box.pack_start(self.entry, True, True, 0)
+
+        self.regex_toggle = Gtk.ToggleButton(label='.*', tooltip_text='Regular expression')
+        self.case_toggle = Gtk.ToggleButton(label='Aa', tooltip_text='Match case')
+        for toggle in (self.regex_toggle, self.case_toggle):
+            toggle.connect('toggled', lambda btn: self.run())
+            box.pack_start(toggle, False, False, 0)
+
+        for icon, backwards in (('go-up-symbolic', True), ('go-down-symbolic', False)):
+            button = Gtk.Button.new_from_icon_name(icon, Gtk.IconSize.BUTTON)
+            button.connect('clicked', lambda btn, b=backwards: self.step(backwards=b))
+            box.pack_start(button, False, False, 0)
+
+        self.count_label = Gtk.Label(width_chars=14)
+        box.pack_start(self.count_label, False, False, 0)
+        self.add(box)
+        self.connect('notify::search-mode-enabled', self._on_search_mode_changed)
+
+    def open(self):
+        self.set_search_mode(True)
+        self.entry.grab_focus()
+
+    def query(self) -> SearchQuery:
+        return SearchQuery(self.entry.get_text(), self.regex_toggle.get_active(), self.case_toggle.get_active())
+
+    def set_target(self, search: Optional[ResponseSearch], target: Optional[FindTarget]):
+        """Searches another view, e.g. once a new response is shown. Call with None before its body is closed."""
+        self.runner.cancel()
+        if self.search and self.search is not search:
+            self.search.cancel()
+        if self.target and self.target is not target:
+            self.target.highlight([], None)
+            self.target.on_scrolled = None
+        self.search, self.target = search, target
+        if target:
+            target.on_scrolled = self._highlight_visible
+        self.run()
+
+    def run(self):
+        self.result, self.current = None, None
+        query = self.query()
+        if not self.search or not self.get_search_mode() or not query.pattern:
+            self.runner.cancel()
+            self.count_label.set_text('')
+            self.entry.get_style_context().remove_class('error')
+            if self.target:
+                self.target.highlight([], None)
+            return
+
+        cached = self.search.cached(query)
+        if cached:
+            self._handle_result(query, cached, None)
+        else:
+            self.count_label.set_text('Searching…')
+            self.runner.submit(self.search, query)
+
+    def step(self, backwards: bool):
+        if not self.result or not len(self.result):
+            return
+
+        if self.current is None:
+            start, _ = self.target.visible_range()
+            self.current = self.result.index_before(start) if backwards else self.result.index_after(start)
+        else:
+            self.current = (self.current + (-1 if backwards else 1)) % len(self.result)
+
+        self.target.show_match(*self.result.span(self.current))
+        self._update_count_label()
+        self._highlight_visible()
+
+    def _handle_result(self, query: SearchQuery, result: Optional[SearchResult], error: Optional[Exception]):
+        # Results for a previous query, or a previous response, are dropped.
+        if query != self.query() or not self.search or (result and self.search.cached(query) is not result):
+            return
+
+        if error:
+            log.debug('Failed to search response %s', error)
+            self.entry.get_style_context().add_class('error')
+            self.count_label.set_text('Invalid pattern')
+            return
+
+        self.entry.get_style_context().remove_class('error')
+        self.result, self.current = result, None
+        self._update_count_label()
+        self._highlight_visible()
+
+    def _update_count_label(self):
+        total = f'{len(self.result)}{"+" if self.result.truncated else ""}'
+        if not len(self.result):
+            self.count_label.set_text('No matches')
+        elif self.current is None:
+            self.count_label.set_text(f'{total} matches')
+        else:
+            self.count_label.set_text(f'{self.current + 1} of {total}')
+
+    def _highlight_visible(self):
+        if not self.target or not self.result:
+            return
+        start, end = self.target.visible_range()
+        spans = self.result.spans_in(max(start - HIGHLIGHT_MARGIN, 0), end + HIGHLIGHT_MARGIN, MAX_HIGHLIGHTED_MATCHES)
+        current = self.result.span(self.current) if self.current is not None else None
+        self.target.highlight(spans, current)
+
+    def _on_entry_key_press(self, entry: Gtk.SearchEntry, event: Gdk.EventKey) -> bool:
+        if event.keyval in (Gdk.KEY_Return, Gdk.KEY_KP_Enter) and event.state & Gdk.ModifierType.SHIFT_MASK:
+            self.step(backwards=True)
+            return True
+        return False
+
+    def _on_search_mode_changed(self, bar, param):
+        self.run()
@@ -0,0 +1,122 @@
+import logging
+import time
+from typing import Optional, Dict, Set
+
+from gi.repository import Gtk, GtkSource, GLib
+
+from highlighting import TOKEN_STYLES, TOKENIZERS, tokenize
+
+log = logging.getLogger(__name__)
+
+# Lines are styled a chunk at a time, each idle callback styles chunks until its budget is spent.
+CHUNK_LINES = 200
+FRAME_BUDGET = 0.008
+# Past this many characters only the lines in view are styled, as they're scrolled to.
+FULL_HIGHLIGHT_MAX_CHARS = 8 * 1024 * 1024
+
+
+class IncrementalHighlighter:
+    """
+    Highlights a source view's buffer a chunk of lines at a time, the lines in view first.
+
+    Used instead of GtkSource's highlighting for the languages in TOKENIZERS, which
+    styles the whole buffer and freezes the ui on large responses. The rest of the
+    buffer is styled in idle callbacks which each stop after FRAME_BUDGET, and are
+    abandoned when the text changes. Buffers over FULL_HIGHLIGHT_MAX_CHARS only have
+    the lines in view styled.
+    """
+
+    def __init__(self, view: GtkSource.View):
+        self.view = view
+        self.language_id: Optional[str] = None
+        self._tags: Dict[str, Gtk.TextTag] = {}
+        self._done: Set[int] = set()  # Chunks which have been styled
+        self._next_chunk = 0
+        self._idle_source: Optional[int] = None
+        self._scroll_handler: Optional[int] = None
+
+    @staticmethod
+    def supports(language_id: str) -> bool:
+        return language_id in TOKENIZERS
+
+    def _create_tags(self, buf: GtkSource.Buffer):
+        scheme: GtkSource.StyleScheme = buf.get_style_scheme()
+        table = buf.get_tag_table()
+        for kind, style_id in TOKEN_STYLES.items():
+            tag = Gtk.TextTag(name=f'highlight-{kind}')
+            style = scheme.get_style(style_id) if scheme else None
+            if style:
+                style.apply(tag)
+            table.add(tag)
+            self._tags[kind] = tag
+
+    def highlight(self, language_id: Optional[str]):
+        """(Re)starts highlighting the buffer, call after its text is set. None stops highlighting."""
+        self.stop()
+        self.language_id = language_id
+        if not language_id:
+            return
+
+        buf: GtkSource.Buffer = self.view.get_buffer()
+        if not self._tags:
+            self._create_tags(buf)
+
+        self.highlight_visible()
+        vadj = self.view.get_vadjustment()
+        self._scroll_handler = vadj.connect('value-changed', lambda adj: self.highlight_visible())
+        if buf.get_char_count() <= FULL_HIGHLIGHT_MAX_CHARS:
+            self._idle_source = GLib.idle_add(self._highlight_in_background, priority=GLib.PRIORITY_LOW)
+
+    def stop(self):
+        if self._idle_source:
+            GLib.source_remove(self._idle_source)
+            self._idle_source = None
+        if self._scroll_handler:
+            self.view.get_vadjustment().disconnect(self._scroll_handler)
+            self._scroll_handler = None
+        self._done.clear()
+        self._next_chunk = 0
+        self.language_id = None
+
+    def highlight_visible(self):
+        rect = self.view.get_visible_rect()
+        top, _ = self.view.get_line_at_y(rect.y)
+        bottom, _ = self.view.get_line_at_y(rect.y + rect.height)
+        for chunk in range(top.get_line() // CHUNK_LINES, bottom.get_line() // CHUNK_LINES + 1):
+            self._highlight_chunk(chunk)
+
+    def _highlight_in_background(self) -> bool:
+        buf = self.view.get_buffer()
+        chunks = buf.get_line_count() // CHUNK_LINES + 1
+        deadline = time.monotonic() + FRAME_BUDGET
+        while self._next_chunk < chunks:
+            self._highlight_chunk(self._next_chunk)
+            self._next_chunk += 1
+            if time.monotonic() >= deadline:
+                return True
+
+        log.debug('Finished highlighting %d lines', buf.get_line_count())
+        self._idle_source = None
+        return False
+
+    def _highlight_chunk(self, chunk: int):
+        if chunk in self._done or not self.language_id:
+            return
+        self._done.add(chunk)
+
+        buf = self.view.get_buffer()
+        first = chunk * CHUNK_LINES
+        if first >= buf.get_line_count():
+            return
+
+        start = buf.get_iter_at_line(first)
+        end = buf.get_iter_at_line(first + CHUNK_LINES)
+        if end.get_line() < first + CHUNK_LINES:
+            end = buf.get_end_iter()
+
+        offset = start.get_offset()
+        for line in buf.get_text(start, end, False).split('\n'):
+            for tok_start, tok_end, kind in tokenize(self.language_id, line):
+                buf.apply_tag(self._tags[kind], buf.get_iter_at_offset(offset + tok_start),
+                              buf.get_iter_at_offset(offset + tok_end))
+            offset += len(line) + 1
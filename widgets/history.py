@@ -0,0 +1,103 @@
+import logging
+import time
+from concurrent.futures import Future
+from datetime import timedelta
+from typing import Dict, List, Optional
+
+from gi.repository import Gtk, GLib
+
+from history import HISTORY, snapshot_request
+from models import HistoryEntry, RequestTreeNode
+from utils import sizeof_fmt, timedelta_fmt
+
+log = logging.getLogger(__name__)
+
+PAGE_SIZE = 50
+
+
+def format_history_entry(entry: HistoryEntry) -> str:
+    sent_at = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry.sent_at))
+    url = GLib.markup_escape_text(entry.url)
+    if entry.error:
+        outcome = f'<span foreground="red">{GLib.markup_escape_text(entry.error[:40])}</span>'
+    else:
+        color = 'green' if entry.status_code < 400 else 'red'
+        outcome = f'<span foreground="{color}">{entry.status_code}</span> {sizeof_fmt(entry.body_size)}'
+        if entry.timings:
+            outcome += f' {timedelta_fmt(timedelta(milliseconds=entry.timings["total"]))}'
+    return f'<b>{entry.method}</b> {url}\n<small>{sent_at} {outcome}</small>'
+
+
+@Gtk.Template.from_file('ui/History.glade')
+class History(Gtk.Box):
+    """Sent requests, newest first, loaded a page at a time as the list is scrolled."""
+    __gtype_name__ = 'History'
+
+    history_label: Gtk.Label = Gtk.Template.Child()
+    history_revealer: Gtk.Revealer = Gtk.Template.Child()
+    history_tree_view: Gtk.TreeView = Gtk.Template.Child()
+    history_store: Gtk.ListStore = Gtk.Template.Child()
+
+    def __init__(self, main_window):
+        super(History, self).__init__()
+        self.main_window = main_window
+        self._entries: Dict[int, HistoryEntry] = {}
+        self._last_pk: Optional[int] = None
+        self._loading = False
+        self._exhausted = False
+        self._generation = 0  # Bumped by reload, pages requested before it are dropped
+
+    @Gtk.Template.Callback()
+    def name_label_pressed(self, *args):
+        reveal = not self.history_revealer.get_reveal_child()
+        self.history_revealer.set_reveal_child(reveal)
+        if reveal:
+            self.reload()
+
+    @Gtk.Template.Callback('history_edge_reached')
+    def _history_edge_reached(self, win: Gtk.ScrolledWindow, pos: Gtk.PositionType):
+        if pos == Gtk.PositionType.BOTTOM:
+            self.load_next_page()
+
+    @Gtk.Template.Callback('history_row_activated')
+    def _history_row_activated(self, view: Gtk.TreeView, path: Gtk.TreePath, col: Gtk.TreeViewColumn):
+        entry = self._entries.get(self.history_store[path][1])
+        if entry:
+            self.main_window.open_request(RequestTreeNode(request=snapshot_request(entry.request)), True)
+
+    def reload(self):
+        self.history_store.clear()
+        self._entries.clear()
+        self._last_pk = None
+        self._exhausted = False
+        self._loading = False
+        self._generation += 1
+        self.load_next_page()
+
+    def load_next_page(self):
+        if self._loading or self._exhausted:
+            return
+
+        self._loading = True
+        generation = self._generation
+        HISTORY.flush()
+        HISTORY.get_entries(self._last_pk, PAGE_SIZE).add_done_callback(
+            lambda future: GLib.idle_add(self._handle_page_loaded, generation, future))
+
+    def _handle_page_loaded(self, generation: int, future: Future):
+        if generation != self._generation:
+            return  # Reloaded while the page was loading
+
+        self._loading = False
+        try:
+            entries: List[HistoryEntry] = future.result()
+        except Exception as e:
+            log.error('Failed to load history %s', e)
+            return
+
+        self._exhausted = len(entries) < PAGE_SIZE
+        for entry in entries:
+            self._entries[entry.pk] = entry
+            self.history_store.append([format_history_entry(entry), entry.pk])
+        if entries:
+            self._last_pk = entries[-1].pk
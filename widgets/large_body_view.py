@@ -0,0 +1,201 @@
+from typing import Optional, Tuple, List
+
+from gi.repository import Gtk, Gdk, GLib
+
+from line_index import LineIndex, read_window
+from pool import TPE
+from response_body import ResponseBody, BodyHold
+from utils import sizeof_fmt
+from widgets.find_bar import TextViewFindTarget
+
+# How much of the body is decoded and put in the text buffer at once.
+WINDOW_BYTES = 256 * 1024
+INDEX_POLL_INTERVAL_MS = 250
+
+
+class LargeBodyView(Gtk.Box):
+    """
+    Shows a large body a window at a time, read from its buffer, which is memory mapped once it's spilled.
+
+    Only the window is ever decoded or put in a text buffer, so opening a body takes the
+    same time and memory whatever its size. The scrollbar moves through the whole body by
+    byte offset, scrolling past either end of the window moves it. Line numbers and go to
+    line use a line index which is built in the background, and work once it reaches them.
+    It's a find bar target, see FindTarget, with matches given as byte offsets in the body.
+    """
+
+    def __init__(self):
+        super(LargeBodyView, self).__init__(orientation=Gtk.Orientation.VERTICAL, spacing=3)
+        self.body: Optional[ResponseBody] = None
+        self.encoding = 'utf-8'
+        self.index: Optional[LineIndex] = None
+        self.window: Tuple[int, int] = (0, 0)
+        self._poll_source: Optional[int] = None
+        self._moving = False
+        self.on_scrolled = None
+
+        toolbar = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=6)
+        self.position_label = Gtk.Label(xalign=0)
+        toolbar.pack_start(self.position_label, True, True, 0)
+        self.go_to_line_entry = Gtk.Entry(placeholder_text='Go to line', width_chars=12)
+        self.go_to_line_entry.connect('activate', self._on_go_to_line_activated)
+        toolbar.pack_start(self.go_to_line_entry, False, False, 0)
+        copy_button = Gtk.Button(label='Copy window')
+        copy_button.connect('clicked', self._on_copy_clicked)
+        toolbar.pack_start(copy_button, False, False, 0)
+        self.pack_start(toolbar, False, False, 0)
+
+        self.text_view = Gtk.TextView(editable=False, cursor_visible=False, monospace=True)
+        self.scrolled_window = Gtk.ScrolledWindow(hscrollbar_policy=Gtk.PolicyType.AUTOMATIC,
+                                                  vscrollbar_policy=Gtk.PolicyType.EXTERNAL)
+        self.scrolled_window.add(self.text_view)
+        self.scrolled_window.connect('edge-reached', self._on_edge_reached)
+
+        self.adjustment = Gtk.Adjustment(value=0, lower=0, upper=1, step_increment=4096,
+                                         page_increment=WINDOW_BYTES // 2, page_size=0)
+        self.adjustment.connect('value-changed', self._on_position_changed)
+        scrollbar = Gtk.Scrollbar(orientation=Gtk.Orientation.VERTICAL, adjustment=self.adjustment)
+
+        content = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL)
+        content.pack_start(self.scrolled_window, True, True, 0)
+        content.pack_start(scrollbar, False, False, 0)
+        self.pack_start(content, True, True, 0)
+        self._text_find_target = TextViewFindTarget(self.text_view)
+
+    def set_body(self, body: ResponseBody, encoding: Optional[str] = None):
+        self.clear()
+        self.body = body
+        self.encoding = encoding or 'utf-8'
+        self.index = LineIndex(body.getbuffer(), hold=BodyHold(body))
+        TPE.submit(self.index.build)
+        self._poll_source = GLib.timeout_add(INDEX_POLL_INTERVAL_MS, self._poll_index, self.index)
+
+        self._moving = True
+        self.adjustment.configure(0, 0, max(body.size, 1), 4096, WINDOW_BYTES // 2, 0)
+        self._moving = False
+        self.show_window(0)
+
+    def clear(self):
+        """Stops using the current body, it can be closed straight away, the index is released once it stops."""
+        if self.index:
+            self.index.cancel()
+            self.index = None
+        if self._poll_source:
+            GLib.source_remove(self._poll_source)
+            self._poll_source = None
+        self.body = None
+        self.window = (0, 0)
+        self.text_view.get_buffer().set_text('')
+        self.position_label.set_text('')
+
+    def show_window(self, offset: int, at_end: bool = False):
+        """Shows the lines around offset, scrolled to the end of the window instead of the start if at_end."""
+        if not self.body:
+            return
+
+        buf = self.body.getbuffer()
+        start, end = read_window(buf, offset, WINDOW_BYTES)
+        self.window = (start, end)
+        self.text_view.get_buffer().set_text(str(buf[start:end], self.encoding, errors='replace'))
+        self._update_position_label()
+
+        self._moving = True
+        self.adjustment.set_value(start)
+        self._moving = False
+
+        vadj = self.scrolled_window.get_vadjustment()
+        GLib.idle_add(lambda: vadj.set_value(vadj.get_upper() if at_end else 0) and False)
+        if self.on_scrolled:
+            self.on_scrolled()
+
+    def go_to_line(self, line: int) -> bool:
+        """Shows the 1 based line, False if it isn't indexed yet or doesn't exist."""
+        offset = self.index.offset_of_line(line - 1) if self.index else None
+        if offset is None:
+            return False
+        self.show_window(offset)
+        return True
+
+    def visible_range(self) -> Tuple[int, int]:
+        return self.window  # Matches anywhere in the window are close enough to be highlighted
+
+    def show_match(self, start: int, end: int):
+        window_start, window_end = self.window
+        if start < window_start or end > window_end:
+            self.show_window(start)
+        char_spans = self._char_spans([(start, end)])
+        if not char_spans:
+            return  # Runs past the end of the window
+        char_start, char_end = char_spans[0]
+        buf = self.text_view.get_buffer()
+        buf.select_range(buf.get_iter_at_offset(char_start), buf.get_iter_at_offset(char_end))
+        # After show_window's scroll back to the top of the window.
+        GLib.idle_add(lambda: self.text_view.scroll_to_mark(buf.get_insert(), 0.1, False, 0, 0.5) and False)
+
+    def highlight(self, spans: List[Tuple[int, int]], current: Optional[Tuple[int, int]]):
+        window_start, window_end = self.window
+        if current and (current[0] < window_start or current[1] > window_end):
+            current = None
+        self._text_find_target.highlight(self._char_spans(spans), self._char_spans([current])[0] if current else None)
+
+    def _char_spans(self, spans: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+        """Character offsets into the window's text of the sorted byte spans which are in it."""
+        buf = self.body.getbuffer() if self.body else b''
+        window_start, window_end = self.window
+        char_spans, pos, chars = [], window_start, 0
+        for start, end in spans:
+            if start < pos or end > window_end:
+                continue
+            chars += len(str(buf[pos:start], self.encoding, errors='replace'))
+            char_start = chars
+            chars += len(str(buf[start:end], self.encoding, errors='replace'))
+            char_spans.append((char_start, chars))
+            pos = end
+        return char_spans
+
+    def _update_position_label(self):
+        start, end = self.window
+        size = self.body.size
+        first = self.index.line_of_offset(start) if self.index else None
+        last = self.index.line_of_offset(max(end - 1, start)) if self.index else None
+        if first is not None and last is not None:
+            total = self.index.line_count if self.index.done.is_set() else f'{self.index.indexed_lines}+'
+            self.position_label.set_text(f'Lines {first + 1}–{last + 1} of {total}')
+        else:
+            self.position_label.set_text(
+                f'{sizeof_fmt(start)}–{sizeof_fmt(end)} of {sizeof_fmt(size)}, indexing lines…')
+
+    def _poll_index(self, index: LineIndex) -> bool:
+        if index is not self.index:
+            return False
+        self._update_position_label()
+        if index.done.is_set():
+            self._poll_source = None
+            return False
+        return True
+
+    def _on_position_changed(self, adj: Gtk.Adjustment):
+        if not self._moving:
+            self.show_window(int(adj.get_value()))
+
+    def _on_edge_reached(self, win: Gtk.ScrolledWindow, pos: Gtk.PositionType):
+        start, end = self.window
+        if pos == Gtk.PositionType.BOTTOM and self.body and end < self.body.size:
+            self.show_window(end)
+        elif pos == Gtk.PositionType.TOP and start > 0:
+            # Start the previous window on the first whole line which keeps it ending at this one.
+            prev_start = max(0, start - WINDOW_BYTES)
+            newline = self.body.getbuffer().find(b'\n', prev_start, start) if prev_start else -1
+            self.show_window(newline + 1 if newline >= 0 else prev_start, at_end=True)
+
+    def _on_go_to_line_activated(self, entry: Gtk.Entry):
+        text = entry.get_text().strip()
+        if text.isdigit() and self.go_to_line(int(text)):
+            entry.get_style_context().remove_class('error')
+        else:
+            entry.get_style_context().add_class('error')
+
+    def _on_copy_clicked(self, btn: Gtk.Button):
+        buf = self.text_view.get_buffer()
+        bounds = buf.get_selection_bounds() or buf.get_bounds()
+        Gtk.Clipboard.get(Gdk.SELECTION_CLIPBOARD).set_text(buf.get_text(*bounds, False), -1)
@@ -0,0 +1,22 @@
+from gi.repository import Gtk
+
+
+@Gtk.Template.from_file('ui/LoadTestPopover.glade')
+class LoadTestPopover(Gtk.Popover):
+    __gtype_name__ = 'LoadTestPopover'
+
+    requests_spin_button: Gtk.SpinButton = Gtk.Template.Child()
+    duration_spin_button: Gtk.SpinButton = Gtk.Template.Child()
+    concurrency_spin_button: Gtk.SpinButton = Gtk.Template.Child()
+
+    def __init__(self, request_editor):
+        super(LoadTestPopover, self).__init__()
+        self.request_editor = request_editor
+
+    @Gtk.Template.Callback('on_run_clicked')
+    def _on_run_clicked(self, btn: Gtk.Button):
+        self.popdown()
+        self.request_editor.start_load_test(
+            self.requests_spin_button.get_value_as_int() or None,
+            self.duration_spin_button.get_value() or None,
+            self.concurrency_spin_button.get_value_as_int())
@@ -3,11 +3,13 @@ import logging
 
 from gi.repository import Gtk, GLib
 
-from db import CollectionDAO, DB_EXECUTOR
+from db import CollectionDAO, DB_EXECUTOR, reads
 from models import MainModel, RequestTreeNode, RequestModel, CollectionModel
 from widgets.active_request_tab import ActiveRequestTab
 from widgets.request_editor import RequestEditor
 from widgets.collection import Collection
+from widgets.history import History
+from widgets.request_search import RequestSearch
 
 log = logging.getLogger(__name__)
 
@@ -82,16 +84,29 @@ class MainWindow(Gtk.Window):
         return self._get_current_active_tab().request_node
 
     def _add_blank_request(self, set_request=False):
-        new_node = RequestTreeNode(request=RequestModel(name='New Request'))
+        self.open_request(RequestTreeNode(request=RequestModel(name='New Request')), set_request)
+
+    def open_request(self, node: RequestTreeNode, set_request=False):
+        """Opens node in a new tab."""
         page = Gtk.DrawingArea()
-        new_tab = ActiveRequestTab(self, page, new_node)
+        new_tab = ActiveRequestTab(self, page, node)
         page_num = self.active_requests_notebook.append_page(page, new_tab)
         self.active_requests_notebook.show_all()
         if set_request:
-            self.request_editor.set_request(new_node)
+            self.request_editor.set_request(node)
 
         self.active_requests_notebook.set_current_page(page_num)
 
+    def open_saved_request(self, pk: str):
+        """Opens the request with pk from whichever collection it's in."""
+        for row in self.request_list.get_children():
+            widget = row.get_child()
+            node = widget.find_node(pk) if isinstance(widget, Collection) else None
+            if node:
+                widget.open_node(node)
+                return
+        log.warning('Request %s is not in any collection', pk)
+
     def close_tab(self, tab: ActiveRequestTab):
         self.active_requests_notebook.remove(tab.page)
         if not self.active_requests_notebook.get_n_pages():
@@ -101,6 +116,7 @@ class MainWindow(Gtk.Window):
         log.info('New request clicked')
         self._add_blank_request()
 
+    @reads
     def _do_load_collections(self):
         # TODO: Handle error
         try:
@@ -111,8 +127,10 @@ class MainWindow(Gtk.Window):
 
     def _handle_collections_loaded(self, collections: List[CollectionModel]):
         log.info('Successfully loaded collections from disk.')
+        self.request_list.add(RequestSearch(self))
         for col in collections:
             self.request_list.add(Collection(col))
+        self.request_list.add(History(self))
 
     def load_collections(self):
         log.info('Loading collections from disk.')
@@ -1,6 +1,6 @@
 from typing import List, Tuple
 
-from gi.repository import Gtk
+from gi.repository import Gtk, Pango
 
 
 @Gtk.Template.from_file('ui/ParamTable.glade')
@@ -16,15 +16,29 @@ class ParamTable(Gtk.TreeView):
 
     def __init__(self):
         super(ParamTable, self).__init__()
-        self.store = Gtk.ListStore(str, str, str)  # (key, value, description)
+        self.store = Gtk.ListStore(str, str, str, bool)  # (key, value, description, value is a file path)
         self.set_model(self.store)
+        self.value_column.set_cell_data_func(self.value_column_renderer, self._render_value)
         self.add_row()
 
     def add_row(self, row: Tuple[str, str, str] = None):
-        self.store.append(row or ('', '', ''))
+        self.store.append((*(row or ('', '', '')), False))
 
     def prepend_row(self, row: Tuple[str, str, str] = None):
-        self.store.prepend(row or ('', '', ''))
+        self.store.prepend((*(row or ('', '', '')), False))
+
+    def prepend_file_row(self, key: str, path: str):
+        """Adds a row whose value is the path of a file to send, rather than text."""
+        self.store.prepend((key, path, '', True))
+
+    def remove_file_rows(self):
+        for row in [row for row in self.store if row[3]]:
+            self.store.remove(row.iter)
+
+    @staticmethod
+    def _render_value(column: Gtk.TreeViewColumn, renderer: Gtk.CellRendererText, model: Gtk.TreeModel,
+                      it: Gtk.TreeIter, data=None):
+        renderer.set_property('style', Pango.Style.ITALIC if model[it][3] else Pango.Style.NORMAL)
 
     def prepend_or_update_row_by_key(self, row: Tuple[str, str, str]):
         key, val, desc = row
@@ -64,7 +78,11 @@ class ParamTable(Gtk.TreeView):
     def get_values(self) -> List[Tuple[str, str, str]]:
         return [(row[0], row[1], row[2]) for row in self.store if row[0]]
 
+    def get_fields(self) -> List[Tuple[str, str, bool]]:
+        """The (key, value, is_file) of each row, for tables which can hold files."""
+        return [(row[0], row[1], row[3]) for row in self.store if row[0]]
+
     def set_values(self, rows: List[Tuple[str, str, str]]):
         self.store.clear()
         for row in rows or [('', '', '')]:
-            self.store.append(row)
+            self.store.append((*row, False))
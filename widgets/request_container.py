@@ -1,11 +1,13 @@
 import logging
-from typing import Tuple, List, Dict
+import os
+from typing import Tuple, List, Dict, Optional
 
 from gi.repository import Gtk, GtkSource
 
 from models import RequestTreeNode
+from request_body import FilePart, MultipartForm
 from widgets.param_table import ParamTable
-from utils import language_map, content_type_map
+from utils import language_map, content_type_map, sizeof_fmt
 
 log = logging.getLogger(__name__)
 
@@ -29,7 +31,7 @@ class RequestContainer:
 
         self.request_type_notebook: Gtk.Notebook = builder.get_object('requestTypeNotebook')
         self.request_form_data = ParamTable()
-        self.request_type_notebook.insert_page(self.request_form_data, Gtk.Label('Form Data'), 2)
+        self.request_type_notebook.insert_page(self._create_form_data_page(), Gtk.Label('Form Data'), 2)
         self.request_form_urlencoded = ParamTable()
         self.request_type_notebook.insert_page(self.request_form_urlencoded, Gtk.Label('Form Url-Encoded'), 3)
 
@@ -37,6 +39,11 @@ class RequestContainer:
         self.request_type_popover_tree_view: Gtk.TreeView = builder.get_object('requestTypePopoverTreeView')
         self.request_type_popover_tree_view_store: Gtk.ListStore = builder.get_object('requestTypePopoverStore')
 
+        # Sent from disk as the body of binary requests, see _get_binary_data.
+        self.binary_file: Optional[str] = None
+        self.request_binary_file_label: Gtk.Label = builder.get_object('requestBinaryFileLabel')
+        builder.get_object('requestBinaryChooseButton').connect('clicked', self._on_binary_choose_clicked)
+
         self.param_table = ParamTable()
         self.request_header_table = ParamTable()
         self.request_notebook.insert_page(self.param_table, Gtk.Label(label='Params'), 0)
@@ -48,6 +55,47 @@ class RequestContainer:
         self.request_type_popover_tree_view.connect('row-activated', self._on_popover_row_activated)
         self.request_type_notebook.connect('switch-page', self._on_request_type_notebook_page_switched)
 
+    def _create_form_data_page(self) -> Gtk.Widget:
+        add_file_button = Gtk.Button(label='Add File')
+        add_file_button.set_tooltip_text('Adds a field sending a file, its value, in italics, is the path of the file')
+        add_file_button.connect('clicked', self._on_form_data_add_file_clicked)
+        buttons = Gtk.Box(spacing=3)
+        buttons.pack_start(add_file_button, False, True, 0)
+
+        page = Gtk.Box(orientation=Gtk.Orientation.VERTICAL)
+        page.pack_start(buttons, False, True, 3)
+        page.pack_start(self.request_form_data, True, True, 0)
+        page.show_all()
+        return page
+
+    def _choose_file(self, title: str) -> Optional[str]:
+        dialog = Gtk.FileChooserNative.new(title, self.request_notebook.get_toplevel(), Gtk.FileChooserAction.OPEN)
+        try:
+            if dialog.run() == Gtk.ResponseType.ACCEPT:
+                return dialog.get_filename()
+            return None
+        finally:
+            dialog.destroy()
+
+    def _on_binary_choose_clicked(self, btn: Gtk.Button):
+        path = self._choose_file('Choose a file to send')
+        if path:
+            self._set_binary_file(path)
+
+    def _set_binary_file(self, path: Optional[str]):
+        self.binary_file = path
+        if path:
+            self.request_binary_file_label.set_text(f'{os.path.basename(path)} ({sizeof_fmt(os.path.getsize(path))})')
+        else:
+            self.request_binary_file_label.set_text('No file chosen.')
+        self.request_binary_file_label.set_tooltip_text(path)
+
+    def _on_form_data_add_file_clicked(self, btn: Gtk.Button):
+        path = self._choose_file('Choose a file to add')
+        if path:
+            # Prepended, the last row is kept empty for typing new fields into.
+            self.request_form_data.prepend_file_row(os.path.basename(path), path)
+
     def _on_request_type_notebook_page_switched(self, notebook: Gtk.Notebook, page: Gtk.Widget, page_num: int):
         # Update the content type
         ct_func = {
@@ -105,20 +153,23 @@ class RequestContainer:
             4: self._get_binary_data
         }[page]()
 
-    def _get_form_data(self):
-        return [(k, v) for k, v, _, in self.request_form_data.get_values()]
+    def _get_form_data(self) -> MultipartForm:
+        return MultipartForm.from_values(self.request_form_data.get_fields())
 
     def _get_urlencoded_data(self):
         return [(k, v) for k, v, _, in self.request_form_urlencoded.get_values()]
 
-    def _get_binary_data(self):
-        raise NotImplemented
+    def _get_binary_data(self) -> Optional[FilePart]:
+        return FilePart(self.binary_file) if self.binary_file else None
 
     def set_request(self, node: RequestTreeNode):
         req = node.request
         self.request_text.get_buffer().set_text(req.request_body, -1)
         self.request_header_table.set_values(req.request_headers)
         self.param_table.set_values(req.params)
+        # The editor is shared by every request, files chosen for the previous one mustn't be sent with this one.
+        self._set_binary_file(None)
+        self.request_form_data.remove_file_rows()
 
     def get_request(self, node: RequestTreeNode):
         req = node.request
@@ -1,11 +1,20 @@
 import logging
-from typing import List, Tuple, Dict, Optional
+from typing import List, Tuple, Dict, Optional, Any
 
 import requests
 from gi.repository import Gtk, GLib
 
-from models import RequestTreeNode
-from pool import TPE
+from history import HISTORY, snapshot_request
+from http_cache import HTTP_CACHE
+from http_engine import HTTP_ENGINE, SEND_QUEUE, RequestHandle, RequestCancelled, SendQueueFull
+from load_test import LoadTest, LoadTestStats
+from models import RequestTreeNode, RequestModel
+from request_body import UploadProgress, UploadBody, FilePart, MultipartForm, prepare_upload
+from response_body import DownloadProgress
+from response_snapshot import ResponseSnapshot, build_response_snapshot
+from timings import RequestTimings
+from utils import format_request_url
+from widgets.load_test_popover import LoadTestPopover
 from widgets.request_container import RequestContainer
 from widgets.response_container import ResponseContainer
 
@@ -21,6 +30,9 @@ class RequestEditor(Gtk.Box):
     request_name_entry: Gtk.Entry = Gtk.Template.Child()
     url_entry: Gtk.Entry = Gtk.Template.Child()
     send_button: Gtk.Button = Gtk.Template.Child()
+    load_test_button: Gtk.MenuButton = Gtk.Template.Child()
+    cancel_button: Gtk.Button = Gtk.Template.Child()
+    cache_check_button: Gtk.CheckButton = Gtk.Template.Child()
     save_button: Gtk.Button = Gtk.Template.Child()
     request_response_stack_switcher: Gtk.StackSwitcher = Gtk.Template.Child()
     request_response_stack: Gtk.Stack = Gtk.Template.Child()
@@ -30,6 +42,8 @@ class RequestEditor(Gtk.Box):
 
         self.main_window = main_window
         self.active_request: Optional[RequestTreeNode] = None
+        self.active_handle: Optional[RequestHandle] = None
+        self.active_load_test: Optional[LoadTest] = None
         self.last_response: Optional[requests.Response] = None
 
         self.request_container = RequestContainer(self)
@@ -38,6 +52,9 @@ class RequestEditor(Gtk.Box):
         self.response_container = ResponseContainer(self)
         self.request_response_stack.add_titled(self.response_container, 'Response', 'Response')
 
+        self.load_test_popover = LoadTestPopover(self)
+        self.load_test_button.set_popover(self.load_test_popover)
+
     @Gtk.Template.Callback('on_request_name_changed')
     def _on_request_name_changed(self, entry: Gtk.Entry):
         self.active_request = self.get_request()
@@ -55,11 +72,15 @@ class RequestEditor(Gtk.Box):
         return node
 
     def set_request(self, node: RequestTreeNode):
+        if self.active_request is not node:
+            # The response pane is shared between tabs, don't let the previous tab's response land in it.
+            self.cancel_request()
         self.active_request = node
         req = node.request
         self.url_entry.set_text(req.url)
         self.set_method(req.method)
         self.request_name_entry.set_text(req.name)
+        self.cache_check_button.set_active(req.use_cache)
         self.request_container.set_request(node)
 
     def set_method(self, method: str):
@@ -71,45 +92,195 @@ class RequestEditor(Gtk.Box):
         idx = self.request_method_combo.get_active()
         return self.request_method_combo_store[idx][0]
 
+    @Gtk.Template.Callback('on_cache_toggled')
+    def _on_cache_toggled(self, btn: Gtk.CheckButton):
+        if self.active_request:
+            self.active_request.request.use_cache = btn.get_active()
+
     @Gtk.Template.Callback('on_save_pressed')
     def _on_save_pressed(self, btn):
         log.info('Save pressed')
 
-    @Gtk.Template.Callback('on_send_pressed')
-    def _on_send_pressed(self, btn):
+    def _get_send_args(self) -> Tuple[str, str, List[Tuple[str, str]], Dict[str, str], Any, Tuple[float, float]]:
         url = self._format_request_url()
         meth_idx = self.request_method_combo.get_active()
         meth = self.request_method_combo_store[meth_idx][0]
-
-        self.response_container.set_response_spinner_active(True)
-        self.request_response_stack.set_visible_child(self.response_container)
+        req = self.get_request().request
 
         params = self.request_container.get_params()
         headers = self.request_container.get_headers()
         body = self.request_container.get_body()
+        timeout = (req.connect_timeout, req.read_timeout)
+        return meth, url, params, headers, body, timeout
 
-        TPE.submit(self.do_request, meth, url, params, headers, body)
+    @Gtk.Template.Callback('on_send_pressed')
+    def _on_send_pressed(self, btn):
+        self.cancel_load_test()
+        meth, url, params, headers, body, timeout = self._get_send_args()
+        sent_request = snapshot_request(self.active_request.request)
+
+        try:
+            self.active_handle = SEND_QUEUE.submit(
+                self.active_request.pk,
+                lambda handle: self.do_request(handle, meth, url, params, headers, body, timeout, sent_request),
+                self.active_request.request.deadline)
+        except SendQueueFull as e:
+            log.warning('Rejected request to %s - %s: %s', meth, url, e)
+            self.response_container.handle_request_finished_exceptionally(e)
+            return
+
+        self.response_container.set_response_spinner_active(True)
+        self.request_response_stack.set_visible_child(self.response_container)
+        self.cancel_button.show()
         log.info('Creating request to %s - %s', meth, url)
 
-    def do_request(self, method: str, url: str, params: List[Tuple[str, str]], headers: Dict[str, str], data=None):
+    @Gtk.Template.Callback('on_cancel_pressed')
+    def _on_cancel_pressed(self, btn):
+        if self.active_load_test:
+            # Stop sending, the results so far are still reported when the workers finish.
+            self.active_load_test.cancel()
+            return
+
+        handle = self.cancel_request()
+        if handle:
+            self.response_container.handle_request_cancelled(handle.reason)
+
+    def cancel_request(self) -> Optional[RequestHandle]:
+        """Cancels the request or load test in flight, if any, its response will not be shown."""
+        self.cancel_load_test()
+        handle, self.active_handle = self.active_handle, None
+        self.cancel_button.hide()
+        if handle:
+            log.info('Cancelling request for %s', handle.key)
+            handle.cancel()
+        return handle
+
+    def cancel_load_test(self):
+        load_test, self.active_load_test = self.active_load_test, None
+        if load_test:
+            log.info('Cancelling load test of %s', load_test.url)
+            load_test.cancel()
+
+    def start_load_test(self, total_requests: Optional[int], duration: Optional[float], concurrency: int):
+        self.cancel_request()
+        meth, url, params, headers, body, timeout = self._get_send_args()
+        if isinstance(body, (FilePart, MultipartForm)):
+            # A streamed body can only be sent once, load tests send theirs many times over.
+            self.response_container.handle_request_finished_exceptionally(
+                ValueError('Load tests can\'t send files or multipart form data'))
+            return
+        if type(body) is str:
+            body = body.encode('utf-8')
+
+        try:
+            load_test = LoadTest(meth, url, total_requests, duration, concurrency,
+                                 lambda stats: GLib.idle_add(self.handle_load_test_progress, load_test, stats),
+                                 params=params, headers=headers, data=body, timeout=timeout)
+        except ValueError as e:
+            self.response_container.handle_request_finished_exceptionally(e)
+            return
+
+        self.active_load_test = load_test
+        self.response_container.set_response_spinner_active(True)
+        self.request_response_stack.set_visible_child(self.response_container)
+        self.cancel_button.show()
+        load_test.start()
+
+    def handle_load_test_progress(self, load_test: LoadTest, stats: LoadTestStats):
+        if load_test is not self.active_load_test:
+            return
+
+        self.response_container.update_load_test(stats)
+        if stats.done:
+            self.active_load_test = None
+            self.cancel_button.hide()
+
+    def do_request(self,
+                   handle: RequestHandle,
+                   method: str,
+                   url: str,
+                   params: List[Tuple[str, str]],
+                   headers: Dict[str, str],
+                   data=None,
+                   timeout: Tuple[float, float] = None,
+                   sent_request: RequestModel = None):
+        timings = RequestTimings()
         try:
-            if type(data) is str:
-                data = data.encode('utf-8')
+            # Files are streamed from disk as they're sent, rather than read into memory first.
+            data, headers = prepare_upload(
+                data, headers,
+                lambda progress: GLib.idle_add(self.handle_upload_progress, handle, progress),
+                handle.raise_if_cancelled)
 
-            res = requests.request(method, url, params=params, headers=headers, data=data)
-            # TODO: Load all the data into custom object before sending it back to UI thread
-            GLib.idle_add(self.handle_request_finished, res)
+            on_progress = lambda progress: GLib.idle_add(self.handle_download_progress, handle, progress)
+            cache_status = None
+            if sent_request and sent_request.use_cache:
+                res, body, cache_status = HTTP_CACHE.fetch(
+                    HTTP_ENGINE, method, url, handle, on_progress,
+                    timings, params=params, headers=headers, data=data, timeout=timeout)
+            else:
+                res, body = HTTP_ENGINE.fetch(
+                    method, url, handle, on_progress,
+                    timings, params=params, headers=headers, data=data, timeout=timeout)
+            if sent_request:
+                # Record it before handing the body to the ui, which closes it once it's replaced.
+                HISTORY.record(method, res.url, sent_request, res, body, timings)
+            snapshot = build_response_snapshot(res, body, cache_status)
+            GLib.idle_add(self.handle_request_finished, handle, snapshot, timings)
+        except RequestCancelled as e:
+            log.info('Request to %s cancelled: %s', url, e)
+            if sent_request:
+                HISTORY.record(method, url, sent_request, timings=timings, error=f'Cancelled: {e}')
+            GLib.idle_add(self.handle_request_cancelled, handle)
         except Exception as e:
             log.error('Error occurred while sending request %s', e)
-            GLib.idle_add(self.response_container.handle_request_finished_exceptionally, e)
+            if sent_request:
+                HISTORY.record(method, url, sent_request, timings=timings, error=str(e) or type(e).__name__)
+            GLib.idle_add(self.handle_request_failed, handle, e)
+        finally:
+            if isinstance(data, UploadBody):
+                data.close()
+
+    def _is_active(self, handle: RequestHandle) -> bool:
+        return handle is self.active_handle and not handle.cancelled
+
+    def handle_upload_progress(self, handle: RequestHandle, progress: UploadProgress):
+        if self._is_active(handle):
+            self.response_container.update_upload_progress(progress)
+
+    def handle_download_progress(self, handle: RequestHandle, progress: DownloadProgress):
+        if self._is_active(handle):
+            self.response_container.update_download_progress(progress)
+
+    def handle_request_finished(self,
+                                handle: RequestHandle,
+                                snapshot: ResponseSnapshot,
+                                timings: RequestTimings):
+        if not self._is_active(handle):
+            log.debug('Dropping stale response for %s', handle.key)
+            snapshot.body.close()
+            return
+
+        log.info('Got %s response from %s', snapshot.response.status_code, self.url_entry.get_text())
+        self.active_handle = None
+        self.cancel_button.hide()
+        self.last_response = snapshot.response
+        self.response_container.handle_request_finished(snapshot, timings)
+
+    def handle_request_cancelled(self, handle: RequestHandle):
+        # Cancelled by its deadline, cancellations from the ui are handled in cancel_request.
+        if handle is self.active_handle:
+            self.active_handle = None
+            self.cancel_button.hide()
+            self.response_container.handle_request_cancelled(handle.reason)
+
+    def handle_request_failed(self, handle: RequestHandle, ex: Exception):
+        if not self._is_active(handle):
+            return
 
-    def handle_request_finished(self, response: requests.Response):
-        log.info('Got %s response from %s', response.status_code, self.url_entry.get_text())
-        self.last_response = response
-        self.response_container.handle_request_finished(response)
+        self.active_handle = None
+        self.cancel_button.hide()
+        self.response_container.handle_request_finished_exceptionally(ex)
 
     def _format_request_url(self) -> str:
-        url = self.url_entry.get_text()
-        if not (url.startswith('http://') or url.startswith('https://')):
-            url = 'http://' + url
-        return url
+        return format_request_url(self.url_entry.get_text())
@@ -0,0 +1,67 @@
+import logging
+from concurrent.futures import Future
+from typing import List
+
+from gi.repository import Gtk, GLib
+
+from db import DB_EXECUTOR, RequestDAO, RequestMatch
+
+log = logging.getLogger(__name__)
+
+MAX_RESULTS = 50
+
+
+def format_request_match(match: RequestMatch) -> str:
+    path = GLib.markup_escape_text(' / '.join(match.path))
+    return f'<b>{match.method}</b> {GLib.markup_escape_text(match.name)}\n<small>{path}</small>'
+
+
+class RequestSearch(Gtk.Box):
+    """
+    Finds saved requests by their name, url, headers or body, as the query's typed.
+    Searched on a read connection through the full text index, results for a query that's since changed are dropped.
+    """
+
+    def __init__(self, main_window):
+        super(RequestSearch, self).__init__(orientation=Gtk.Orientation.VERTICAL, spacing=3)
+        self.main_window = main_window
+
+        self.entry = Gtk.SearchEntry(placeholder_text='Search requests')
+        self.entry.connect('search-changed', lambda entry: self.search())
+        self.pack_start(self.entry, False, False, 0)
+
+        self.store = Gtk.ListStore(str, str)  # Markup, pk
+        self.results_view = Gtk.TreeView(model=self.store, headers_visible=False, tooltip_column=0)
+        self.results_view.append_column(Gtk.TreeViewColumn('Request', Gtk.CellRendererText(), markup=0))
+        self.results_view.connect('row-activated', self._on_row_activated)
+        self.results_revealer = Gtk.Revealer()
+        self.results_revealer.add(self.results_view)
+        self.pack_start(self.results_revealer, False, False, 0)
+
+    def search(self):
+        text = self.entry.get_text().strip()
+        if not text:
+            self.store.clear()
+            self.results_revealer.set_reveal_child(False)
+            return
+
+        DB_EXECUTOR.submit(RequestDAO().search, text, MAX_RESULTS).add_done_callback(
+            lambda future: GLib.idle_add(self._handle_results, text, future))
+
+    def _handle_results(self, text: str, future: Future):
+        if text != self.entry.get_text().strip():
+            return
+
+        try:
+            matches: List[RequestMatch] = future.result()
+        except Exception as e:
+            log.error('Failed to search requests %s', e)
+            return
+
+        self.store.clear()
+        for match in matches:
+            self.store.append([format_request_match(match), match.pk])
+        self.results_revealer.set_reveal_child(True)
+
+    def _on_row_activated(self, view: Gtk.TreeView, path: Gtk.TreePath, col: Gtk.TreeViewColumn):
+        self.main_window.open_saved_request(self.store[path][1])
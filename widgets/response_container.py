@@ -1,14 +1,23 @@
-import json
 import logging
-from io import StringIO
-from typing import Optional
+from datetime import timedelta
+from typing import Optional, Dict, Callable, Union
 
-import jsonpath_rw
 import requests
-from gi.repository import Gtk, GtkSource, WebKit2
-from lxml import etree, html
-
-from utils import get_content_type, timedelta_fmt, format_response_size, get_language_for_mime_type
+from gi.repository import Gtk, Gdk, GLib, GtkSource
+
+from load_test import LoadTestStats
+from request_body import UploadProgress
+from response_body import ResponseBody, DownloadProgress
+from response_filter import FilterRunner, ResponseDocument, StreamingJsonDocument, FilterResult, \
+    FILTERABLE_CONTENT_TYPES
+from response_search import ResponseSearch
+from response_snapshot import ResponseSnapshot
+from timings import RequestTimings, PHASE_LABELS
+from utils import get_content_type, timedelta_fmt, sizeof_fmt
+from widgets.find_bar import FindBar, FindTarget, TextViewFindTarget
+from widgets.highlighter import IncrementalHighlighter
+from widgets.large_body_view import LargeBodyView
+from widgets.timing_waterfall import TimingWaterfall
 
 log = logging.getLogger(__name__)
 
@@ -18,6 +27,7 @@ class ResponseContainer(Gtk.Overlay):
     __gtype_name__ = 'ResponseContainer'
 
     response_notebook: Gtk.Notebook = Gtk.Template.Child()
+    response_body_notebook: Gtk.Notebook = Gtk.Template.Child()
     response_text: GtkSource.View = Gtk.Template.Child()
     response_text_raw: Gtk.TextView = Gtk.Template.Child()
     response_loading_spinner: Gtk.Spinner = Gtk.Template.Child()
@@ -37,80 +47,139 @@ class ResponseContainer(Gtk.Overlay):
         super(ResponseContainer, self).__init__()
 
         self.last_response: Optional[requests.Response] = None
+        self.last_body: Optional[ResponseBody] = None
+        self.last_snapshot: Optional[ResponseSnapshot] = None
+        self.last_response_text = ''
+        self.displayed_text = ''  # What the pretty view shows, the formatted or filtered response
+        self.response_document: Optional[Union[ResponseDocument, StreamingJsonDocument]] = None
+        self.filter_runner = FilterRunner(
+            lambda expr, result, error: GLib.idle_add(self._handle_filter_result, expr, result, error))
         self.lang_manager = GtkSource.LanguageManager()
 
         style_manager = GtkSource.StyleSchemeManager()
         # scheme: GtkSource.StyleScheme = mgr.get_scheme('classic')
         scheme: GtkSource.StyleScheme = style_manager.get_scheme('kate')
         self.response_text.get_buffer().set_style_scheme(scheme)
-
-        # TODO: Lazy load the web view
-        self.response_webview: WebKit2.WebView = WebKit2.WebView() \
-            .new_with_context(WebKit2.WebContext().new_ephemeral())
-        self.response_webview_scroll_window.add(self.response_webview)
+        # Styles json, xml and html a chunk at a time instead of GtkSource highlighting the whole buffer at once.
+        self.highlighter = IncrementalHighlighter(self.response_text)
+
+        # Created with its web context the first time an html response is previewed, see _get_webview.
+        self.response_webview = None
+
+        self.timing_waterfall = TimingWaterfall()
+        self.response_notebook.append_page(self.timing_waterfall, Gtk.Label(label='Timing'))
+        self.timing_waterfall.show_all()
+
+        # Replaces the pretty and raw pages for responses too large to put in a text buffer.
+        self.large_body_view = LargeBodyView()
+        self.response_body_notebook.append_page(self.large_body_view, Gtk.Label(label='Body'))
+        self.large_body_view.show_all()
+        self.large_body_view.hide()
+
+        # Searches whichever body page is shown, searches are kept per view until its text changes.
+        self.find_bar = FindBar()
+        self.response_notebook.get_parent().pack_end(self.find_bar, False, True, 0)
+        self.find_bar.show_all()
+        self.text_find_targets = {
+            view: TextViewFindTarget(view) for view in (self.response_text, self.response_text_raw)
+        }
+        self._searches: Dict[FindTarget, ResponseSearch] = {}
+        self.response_body_notebook.connect('switch-page', lambda nb, page, num: self._update_find_target(page))
+        self.connect('key-press-event', self._on_key_press)
 
     @Gtk.Template.Callback('on_response_filter_changed')
     def _on_response_filter_changed(self, entry: Gtk.SearchEntry):
         filter_text = entry.get_text()
         if filter_text == '':
+            self.filter_runner.cancel()
+            entry.get_style_context().remove_class('error')
             self._set_response_text()
+            return
 
         ct = get_content_type(self.last_response)
-        try:
-            if ct == 'application/json':
-                path_expr = jsonpath_rw.parse(filter_text)
-                j = self.last_response.json()
-                match_text = json.dumps([match.value for match in path_expr.find(j)], indent=4) or 'No matches found'
-                self.response_text.get_buffer().set_text(match_text)
-            elif ct in {'text/xml', 'application/xml'}:
-                root = etree.fromstring(self.last_response.text)
-                matches = root.xpath(filter_text)
-                matches_root = etree.Element('matches')
-                for m in matches:
-                    matches_root.append(m)
-
-                matches_html = etree.tostring(matches_root, encoding='unicode', pretty_print=True)
-                self.response_text.get_buffer().set_text(matches_html)
-            elif ct == 'text/html':
-                root = html.fromstring(self.last_response.text)
-                matches = root.xpath(filter_text)
-                matches_root = etree.Element('matches')
-                for m in matches:
-                    matches_root.append(m)
-
-                matches_html = etree.tostring(matches_root, encoding='unicode', pretty_print=True)
-                self.response_text.get_buffer().set_text(matches_html)
-            else:
-                log.warning('Got unexpected content type %s when filtering response.', ct)
-        except Exception as e:
-            log.debug('Failed to filter response json %s', e)
-
-    def _get_formatted_response_text(self):
-        response = self.last_response
-        ct = get_content_type(response)
-        txt = response.text
-        try:
-            if ct == 'application/json':
-                j = response.json()
-                txt = json.dumps(j, indent=2)
-            elif ct in {'text/xml', 'application/xml'}:
-                root = etree.fromstring(response.text)
-                txt = etree.tostring(root, encoding='unicode', pretty_print=True)
-            elif ct == 'text/html':  # TODO: Add css path filters
-                root = html.fromstring(response.text)
-                txt = etree.tostring(root, encoding='unicode', pretty_print=True)
-            elif not response.text:
-                txt = 'Empty Response'
-        except Exception as e:
-            log.warning('Failed to parse %s response: %s', ct, e)
-            txt = 'Failed to parse response.'
-
-        return txt
+        if self.response_document and ct in FILTERABLE_CONTENT_TYPES:
+            # Evaluated off the main loop once typing pauses, see _handle_filter_result.
+            self.filter_runner.submit(self.response_document, filter_text)
+            return
+
+        log.warning('Got unexpected content type %s when filtering response.', ct)
+
+    def _handle_filter_result(self, expr: str, result: Optional[FilterResult], error: Optional[Exception]):
+        entry = self.response_filter_search_entry
+        if expr != entry.get_text():
+            return
+
+        if error:
+            log.debug('Failed to filter response %s', error)
+            entry.get_style_context().add_class('error')
+            return
+
+        entry.get_style_context().remove_class('error')
+        # Large bodies aren't highlighted, but what's filtered out of them is small enough to be.
+        large_json = isinstance(self.response_document, StreamingJsonDocument)
+        self._set_highlighted_text(result.text, 'json' if large_json else self.last_snapshot.language_id)
 
     def _set_response_text(self):
-        txt = self._get_formatted_response_text()
-        self._highlight_syntax(txt)
-        self.response_text.get_buffer().set_text(txt)
+        if not self.last_snapshot:
+            return
+        if self.last_snapshot.large:
+            # Only shown for large json, which can still be filtered, see _show_large_body_view.
+            self._set_plain_text('This response is too large to format, it is shown in the Body tab.\n'
+                                 'Filter it with the response filter, from the context menu.')
+            return
+        self._set_highlighted_text(self.last_snapshot.formatted_text, self.last_snapshot.language_id)
+
+    def _set_highlighted_text(self, text: str, lang_id: str):
+        self.highlighter.stop()
+        self._highlight_syntax(lang_id)
+        self.response_text.get_buffer().set_text(text)
+        if IncrementalHighlighter.supports(lang_id):
+            self.highlighter.highlight(lang_id)
+        self._displayed_text_changed(text)
+
+    def _set_plain_text(self, text: str):
+        """Shows text which isn't the response in the pretty view, e.g. an error."""
+        self.highlighter.stop()
+        self.response_text.get_buffer().set_text(text)
+        self._displayed_text_changed(text)
+
+    def _displayed_text_changed(self, text: str):
+        self.displayed_text = text
+        self._searches.pop(self.text_find_targets[self.response_text], None)
+        self._update_find_target()
+
+    def _get_search(self, target: FindTarget, create: Callable[[], ResponseSearch]) -> ResponseSearch:
+        if target not in self._searches:
+            self._searches[target] = create()
+        return self._searches[target]
+
+    def _update_find_target(self, page: Gtk.Widget = None):
+        """Points the find bar at the body page being shown, or the one being switched to."""
+        notebook = self.response_body_notebook
+        page = page or notebook.get_nth_page(notebook.get_current_page())
+        target, search = None, None
+        if page is self.large_body_view:
+            if self.large_body_view.body:
+                body, encoding = self.large_body_view.body, self.large_body_view.encoding
+                target = self.large_body_view
+                search = self._get_search(target, lambda: ResponseSearch(body.getbuffer(), encoding, body=body))
+        elif self.response_text.is_ancestor(page):
+            target = self.text_find_targets[self.response_text]
+            search = self._get_search(target, lambda: ResponseSearch(self.displayed_text))
+        elif self.response_text_raw.is_ancestor(page):
+            target = self.text_find_targets[self.response_text_raw]
+            search = self._get_search(target, lambda: ResponseSearch(self.last_response_text))
+
+        if target is not self.find_bar.target or search is not self.find_bar.search:
+            self.find_bar.set_target(search, target)
+
+    def _on_key_press(self, widget: Gtk.Widget, event: Gdk.EventKey) -> bool:
+        if event.state & Gdk.ModifierType.CONTROL_MASK and event.keyval in (Gdk.KEY_f, Gdk.KEY_F):
+            self.response_notebook.set_current_page(1)  # Body page
+            self._update_find_target()
+            self.find_bar.open()
+            return True
+        return False
 
     @Gtk.Template.Callback('populate_response_text_context_menu')
     def _populate_response_text_context_menu(self, view: Gtk.TextView, popup: Gtk.Widget):
@@ -124,7 +193,7 @@ class ResponseContainer(Gtk.Overlay):
         menu.append(word_wrap_toggle)
 
         ct = get_content_type(self.last_response)
-        if self.last_response and ct in {'application/json', 'text/html', 'text/xml', 'application/xml'}:
+        if self.response_document and ct in FILTERABLE_CONTENT_TYPES:
             show_filter_toggle: Gtk.MenuItem = Gtk.MenuItem().new_with_label('Show response filter')
             show_filter_toggle.connect('activate', self._show_filter_toggle_clicked)
             menu.append(show_filter_toggle)
@@ -143,63 +212,172 @@ class ResponseContainer(Gtk.Overlay):
             self.response_loading_spinner.stop()
             self.reorder_overlay(self.response_loading_spinner, 0)
 
+    def update_upload_progress(self, progress: UploadProgress):
+        sent = f'{sizeof_fmt(progress.sent)} / {sizeof_fmt(progress.total)}'
+        if not progress.done:
+            sent = f'{sent} ({sizeof_fmt(progress.rate)}/s)'
+        self.response_size_label.set_text(f'Sent: {sent}')
+
+    def update_download_progress(self, progress: DownloadProgress):
+        received = sizeof_fmt(progress.received)
+        if progress.total:
+            received = f'{received} / {sizeof_fmt(progress.total)}'
+        if not progress.done:
+            received = f'{received} ({sizeof_fmt(progress.rate)}/s)'
+        self.response_size_label.set_text(f'Size: {received}')
+
     def update_webview(self, response: requests.Response):
         """Loads the webview, or show error message if webkit unavailable."""
-        ct = get_content_type(response)
+        ct = self.last_snapshot.content_type
         if not (response.request.method == 'GET' and response.ok and ct == 'text/html'):
             # self.response_webview.try_close()
             return
 
-        # TODO: Enable running of javascript
-        self.response_webview.load_html(response.text)
+        webview = self._get_webview()
+        if webview:
+            # TODO: Enable running of javascript
+            webview.load_html(self.last_response_text)
+
+    def _get_webview(self):
+        """The preview's web view, False if webkit is unavailable."""
+        if self.response_webview is None:
+            try:
+                from gi.repository import WebKit2
+                self.response_webview = WebKit2.WebView() \
+                    .new_with_context(WebKit2.WebContext().new_ephemeral())
+            except (ImportError, ValueError) as e:
+                log.warning('WebKit is unavailable, html responses won\'t be previewed: %s', e)
+                self.response_webview = False
+                self.response_webview_scroll_window.add(
+                    Gtk.Label(label='Install WebKit2GTK to preview html responses.'))
+            else:
+                self.response_webview_scroll_window.add(self.response_webview)
+            self.response_webview_scroll_window.show_all()
+
+        return self.response_webview
 
     def _word_wrap_toggle_clicked(self, btn):
         current = self.response_text.get_wrap_mode()
         new = Gtk.WrapMode.NONE if current != Gtk.WrapMode.NONE else Gtk.WrapMode.WORD
         self.response_text.set_wrap_mode(new)
 
-    def handle_request_finished(self, response: requests.Response):
+    def handle_request_finished(self, snapshot: ResponseSnapshot, timings: RequestTimings):
+        """Shows a response, everything which can be is precomputed in the snapshot, off the main loop."""
+        response = snapshot.response
         log.info('Got %s response from %s', response.status_code, response.url)
-        self.last_response = response
         try:
-            status_markup = f'{response.status_code} {response.reason}'
-            if not response.ok:
-                status_markup = f'<span foreground="red">{status_markup}</span>'
-
-            self.response_status_label.set_markup(f'Status: {status_markup}')
-            self.response_time_label.set_text(f'Time: {timedelta_fmt(response.elapsed)}')
-            self.response_size_label.set_text(f'Size: {format_response_size(response)}')
+            # Stop using the previous response's body. Workers still indexing, searching or filtering
+            # it hold it open, it's closed once they've stopped.
+            self.find_bar.set_target(None, None)
+            for search in self._searches.values():
+                search.cancel()
+            self._searches.clear()
+            self.large_body_view.clear()
+            self.filter_runner.cancel()
+            if isinstance(self.response_document, StreamingJsonDocument):
+                self.response_document.close()
+            if self.last_body is not None:
+                self.last_body.close()
+
+            self.response_document = self._create_response_document(snapshot)
+            self.last_snapshot = snapshot
+            self.last_response = response
+            self.last_body = snapshot.body
+            self.last_response_text = snapshot.text
+            self.response_status_label.set_markup(f'Status: {snapshot.status_markup}')
+            self.response_size_label.set_text(f'Size: {sizeof_fmt(snapshot.size)}')
 
             # Write headers
-            headers_markup = '\n'.join([f'<b>{k}</b> → {v}' for k, v in response.headers.items()])
             buf: Gtk.TextBuffer = self.response_headers_text.get_buffer()
             start, end = buf.get_bounds()
             buf.delete(start, end)
-            buf.insert_markup(buf.get_start_iter(), headers_markup, -1)
+            buf.insert_markup(buf.get_start_iter(), snapshot.headers_markup, -1)
 
-            self._set_response_text()
-            self.update_webview(response)
-            self.response_text_raw.get_buffer().set_text(response.text)
+            self._show_large_body_view(snapshot.large)
+            if snapshot.large:
+                self.large_body_view.set_body(snapshot.body, response.encoding)
+                if self.response_document:
+                    self._set_response_text()
+            else:
+                self._set_response_text()
+                self.update_webview(response)
+                self.response_text_raw.get_buffer().set_text(self.last_response_text)
+            self._update_find_target()
             self.response_notebook.set_current_page(1)  # Body page
+
+            # Covers handing the response to the main loop, decoding, formatting and highlighting it.
+            timings.mark('process')
+            self._set_timings(timings)
         finally:
             self.set_response_spinner_active(False)
 
-    def _highlight_syntax(self, txt: str):
-        lang_id = get_language_for_mime_type(get_content_type(self.last_response))
+    @staticmethod
+    def _create_response_document(snapshot: ResponseSnapshot):
+        if not snapshot.large:
+            return ResponseDocument(snapshot.content_type, snapshot.text)
+        if snapshot.content_type == StreamingJsonDocument.content_type:
+            # Too large to parse, but json can still be filtered by scanning the body.
+            return StreamingJsonDocument(snapshot.body.getbuffer(), snapshot.body)
+        return None
+
+    def _show_large_body_view(self, show: bool):
+        if show:
+            # Drop the previous response's text, the buffers hold onto it otherwise.
+            self._set_plain_text('')
+            self.response_text_raw.get_buffer().set_text('')
+        self.large_body_view.set_visible(show)
+        for page_num in range(self.response_body_notebook.get_n_pages()):
+            page = self.response_body_notebook.get_nth_page(page_num)
+            if page is self.large_body_view:
+                continue
+            # The pretty page stays for large json, it shows what the response filter finds.
+            keep = show and self.response_document is not None and self.response_text.is_ancestor(page)
+            page.set_visible(not show or keep)
+        if show:
+            self.response_body_notebook.set_current_page(self.response_body_notebook.page_num(self.large_body_view))
+
+    def _set_timings(self, timings: RequestTimings):
+        self.response_time_label.set_text(f'Time: {timedelta_fmt(timedelta(seconds=timings.total))}')
+        self.response_time_label.set_tooltip_text('\n'.join(
+            f'{PHASE_LABELS[phase]}: {timedelta_fmt(timedelta(seconds=duration))}'
+            for phase, _, duration in timings.waterfall()))
+        self.timing_waterfall.set_timings(timings)
+
+    def _highlight_syntax(self, lang_id: str):
         buf: GtkSource.Buffer = self.response_text.get_buffer()
-        if lang_id == 'html':
-            lang_id = 'xml'  # Full HTML highlighting is very slow; it freezes the UI.
-
-        # Disable highlighting for files with really long lines
-        if any((True for line in StringIO(txt) if len(line) > 5000)):
-            lang_id = 'text'
-
+        if IncrementalHighlighter.supports(lang_id):
+            buf.set_language(None)  # Styled by the incremental highlighter instead
+            return
         lang = self.lang_manager.get_language(lang_id)
         current_lang: GtkSource.Language = buf.get_language()
         if not current_lang or current_lang.get_id() != lang_id:
             buf.set_language(lang)
 
+    def update_load_test(self, stats: LoadTestStats):
+        status_markup = f'{stats.completed} requests, {stats.errors} errors'
+        if stats.errors:
+            status_markup = f'<span foreground="red">{status_markup}</span>'
+
+        self.response_status_label.set_markup(f'Load test: {status_markup}')
+        self.response_time_label.set_text(f'Time: {stats.format_latencies()}')
+        self.response_time_label.set_tooltip_text(None)
+        self.timing_waterfall.set_timings(None)
+        self.response_size_label.set_text(f'Throughput: {stats.throughput:.1f} req/s')
+
+        buf: GtkSource.Buffer = self.response_text.get_buffer()
+        buf.set_language(self.lang_manager.get_language('text'))
+        self._set_plain_text(stats.format_report())
+
+        if stats.done:
+            self.set_response_spinner_active(False)
+            self.response_notebook.set_current_page(1)  # Body page
+
+    def handle_request_cancelled(self, reason: str):
+        self.set_response_spinner_active(False)
+        self._set_plain_text(reason)
+        self.response_notebook.set_current_page(1)  # Body page
+
     def handle_request_finished_exceptionally(self, ex: Exception):
         self.set_response_spinner_active(False)
-        self.response_text.get_buffer().set_text(f'Error occurred while performing request: {ex}')
+        self._set_plain_text(f'Error occurred while performing request: {ex}')
         self.response_notebook.set_current_page(1)  # Body page
@@ -0,0 +1,78 @@
+import json
+from datetime import timedelta
+from typing import Optional
+
+from gi.repository import Gtk, Gdk
+
+from timings import RequestTimings, PHASE_LABELS
+from utils import timedelta_fmt
+
+ROW_HEIGHT = 24
+PADDING = 8
+LABEL_WIDTH = 140
+VALUE_WIDTH = 80
+
+PHASE_COLORS = {
+    'queueing': (0.80, 0.80, 0.80),
+    'dns': (0.40, 0.70, 0.40),
+    'connect': (0.95, 0.60, 0.20),
+    'tls': (0.70, 0.40, 0.80),
+    'send': (0.85, 0.45, 0.45),
+    'ttfb': (0.30, 0.60, 0.90),
+    'download': (0.20, 0.75, 0.75),
+    'process': (0.60, 0.60, 0.60),
+}
+
+
+class TimingWaterfall(Gtk.Box):
+    """Shows how long each phase of a request took, as bars offset by when they started."""
+
+    def __init__(self):
+        super(TimingWaterfall, self).__init__(orientation=Gtk.Orientation.VERTICAL, spacing=3)
+        self.timings: Optional[RequestTimings] = None
+
+        self.drawing_area = Gtk.DrawingArea()
+        self.drawing_area.connect('draw', self._on_draw)
+        self.pack_start(self.drawing_area, False, False, 0)
+
+        self.copy_button = Gtk.Button(label='Copy as JSON')
+        self.copy_button.set_halign(Gtk.Align.START)
+        self.copy_button.set_sensitive(False)
+        self.copy_button.connect('clicked', self._on_copy_clicked)
+        self.pack_start(self.copy_button, False, False, PADDING)
+
+    def set_timings(self, timings: Optional[RequestTimings]):
+        self.timings = timings
+        rows = len(timings.waterfall()) if timings else 0
+        self.drawing_area.set_size_request(-1, rows * ROW_HEIGHT + 2 * PADDING)
+        self.copy_button.set_sensitive(timings is not None)
+        self.drawing_area.queue_draw()
+
+    def _on_draw(self, area: Gtk.DrawingArea, cr):
+        if not self.timings:
+            return False
+
+        total = self.timings.total or 1.0
+        bar_width = max(area.get_allocated_width() - LABEL_WIDTH - VALUE_WIDTH - 2 * PADDING, 1)
+        fg: Gdk.RGBA = area.get_style_context().get_color(Gtk.StateFlags.NORMAL)
+
+        for idx, (phase, offset, duration) in enumerate(self.timings.waterfall()):
+            y = PADDING + idx * ROW_HEIGHT
+            text_y = y + ROW_HEIGHT * 0.65
+
+            cr.set_source_rgba(fg.red, fg.green, fg.blue, fg.alpha)
+            cr.move_to(PADDING, text_y)
+            cr.show_text(PHASE_LABELS[phase])
+            cr.move_to(PADDING + LABEL_WIDTH + bar_width + PADDING, text_y)
+            cr.show_text(timedelta_fmt(timedelta(seconds=duration)))
+
+            cr.set_source_rgb(*PHASE_COLORS[phase])
+            cr.rectangle(PADDING + LABEL_WIDTH + offset / total * bar_width, y + 4,
+                         max(duration / total * bar_width, 1), ROW_HEIGHT - 8)
+            cr.fill()
+
+        return False
+
+    def _on_copy_clicked(self, btn: Gtk.Button):
+        clipboard = Gtk.Clipboard.get(Gdk.SELECTION_CLIPBOARD)
+        clipboard.set_text(json.dumps(self.timings.to_dict(), indent=2), -1)